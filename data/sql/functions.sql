@@ -58,11 +58,12 @@ DROP FUNCTION stoq_create_language_plpgsql();
 -- Enable unaccent extension
 CREATE EXTENSION IF NOT EXISTS unaccent;
 
+-- This is a sql function instead of a plpgsql one since it is a lot cheaper
+-- to call. It is used by expression indexes (see patch-05-46.sql), so the
+-- dictionary is qualified to not depend on the search_path.
 CREATE OR REPLACE FUNCTION stoq_normalize_string(input_string text) RETURNS text AS $$
-BEGIN
-  return LOWER(unaccent(input_string));
-END;
-$$ LANGUAGE plpgsql IMMUTABLE;
+    SELECT LOWER(public.unaccent('public.unaccent'::regdictionary, $1));
+$$ LANGUAGE sql IMMUTABLE STRICT;
 
 -- Returns a default te_id for the domain tables
 CREATE OR REPLACE FUNCTION new_te() RETURNS integer AS $$
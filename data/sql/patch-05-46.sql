@@ -0,0 +1,29 @@
+-- Trigram indexes for the text columns searched by the search dialogs
+-- (see TRIGRAM_INDEXED_COLUMNS on stoqlib/database/queryexecuter.py).
+-- StringQueryState searches are done using
+-- stoq_normalize_string(column) ILIKE '%word%', so the indexes need to be
+-- on that same expression for the planner to use them. We use gin instead
+-- of gist since those columns are searched a lot more than they are written.
+
+-- stoq_normalize_string was changed to a sql function (see functions.sql),
+-- rebuild the index that depends on it
+REINDEX INDEX sellable_description_normalized_idx;
+
+CREATE INDEX person_name_normalized_trgm_idx ON person
+    USING gin (stoq_normalize_string(name) gin_trgm_ops);
+CREATE INDEX individual_cpf_normalized_trgm_idx ON individual
+    USING gin (stoq_normalize_string(cpf) gin_trgm_ops);
+CREATE INDEX company_cnpj_normalized_trgm_idx ON company
+    USING gin (stoq_normalize_string(cnpj) gin_trgm_ops);
+CREATE INDEX company_fancy_name_normalized_trgm_idx ON company
+    USING gin (stoq_normalize_string(fancy_name) gin_trgm_ops);
+CREATE INDEX sellable_code_normalized_trgm_idx ON sellable
+    USING gin (stoq_normalize_string(code) gin_trgm_ops);
+CREATE INDEX sellable_barcode_normalized_trgm_idx ON sellable
+    USING gin (stoq_normalize_string(barcode) gin_trgm_ops);
+CREATE INDEX sellable_category_description_normalized_trgm_idx ON sellable_category
+    USING gin (stoq_normalize_string(description) gin_trgm_ops);
+CREATE INDEX work_order_description_normalized_trgm_idx ON work_order
+    USING gin (stoq_normalize_string(description) gin_trgm_ops);
+CREATE INDEX payment_description_normalized_trgm_idx ON payment
+    USING gin (stoq_normalize_string(description) gin_trgm_ops);
@@ -0,0 +1,106 @@
+-- The stock of each storable on each branch. The stock views used to sum
+-- product_stock_item (one row for each batch) on every search, now they
+-- use this table, which is kept by a trigger on product_stock_item.
+-- rebuild_product_stock_summary() can be used to rebuild it in full.
+
+CREATE TABLE product_stock_summary (
+    storable_id uuid NOT NULL REFERENCES storable(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    branch_id uuid NOT NULL REFERENCES branch(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    stock numeric(20, 3) NOT NULL DEFAULT 0,
+    -- No scale here to keep the sum of quantity * stock_cost exact
+    total_stock_cost numeric NOT NULL DEFAULT 0,
+    PRIMARY KEY (storable_id, branch_id)
+);
+
+CREATE INDEX product_stock_summary_branch_id_idx
+    ON product_stock_summary (branch_id);
+
+
+CREATE OR REPLACE FUNCTION add_product_stock_summary(
+    storable_id_ uuid, branch_id_ uuid, stock_ numeric,
+    total_stock_cost_ numeric) RETURNS void AS $$
+BEGIN
+    LOOP
+        UPDATE product_stock_summary SET
+                stock = stock + stock_,
+                total_stock_cost = total_stock_cost + total_stock_cost_
+            WHERE storable_id = storable_id_ AND branch_id = branch_id_;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+
+        BEGIN
+            INSERT INTO product_stock_summary
+                    (storable_id, branch_id, stock, total_stock_cost)
+                VALUES
+                    (storable_id_, branch_id_, stock_, total_stock_cost_);
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Another transaction inserted the row first, update it instead
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION update_product_stock_summary() RETURNS trigger AS $$
+BEGIN
+    -- OLD and NEW cannot be used on the same expression as TG_OP, since
+    -- they are not assigned on INSERT and DELETE respectively
+    IF TG_OP = 'UPDATE' THEN
+        IF (NEW.quantity IS NOT DISTINCT FROM OLD.quantity AND
+            NEW.stock_cost IS NOT DISTINCT FROM OLD.stock_cost AND
+            NEW.storable_id IS NOT DISTINCT FROM OLD.storable_id AND
+            NEW.branch_id = OLD.branch_id) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.storable_id IS NOT NULL THEN
+            PERFORM add_product_stock_summary(
+                OLD.storable_id, OLD.branch_id,
+                -COALESCE(OLD.quantity, 0),
+                -COALESCE(OLD.quantity * OLD.stock_cost, 0));
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF NEW.storable_id IS NOT NULL THEN
+            PERFORM add_product_stock_summary(
+                NEW.storable_id, NEW.branch_id,
+                COALESCE(NEW.quantity, 0),
+                COALESCE(NEW.quantity * NEW.stock_cost, 0));
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_product_stock_summary_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON product_stock_item
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_product_stock_summary();
+
+
+CREATE OR REPLACE FUNCTION rebuild_product_stock_summary() RETURNS void AS $$
+BEGIN
+    -- Block the stock changes until the summary is rebuilt
+    LOCK TABLE product_stock_item IN SHARE MODE;
+
+    DELETE FROM product_stock_summary;
+    INSERT INTO product_stock_summary
+            (storable_id, branch_id, stock, total_stock_cost)
+        SELECT storable_id, branch_id,
+               COALESCE(SUM(quantity), 0),
+               COALESCE(SUM(quantity * stock_cost), 0)
+            FROM product_stock_item
+            WHERE storable_id IS NOT NULL
+            GROUP BY storable_id, branch_id;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_product_stock_summary();
@@ -0,0 +1,112 @@
+-- Stop creating a temporary table for each stock_transaction_history row.
+-- upsert_stock_item() used to create __inserting_sth to tell
+-- validate_stock_item() that the product_stock_item write was done by it,
+-- which means catalog writes (and pg_class bloat) for every transaction.
+-- Now it uses a transaction local setting, that is reverted together with
+-- the (sub)transaction if anything goes wrong.
+
+CREATE OR REPLACE FUNCTION validate_stock_item() RETURNS trigger AS $$
+DECLARE
+    inserting_ text;
+    errmsg text;
+BEGIN
+    -- Only allow updates that are not touching quantity/stock_cost
+    IF (TG_OP = 'UPDATE' AND
+        NEW.quantity = OLD.quantity AND
+        NEW.stock_cost = OLD.stock_cost) THEN
+        RETURN NEW;
+    END IF;
+
+    BEGIN
+        inserting_ := current_setting('stoq.inserting_sth');
+    EXCEPTION WHEN undefined_object THEN
+        -- Never set on this session
+        inserting_ := NULL;
+    END;
+
+    IF inserting_ IS DISTINCT FROM 'on' THEN
+        -- Postgresql will give us a syntaxerror if we try to break
+        -- the string in the RAISE EXCEPTION statement
+        errmsg := ('product_stock_item should not be inserted or have its ' ||
+                   'quantity/stock_cost columns updated manually. ' ||
+                   'To do that, insert a row on stock_transaction_history');
+        RAISE EXCEPTION '%', errmsg;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION upsert_stock_item() RETURNS trigger AS $$
+DECLARE
+    stock_cost_ numeric(20, 8);
+    psi product_stock_item%ROWTYPE;
+BEGIN
+    IF NEW.batch_id IS NOT NULL THEN
+        SELECT * INTO psi FROM product_stock_item
+            WHERE branch_id = NEW.branch_id AND
+                  batch_id = NEW.batch_id AND
+                  storable_id = NEW.storable_id;
+    ELSE
+        SELECT * INTO psi FROM product_stock_item
+            WHERE branch_id = NEW.branch_id AND
+                  storable_id = NEW.storable_id;
+    END IF;
+
+    IF FOUND THEN
+        IF NEW.type = 'manual-adjust' THEN
+            -- Manual adjusts will not alter the quantity of the stock item.
+            -- They are used only to adjust any divergence between the sum of the
+            -- transactions quantities and the actual quantity on the stock item.
+            IF NEW.unit_cost IS NULL THEN
+                RAISE EXCEPTION 'unit_cost cannot be NULL on manual-adjust transactions';
+            END IF;
+            NEW.stock_cost := NEW.unit_cost;
+            RETURN NEW;
+        ELSIF NEW.quantity > 0 AND NEW.unit_cost IS NOT NULL THEN
+            -- Only update the cost if increasing the stock and the new unit_cost is provided
+            -- Removing an item from stock does not change the stock cost.
+            stock_cost_ := (((psi.quantity * psi.stock_cost) + (NEW.quantity * NEW.unit_cost)) /
+                            (psi.quantity + NEW.quantity));
+        ELSIF NEW.type = 'update-stock-cost' THEN
+            IF NEW.quantity != 0 THEN
+                RAISE EXCEPTION 'quantity need to be 0 for update-stock-cost transactions';
+            END IF;
+            stock_cost_ := NEW.unit_cost;
+        ELSE
+            stock_cost_ := psi.stock_cost;
+        END IF;
+
+        NEW.stock_cost := stock_cost_;
+        PERFORM set_config('stoq.inserting_sth', 'on', true);
+        UPDATE product_stock_item SET
+                quantity = quantity + NEW.quantity,
+                stock_cost = stock_cost_
+            WHERE id = psi.id;
+        PERFORM set_config('stoq.inserting_sth', 'off', true);
+    ELSE
+        -- Make sure that update-stock-cost only happens for existing
+        -- product_stock_items
+        IF NEW.type IN ('manual-adjust', 'update-stock-cost') THEN
+            RAISE EXCEPTION 'Cannot adjust stock/cost of non-existing product_stock_item';
+        END IF;
+
+        -- In this case, this is the first transaction history for this
+        -- stock item. There's no stock_cost calculation to do as it will be
+        -- equal to the unit_cost itself
+        PERFORM set_config('stoq.inserting_sth', 'on', true);
+        INSERT INTO product_stock_item
+                (storable_id, batch_id, branch_id,
+                 stock_cost, quantity)
+            VALUES
+                (NEW.storable_id, NEW.batch_id, NEW.branch_id,
+                 COALESCE(NEW.unit_cost, 0), NEW.quantity)
+            RETURNING * INTO psi;
+        PERFORM set_config('stoq.inserting_sth', 'off', true);
+        NEW.stock_cost := psi.stock_cost;
+    END IF;
+
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
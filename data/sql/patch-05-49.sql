@@ -0,0 +1,188 @@
+-- The credit balances of each person paying for something. Client's
+-- credit_account_balance and remaining_store_credit used to sum all the
+-- client payments on every read (e.g. on each checkout), now they read this
+-- table, which is kept by triggers on payment and payment_group.
+-- rebuild_client_credit_ledger() can be used to rebuild it.
+
+CREATE TABLE client_credit_ledger (
+    person_id uuid PRIMARY KEY REFERENCES person(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    -- The paid credit payments, out ones giving credit to the client
+    -- and in ones using it
+    credit_balance numeric(20, 2) NOT NULL DEFAULT 0,
+    -- The pending and confirmed in store_credit payments
+    store_credit_debit numeric(20, 2) NOT NULL DEFAULT 0
+);
+
+
+CREATE OR REPLACE FUNCTION add_client_credit_ledger(
+    person_id_ uuid, credit_balance_ numeric, store_credit_debit_ numeric)
+    RETURNS void AS $$
+BEGIN
+    IF credit_balance_ = 0 AND store_credit_debit_ = 0 THEN
+        RETURN;
+    END IF;
+
+    LOOP
+        UPDATE client_credit_ledger SET
+                credit_balance = credit_balance + credit_balance_,
+                store_credit_debit = store_credit_debit + store_credit_debit_
+            WHERE person_id = person_id_;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+
+        BEGIN
+            INSERT INTO client_credit_ledger
+                    (person_id, credit_balance, store_credit_debit)
+                VALUES
+                    (person_id_, credit_balance_, store_credit_debit_);
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Another transaction inserted the row first, update it instead
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds (or subtracts, when sign_ is -1) what the payment means to the
+-- credit balances of its payer
+CREATE OR REPLACE FUNCTION add_payment_to_client_credit_ledger(
+    payment_ payment, sign_ integer) RETURNS void AS $$
+DECLARE
+    method_name_ text;
+    payer_id_ uuid;
+    credit_balance_ numeric := 0;
+    store_credit_debit_ numeric := 0;
+BEGIN
+    IF payment_.group_id IS NULL THEN
+        RETURN;
+    END IF;
+
+    SELECT method_name INTO method_name_
+        FROM payment_method WHERE id = payment_.method_id;
+
+    IF method_name_ = 'credit' AND payment_.status = 'paid' THEN
+        IF payment_.payment_type = 'out' THEN
+            credit_balance_ := COALESCE(payment_.paid_value, 0);
+        ELSE
+            credit_balance_ := -COALESCE(payment_.paid_value, 0);
+        END IF;
+    ELSIF (method_name_ = 'store_credit' AND
+           payment_.payment_type = 'in' AND
+           payment_.status IN ('pending', 'confirmed')) THEN
+        store_credit_debit_ := COALESCE(payment_.value, 0);
+    ELSE
+        RETURN;
+    END IF;
+
+    SELECT payer_id INTO payer_id_
+        FROM payment_group WHERE id = payment_.group_id;
+    IF payer_id_ IS NOT NULL THEN
+        PERFORM add_client_credit_ledger(
+            payer_id_, sign_ * credit_balance_, sign_ * store_credit_debit_);
+    END IF;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION update_client_credit_ledger() RETURNS trigger AS $$
+BEGIN
+    -- OLD and NEW cannot be used on the same expression as TG_OP, since
+    -- they are not assigned on INSERT and DELETE respectively
+    IF TG_OP = 'UPDATE' THEN
+        IF (NEW.status = OLD.status AND
+            NEW.payment_type = OLD.payment_type AND
+            NEW.value IS NOT DISTINCT FROM OLD.value AND
+            NEW.paid_value IS NOT DISTINCT FROM OLD.paid_value AND
+            NEW.method_id = OLD.method_id AND
+            NEW.group_id IS NOT DISTINCT FROM OLD.group_id) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM add_payment_to_client_credit_ledger(OLD, -1);
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM add_payment_to_client_credit_ledger(NEW, 1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_client_credit_ledger_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON payment
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_client_credit_ledger();
+
+
+-- Rebuilds the ledger of the given person, or of everyone if NULL
+CREATE OR REPLACE FUNCTION rebuild_client_credit_ledger(
+    person_id_ uuid DEFAULT NULL) RETURNS void AS $$
+BEGIN
+    IF person_id_ IS NULL THEN
+        -- Block the payment changes until the ledger is rebuilt
+        LOCK TABLE payment IN SHARE MODE;
+        DELETE FROM client_credit_ledger;
+    ELSE
+        DELETE FROM client_credit_ledger WHERE person_id = person_id_;
+    END IF;
+
+    INSERT INTO client_credit_ledger
+            (person_id, credit_balance, store_credit_debit)
+        SELECT payment_group.payer_id,
+               COALESCE(SUM(
+                   CASE WHEN (payment_method.method_name = 'credit' AND
+                              payment.status = 'paid')
+                        THEN CASE WHEN payment.payment_type = 'out'
+                                  THEN payment.paid_value
+                                  ELSE -payment.paid_value END
+                        END), 0),
+               COALESCE(SUM(
+                   CASE WHEN (payment_method.method_name = 'store_credit' AND
+                              payment.payment_type = 'in' AND
+                              payment.status IN ('pending', 'confirmed'))
+                        THEN payment.value
+                        END), 0)
+            FROM payment
+            JOIN payment_group ON payment_group.id = payment.group_id
+            JOIN payment_method ON payment_method.id = payment.method_id
+            WHERE payment_group.payer_id IS NOT NULL AND
+                  (person_id_ IS NULL OR
+                   payment_group.payer_id = person_id_) AND
+                  payment_method.method_name IN ('credit', 'store_credit')
+            GROUP BY payment_group.payer_id;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Changing the payer of a group moves all its payments to the new payer
+CREATE OR REPLACE FUNCTION update_client_credit_ledger_payer()
+    RETURNS trigger AS $$
+BEGIN
+    IF NEW.payer_id IS NOT DISTINCT FROM OLD.payer_id THEN
+        RETURN NULL;
+    END IF;
+
+    IF OLD.payer_id IS NOT NULL THEN
+        PERFORM rebuild_client_credit_ledger(OLD.payer_id);
+    END IF;
+    IF NEW.payer_id IS NOT NULL THEN
+        PERFORM rebuild_client_credit_ledger(NEW.payer_id);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_client_credit_ledger_payer_trigger
+    AFTER UPDATE ON payment_group
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_client_credit_ledger_payer();
+
+
+SELECT rebuild_client_credit_ledger();
@@ -0,0 +1,115 @@
+-- The balance of each account on each day. Account.get_total_for_interval
+-- used to sum account_transaction by Date(date) (which can't use an index)
+-- for each account of the financial tree, now it sums this table, which
+-- is kept by a trigger on account_transaction.
+-- rebuild_account_balance_daily() can be used to rebuild it in full.
+
+CREATE TABLE account_balance_daily (
+    account_id uuid NOT NULL REFERENCES account(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    date date NOT NULL,
+    -- The value of the transactions to the account minus the ones
+    -- from it, in this day
+    value numeric(20, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (account_id, date)
+);
+
+
+CREATE OR REPLACE FUNCTION add_account_balance_daily(
+    account_id_ uuid, date_ date, value_ numeric) RETURNS void AS $$
+BEGIN
+    LOOP
+        UPDATE account_balance_daily SET value = value + value_
+            WHERE account_id = account_id_ AND date = date_;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+
+        BEGIN
+            INSERT INTO account_balance_daily (account_id, date, value)
+                VALUES (account_id_, date_, value_);
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Another transaction inserted the row first, update it instead
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Adds (or subtracts, when sign_ is -1) the transaction to the balances
+-- of its accounts. Transactions from an account to itself don't count.
+CREATE OR REPLACE FUNCTION add_transaction_to_account_balance_daily(
+    transaction_ account_transaction, sign_ integer) RETURNS void AS $$
+BEGIN
+    IF (transaction_.date IS NULL OR
+        transaction_.account_id IS NULL OR
+        transaction_.source_account_id IS NULL OR
+        transaction_.account_id = transaction_.source_account_id OR
+        COALESCE(transaction_.value, 0) = 0) THEN
+        RETURN;
+    END IF;
+
+    PERFORM add_account_balance_daily(
+        transaction_.account_id, transaction_.date::date,
+        sign_ * transaction_.value);
+    PERFORM add_account_balance_daily(
+        transaction_.source_account_id, transaction_.date::date,
+        -sign_ * transaction_.value);
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION update_account_balance_daily() RETURNS trigger AS $$
+BEGIN
+    -- OLD and NEW cannot be used on the same expression as TG_OP, since
+    -- they are not assigned on INSERT and DELETE respectively
+    IF TG_OP = 'UPDATE' THEN
+        IF (NEW.value IS NOT DISTINCT FROM OLD.value AND
+            NEW.date IS NOT DISTINCT FROM OLD.date AND
+            NEW.account_id IS NOT DISTINCT FROM OLD.account_id AND
+            NEW.source_account_id IS NOT DISTINCT FROM
+                OLD.source_account_id) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM add_transaction_to_account_balance_daily(OLD, -1);
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM add_transaction_to_account_balance_daily(NEW, 1);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_account_balance_daily_trigger
+    AFTER INSERT OR UPDATE OR DELETE ON account_transaction
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_account_balance_daily();
+
+
+CREATE OR REPLACE FUNCTION rebuild_account_balance_daily() RETURNS void AS $$
+BEGIN
+    -- Block the transaction changes until the balances are rebuilt
+    LOCK TABLE account_transaction IN SHARE MODE;
+
+    DELETE FROM account_balance_daily;
+    INSERT INTO account_balance_daily (account_id, date, value)
+        SELECT account_id, date, SUM(value)
+            FROM (SELECT account_id, date::date AS date, value
+                      FROM account_transaction
+                      WHERE account_id <> source_account_id
+                  UNION ALL
+                  SELECT source_account_id, date::date, -value
+                      FROM account_transaction
+                      WHERE account_id <> source_account_id) AS t
+            WHERE date IS NOT NULL AND value IS NOT NULL
+            GROUP BY account_id, date;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT rebuild_account_balance_daily();
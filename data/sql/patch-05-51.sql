@@ -0,0 +1,199 @@
+-- Counters for the invoice numbers and the max values of some text columns
+-- (e.g. the sellable code, used to suggest the next one). Those used to be
+-- a MAX() over the whole table every time, now they are kept by triggers.
+-- The counters only grow, a number or code is never suggested again, even
+-- if the row using it is removed.
+
+--
+-- Invoice numbers, by branch, series and mode
+--
+
+CREATE TABLE invoice_number_counter (
+    branch_id uuid NOT NULL REFERENCES branch(id)
+        ON UPDATE CASCADE ON DELETE CASCADE,
+    series integer,
+    mode text,
+    last_number integer NOT NULL DEFAULT 0
+);
+
+-- series and mode may be NULL, just like on invoice
+CREATE UNIQUE INDEX invoice_number_counter_key
+    ON invoice_number_counter (branch_id, COALESCE(series, -1),
+                               COALESCE(mode, ''));
+
+
+CREATE OR REPLACE FUNCTION add_invoice_number_counter(
+    branch_id_ uuid, series_ integer, mode_ text, number_ integer)
+    RETURNS void AS $$
+BEGIN
+    LOOP
+        UPDATE invoice_number_counter SET
+                last_number = GREATEST(last_number, number_)
+            WHERE branch_id = branch_id_ AND
+                  COALESCE(series, -1) = COALESCE(series_, -1) AND
+                  COALESCE(mode, '') = COALESCE(mode_, '');
+        IF FOUND THEN
+            RETURN;
+        END IF;
+
+        BEGIN
+            INSERT INTO invoice_number_counter
+                    (branch_id, series, mode, last_number)
+                VALUES (branch_id_, series_, mode_, number_);
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Another transaction inserted the row first, update it instead
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- Returns the last invoice number, locking the counter until the end of
+-- the transaction, so other stations will wait for the invoice using the
+-- next number to be committed before getting their own
+CREATE OR REPLACE FUNCTION lock_invoice_number_counter(
+    branch_id_ uuid, series_ integer, mode_ text) RETURNS integer AS $$
+DECLARE
+    last_number_ integer;
+BEGIN
+    PERFORM add_invoice_number_counter(branch_id_, series_, mode_, 0);
+    SELECT last_number INTO last_number_ FROM invoice_number_counter
+        WHERE branch_id = branch_id_ AND
+              COALESCE(series, -1) = COALESCE(series_, -1) AND
+              COALESCE(mode, '') = COALESCE(mode_, '')
+        FOR UPDATE;
+    RETURN last_number_;
+END;
+$$ LANGUAGE plpgsql;
+
+
+CREATE OR REPLACE FUNCTION update_invoice_number_counter()
+    RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' THEN
+        IF (NEW.invoice_number IS NOT DISTINCT FROM OLD.invoice_number AND
+            NEW.branch_id IS NOT DISTINCT FROM OLD.branch_id AND
+            NEW.series IS NOT DISTINCT FROM OLD.series AND
+            NEW.mode IS NOT DISTINCT FROM OLD.mode) THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    IF NEW.invoice_number IS NOT NULL AND NEW.branch_id IS NOT NULL THEN
+        PERFORM add_invoice_number_counter(
+            NEW.branch_id, NEW.series, NEW.mode::text, NEW.invoice_number);
+    END IF;
+
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_invoice_number_counter_trigger
+    AFTER INSERT OR UPDATE ON invoice
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_invoice_number_counter();
+
+INSERT INTO invoice_number_counter (branch_id, series, mode, last_number)
+    SELECT branch_id, series, mode::text, MAX(invoice_number)
+        FROM invoice
+        WHERE branch_id IS NOT NULL AND invoice_number IS NOT NULL
+        GROUP BY branch_id, series, mode;
+
+
+--
+-- Max values of text columns
+--
+
+CREATE TABLE max_value_counter (
+    -- <table>.<column>
+    name text PRIMARY KEY,
+    max_value text,
+    -- The length of the longest value, the max value is returned
+    -- padded with zeros to it
+    max_length integer NOT NULL DEFAULT 0
+);
+
+
+-- The values are compared padded with zeros to the same length,
+-- so '10' is greater than '9'
+CREATE OR REPLACE FUNCTION add_max_value_counter(name_ text, value_ text)
+    RETURNS void AS $$
+BEGIN
+    IF value_ IS NULL OR value_ = '' THEN
+        RETURN;
+    END IF;
+
+    LOOP
+        UPDATE max_value_counter SET
+                max_value = CASE
+                    WHEN (max_value IS NULL OR
+                          lpad(value_, GREATEST(char_length(value_),
+                                                char_length(max_value)), '0') >
+                          lpad(max_value, GREATEST(char_length(value_),
+                                                   char_length(max_value)), '0'))
+                    THEN value_
+                    ELSE max_value END,
+                max_length = GREATEST(max_length, char_length(value_))
+            WHERE name = name_;
+        IF FOUND THEN
+            RETURN;
+        END IF;
+
+        BEGIN
+            INSERT INTO max_value_counter (name, max_value, max_length)
+                VALUES (name_, value_, char_length(value_));
+            RETURN;
+        EXCEPTION WHEN unique_violation THEN
+            -- Another transaction inserted the row first, update it instead
+        END;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+
+-- TG_ARGV: the name of the counter, the column and optionally a delimiter,
+-- to count only the first part of the values (like split_part())
+CREATE OR REPLACE FUNCTION update_max_value_counter() RETURNS trigger AS $$
+DECLARE
+    value_ text;
+BEGIN
+    EXECUTE 'SELECT ($1).' || quote_ident(TG_ARGV[1]) INTO value_ USING NEW;
+    IF TG_NARGS > 2 THEN
+        value_ := split_part(value_, TG_ARGV[2], 1);
+    END IF;
+
+    PERFORM add_max_value_counter(TG_ARGV[0], value_);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER update_max_value_counter_trigger
+    AFTER INSERT OR UPDATE OF code ON sellable
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_max_value_counter('sellable.code', 'code');
+
+CREATE TRIGGER update_max_value_counter_trigger
+    AFTER INSERT OR UPDATE OF batch_number ON storable_batch
+    FOR EACH ROW
+    EXECUTE PROCEDURE update_max_value_counter(
+        'storable_batch.batch_number', 'batch_number', '-');
+
+INSERT INTO max_value_counter (name, max_value, max_length)
+    SELECT 'sellable.code', MAX(lpad(code, max_length, '0')), max_length
+        FROM sellable,
+             (SELECT MAX(char_length(code)) AS max_length
+                  FROM sellable) AS l
+        WHERE code <> ''
+        GROUP BY max_length;
+
+INSERT INTO max_value_counter (name, max_value, max_length)
+    SELECT 'storable_batch.batch_number',
+           MAX(lpad(split_part(batch_number, '-', 1), max_length, '0')),
+           max_length
+        FROM storable_batch,
+             (SELECT MAX(char_length(split_part(batch_number, '-', 1)))
+                  AS max_length
+                  FROM storable_batch) AS l
+        WHERE split_part(batch_number, '-', 1) <> ''
+        GROUP BY max_length;
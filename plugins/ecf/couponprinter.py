@@ -444,7 +444,7 @@ class Coupon(object):
 
     def close(self, sale):
         sale_items = sale.get_items()
-        ibpt_msg = generate_ibpt_message(sale_items)
+        ibpt_msg = generate_ibpt_message(sale_items, branch=sale.branch)
         parts = [ibpt_msg,
                  _(u'Salesperson: %s') % sale.get_salesperson_name(),
                  _('Stoq Retail Management')]
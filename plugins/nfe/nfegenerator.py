@@ -219,7 +219,8 @@ class NFeGenerator(object):
 
         invoice = self._order.invoice
         if not invoice.invoice_number:
-            invoice.invoice_number = Invoice.get_next_invoice_number(self.store)
+            invoice.invoice_number = Invoice.get_next_invoice_number(
+                self.store, lock=True)
         nnf = invoice.invoice_number
         assert nnf
 
@@ -392,7 +393,8 @@ class NFeGenerator(object):
             self._nfe_data.append(dup)
 
     def _add_additional_information(self, operation_items):
-        fisco_info = generate_ibpt_message(operation_items)
+        fisco_info = generate_ibpt_message(operation_items,
+                                           branch=self._order.branch)
         fisco_info += sysparam.get_string('NFE_FISCO_INFORMATION')
         comments = self._order.comments
         # The SEFAZ software, do not accepts '\n' in the additional information field.
@@ -479,6 +479,21 @@ class StoqCommandHandler:
         from stoqlib.lib.sintegragenerator import generate
         generate(filename, start, end)
 
+    def cmd_rebuild_summaries(self, options):
+        """Rebuild the stock, client credit and account balance summaries"""
+        self._read_config(options, register_station=False)
+
+        from stoqlib.database.runtime import new_store
+        from stoqlib.domain.account import AccountBalanceDaily
+        from stoqlib.domain.person import ClientCreditLedger
+        from stoqlib.domain.product import ProductStockSummary
+        with new_store() as store:
+            for summary in [ProductStockSummary, ClientCreditLedger,
+                            AccountBalanceDaily]:
+                print('Rebuilding %s...' % (summary.__storm_table__, ))
+                summary.rebuild(store)
+            store.retval = not options.dry
+
     def cmd_shell(self, options):
         """Drop to a shell for executing SQL queries"""
         self._read_config(options, register_station=False,
@@ -497,7 +512,9 @@ class StoqCommandHandler:
         from stoqlib.importers import importer
         importer = importer.get_by_type(options.type)
         importer.feed_file(options.import_filename)
-        importer.process()
+        if options.items_per_commit:
+            importer.set_items_per_commit(options.items_per_commit)
+        importer.process(bulk=options.bulk)
 
     def opt_import(self, parser, group):
         group.add_option('-t', '--type',
@@ -508,6 +525,16 @@ class StoqCommandHandler:
                          action="store",
                          help="Filename to import",
                          dest="import_filename")
+        group.add_option('', '--bulk',
+                         action="store_true",
+                         default=False,
+                         help="Use multi-row inserts, skipping domain hooks",
+                         dest="bulk")
+        group.add_option('', '--items-per-commit',
+                         action="store",
+                         type="int",
+                         help="Number of items imported per transaction",
+                         dest="items_per_commit")
 
     def cmd_console(self, options):
         """Drop to a Stoq python console"""
@@ -34,14 +34,12 @@ from kiwi.datatypes import converter, ValidationError
 from kiwi.python import Settable
 from kiwi.ui.objectlist import Column
 from kiwi.ui.widgets.contextmenu import ContextMenu, ContextMenuItem
-from storm.expr import And, Lower
 
 from stoqdrivers.enum import UnitType
 from stoqlib.api import api
 from stoqlib.domain.devices import DeviceSettings
 from stoqlib.domain.payment.group import PaymentGroup
 from stoqlib.domain.person import Transporter
-from stoqlib.domain.product import StorableBatch
 from stoqlib.domain.sale import Sale, Delivery
 from stoqlib.domain.sellable import Sellable
 from stoqlib.drivers.scale import read_scale_info
@@ -57,6 +55,7 @@ from stoqlib.lib.formatters import (format_sellable_description,
 from stoqlib.lib.message import warning, info, yesno, marker
 from stoqlib.lib.parameters import sysparam
 from stoqlib.lib.pluginmanager import get_plugin_manager
+from stoqlib.lib.sellablelookup import SellableLookupIndex
 from stoqlib.lib.translation import stoqlib_gettext as _
 from stoqlib.gui.base.dialogs import push_fullscreen, pop_fullscreen
 from stoqlib.gui.base.gtkadds import button_set_image_with_label
@@ -165,6 +164,7 @@ class PosApp(ShellApp):
         # CONFIRM_SALES_ON_TILL doesnt create a coupon
         self._sale_started = False
         self._scale_settings = DeviceSettings.get_scale_settings(self.store)
+        self._sellable_index = SellableLookupIndex(self.store)
 
     #
     # Application
@@ -274,6 +274,11 @@ class PosApp(ShellApp):
 
         CloseLoanWizardFinishEvent.connect(self._on_CloseLoanWizardFinishEvent)
 
+        # Load the barcodes/codes/batch numbers so scanning a product
+        # does not need to query the database
+        self._sellable_index.preload()
+        self._sellable_index.connect()
+
     def deactivate(self):
         api.user_settings.set('pos-show-details-viewer',
                               self.DetailsViewer.get_active())
@@ -288,6 +293,7 @@ class PosApp(ShellApp):
         # disconnect, the callback from this instance would still be called, but
         # its no longer valid.
         CloseLoanWizardFinishEvent.disconnect(self._on_CloseLoanWizardFinishEvent)
+        self._sellable_index.disconnect()
 
     def setup_focus(self):
         self.barcode.grab_focus()
@@ -543,31 +549,8 @@ class PosApp(ShellApp):
             text = barinfo.code
             weight = barinfo.weight
 
-        batch = None
-        query = Sellable.status == Sellable.STATUS_AVAILABLE
-
-        # FIXME: Put this logic for getting the sellable based on
-        # barcode/code/batch_number on domain. Note that something very
-        # simular is done on abstractwizard.py
-
-        sellable = self.store.find(
-            Sellable, And(query, Lower(Sellable.barcode) == text.lower())).one()
-
-        # If the barcode didnt match, maybe the user typed the product code
-        if not sellable:
-            sellable = self.store.find(
-                Sellable, And(query, Lower(Sellable.code) == text.lower())).one()
-
-        # If none of the above found, try to get the batch number
-        if not sellable:
-            query = Lower(StorableBatch.batch_number) == text.lower()
-            batch = self.store.find(StorableBatch, query).one()
-            if batch:
-                sellable = batch.storable.product.sellable
-                if not sellable.is_available:
-                    # If the sellable is not available, reset both
-                    sellable = None
-                    batch = None
+        # Scale barcodes are resolved by their code, through the same index
+        sellable, batch = self._sellable_index.lookup(text)
 
         # The user can't add the parent product of a grid directly to the sale.
         # TODO: Display a dialog to let the user choose an specific grid product.
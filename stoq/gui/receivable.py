@@ -37,17 +37,19 @@ import pango
 import gtk
 from kiwi.currency import currency
 from kiwi.python import all
-from kiwi.ui.dialogs import save
+from kiwi.ui.dialogs import open as open_dialog, save
 from kiwi.ui.gadgets import render_pixbuf
 from kiwi.ui.objectlist import Column
 
 from stoqlib.api import api
 from stoqlib.domain.payment.category import PaymentCategory
+from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.payment.views import InPaymentView
 from stoqlib.domain.till import Till
 from stoqlib.exceptions import TillError
 from stoqlib.gui.base.dialogs import run_dialog
+from stoqlib.gui.dialogs.progressdialog import ProgressDialog
 from stoqlib.gui.editors.paymenteditor import InPaymentEditor
 from stoqlib.gui.editors.paymentseditor import SalePaymentsEditor
 from stoqlib.gui.search.paymentsearch import InPaymentBillCheckSearch
@@ -59,8 +61,9 @@ from stoqlib.gui.utils.keybindings import get_accels
 from stoqlib.gui.utils.printing import print_report
 from stoqlib.gui.wizards.renegotiationwizard import PaymentRenegotiationWizard
 from stoqlib.lib.boleto import get_bank_info_by_number
+from stoqlib.lib.cnab.reconciliation import BillReconciliation
 from stoqlib.lib.dateutils import localtoday
-from stoqlib.lib.message import warning
+from stoqlib.lib.message import info, warning
 from stoqlib.lib.translation import stoqlib_gettext as _
 from stoqlib.reporting.payment import ReceivablePaymentReport
 from stoqlib.reporting.paymentsreceipt import InPaymentReceipt
@@ -98,6 +101,7 @@ class ReceivableApp(BaseAccountWindow):
              _('Payment _flow history...'),
              group.get('payment_flow_history')),
             ('ExportBills', None, _('Export bills...')),
+            ('ImportBillReturn', None, _('Import bank return file...')),
 
 
             # Payment
@@ -545,3 +549,50 @@ class ReceivableApp(BaseAccountWindow):
 
         with open(filename, 'w') as fh:
             fh.write(cnab)
+
+    def on_ImportBillReturn__activate(self, action):
+        method = PaymentMethod.get_by_name(self.store, u'bill')
+        account = method.destination_account
+        bank_account = account and account.bank
+        if bank_account is None:
+            warning(_('The destination account of the bill payment method '
+                      'is not a bank account'))
+            return
+
+        filename = open_dialog(_('Import bank return file'),
+                               parent=self.get_toplevel())
+        if not filename:
+            return
+
+        with open(filename) as fh:
+            data = fh.read()
+
+        try:
+            reconciliation = BillReconciliation(bank_account, data)
+        except Exception as e:
+            log.error(''.join(traceback.format_exception(*sys.exc_info())))
+            warning(_('An error ocurred while reading the return file'),
+                    str(e))
+            return
+
+        progress_dialog = ProgressDialog(_('Receiving the paid bills'),
+                                         pulse=False)
+        progress_dialog.set_transient_for(self.get_toplevel())
+        progress_dialog.start(wait=0)
+        progress_dialog.cancel.hide()
+
+        def update_progress(current, total):
+            progress_dialog.set_text('%d/%d' % (current, total))
+            progress_dialog.progressbar.set_fraction(current / float(total))
+            while gtk.events_pending():
+                gtk.main_iteration(False)
+
+        try:
+            summary = reconciliation.reconcile(
+                progress_callback=update_progress)
+        finally:
+            progress_dialog.stop()
+
+        info(_('The bank return file was imported'),
+             summary.get_description())
+        self.refresh()
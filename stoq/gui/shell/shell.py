@@ -318,6 +318,31 @@ class Shell(object):
             seconds = minutes * 60
             glib.timeout_add_seconds(5, self._verify_idle_logout, seconds)
 
+    def _schedule_templates_warmup(self):
+        # Compile the report templates while the user is idle, so the
+        # first report printed doesn't have to. The compiled templates are
+        # cached on disk, so this is only slow after they are modified
+        from stoqlib.lib.template import iter_template_filenames
+        filenames = iter_template_filenames()
+        glib.idle_add(self._warmup_next_template, filenames,
+                      priority=glib.PRIORITY_LOW)
+
+    def _warmup_next_template(self, filenames):
+        from stoqlib.lib.template import warmup_templates
+        for filename in filenames:
+            warmup_templates([filename])
+            # Call us again for the next template
+            return True
+        return False
+
+    def _start_change_listener(self):
+        # Invalidate what we have cached when other stations change it
+        from stoqlib.database.changes import get_change_listener
+        try:
+            get_change_listener().start()
+        except Exception as e:
+            log.warning('Could not listen to the database changes: %s' % (e, ))
+
     def _verify_idle_logout(self, seconds):
         # This is called once every 10 seconds
         from stoqlib.gui.utils.idle import get_idle_seconds
@@ -493,6 +518,8 @@ class Shell(object):
                 action.activate()
 
         self._maybe_schedule_idle_logout()
+        self._schedule_templates_warmup()
+        self._start_change_listener()
 
         log.debug("Entering main loop")
         self._bootstrap.entered_main = True
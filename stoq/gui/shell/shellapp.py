@@ -35,7 +35,6 @@ from stoqlib.gui.dialogs.spreadsheetexporterdialog import SpreadSheetExporter
 from stoqlib.gui.events import ApplicationSetupSearchEvent
 from stoqlib.gui.search.searchslave import SearchSlave
 from stoqlib.gui.utils.printing import print_report
-from stoqlib.gui.widgets.lazyobjectlist import LazyObjectModel
 from stoqlib.lib.decorators import cached_function
 from stoqlib.lib.translation import stoqlib_gettext as _
 
@@ -212,14 +211,10 @@ class ShellApp(GladeDelegate):
         if self.search_spec is None:
             raise NotImplementedError
 
-        model = self.results.get_model()
-        if isinstance(model, LazyObjectModel):
-            model.load_items_from_results(0, model._count)
-
         sse = SpreadSheetExporter()
-        sse.export(object_list=self.results,
-                   name=self.app_name,
-                   filename_prefix=self.app_name)
+        sse.export_search(search=self.search,
+                          name=self.app_name,
+                          filename_prefix=self.app_name)
 
     def create_filters(self):
         """Implement this to provide filters for the search container"""
@@ -315,7 +310,7 @@ class ShellApp(GladeDelegate):
         """ Encapsuled method for running dialogs. """
         return run_dialog(dialog_class, self, *args, **kwargs)
 
-    @cached_function()
+    @cached_function(depends_on=['Inventory'])
     def has_open_inventory(self):
         return Inventory.has_open(self.store,
                                   api.get_current_branch(self.store))
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Insert lots of domain rows using multi-row INSERT statements"""
+
+import collections
+import logging
+import uuid
+
+from storm.info import get_cls_info
+
+log = logging.getLogger(__name__)
+
+
+class BulkInserter(object):
+    """Batches domain rows and inserts them with multi-row INSERTs
+
+    Rows are added with :meth:`.add` and only sent to the database
+    when :meth:`.flush` is called, one ``INSERT ... VALUES (...), (...)``
+    per table and group of :attr:`.chunk_size` rows, instead of one
+    ``INSERT`` per object like the ORM does.
+
+    Tables are inserted in the order they were first added to the
+    inserter, so to respect the foreign keys, the parent rows should be
+    added before their children, e.g. |person| before |client| and
+    |sellable| before |product| and |storable|.
+
+    Note that the rows are not domain objects, so the domain hooks
+    (e.g. :meth:`Domain.on_create`) and the column validators are not
+    called. The Python default values of the columns are used, but
+    ``AutoReload`` columns (``te_id``, ``identifier``, etc) will get their
+    values from the database default, just like when using the ORM.
+
+    :param store: the store where the rows will be inserted
+    :param chunk_size: the maximum number of rows in one INSERT
+    """
+
+    def __init__(self, store, chunk_size=500):
+        self.store = store
+        self.chunk_size = chunk_size
+        self._rows = collections.OrderedDict()
+        self._pending = 0
+        #: the total number of rows inserted on the database
+        self.inserted = 0
+
+    def __len__(self):
+        return self._pending
+
+    #
+    #  Public API
+    #
+
+    def add(self, cls, **kwargs):
+        """Add a row to be inserted
+
+        :param cls: the |domain| class of the row
+        :param kwargs: the values of the row, by attribute name. References
+            are not supported, use the id column (``person_id`` instead
+            of ``person``)
+        :returns: the id of the row. If not given on *kwargs*, a new one
+            will be generated, so other rows can reference this one
+        """
+        cls_info = get_cls_info(cls)
+        if 'id' not in kwargs:
+            kwargs['id'] = unicode(uuid.uuid1())
+        row_id = kwargs['id']
+
+        row = []
+        for attr, column in cls_info.attributes.items():
+            variable = column.variable_factory(validator=None)
+            if attr in kwargs:
+                variable.set(kwargs.pop(attr))
+            elif variable.get_lazy() is not None or not variable.is_defined():
+                # Let the database fill this one
+                continue
+            row.append((column.name, variable))
+
+        if kwargs:
+            raise TypeError("%s has no columns named %s" % (
+                cls.__name__, ', '.join(sorted(kwargs))))
+
+        row.sort(key=lambda c: c[0])
+        table = cls_info.table.name
+        columns = tuple(name for name, variable in row)
+        self._rows.setdefault(table, collections.OrderedDict()).setdefault(
+            columns, []).append([var for name, var in row])
+        self._pending += 1
+        return row_id
+
+    def flush(self):
+        """Insert all the pending rows on the database
+
+        :returns: the number of rows inserted
+        """
+        if not self._pending:
+            return 0
+
+        # Objects created using the ORM (e.g. categories) may be referenced
+        # by the rows, make sure they are on the database first
+        self.store.flush()
+
+        inserted = 0
+        for table, column_groups in self._rows.items():
+            for columns, rows in column_groups.items():
+                for i in range(0, len(rows), self.chunk_size):
+                    chunk = rows[i:i + self.chunk_size]
+                    self._insert(table, columns, chunk)
+                    inserted += len(chunk)
+            column_groups.clear()
+
+        log.debug('bulk inserted %d rows' % (inserted, ))
+        self._pending = 0
+        self.inserted += inserted
+        return inserted
+
+    #
+    #  Private
+    #
+
+    def _insert(self, table, columns, rows):
+        marks = '(%s)' % (', '.join('?' * len(columns)), )
+        statement = 'INSERT INTO %s (%s) VALUES %s' % (
+            table, ', '.join('"%s"' % c for c in columns),
+            ', '.join([marks] * len(rows)))
+        params = []
+        for row in rows:
+            params.extend(row)
+        self.store.execute(statement, params, noresult=True)
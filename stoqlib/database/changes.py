@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Notify the other stations about the rows changed by a transaction
+
+When a :class:`stoqlib.database.runtime.StoqlibStore` is committed, the
+``(table, id)`` of the objects it created, modified or removed are
+published with ``NOTIFY`` on the :data:`CHANNEL` channel, in the same
+transaction (so they are only delivered if it is committed).
+
+Each station runs a :class:`ChangeListener`, which ``LISTEN`` s on the
+channel and, for each change made by another station:
+
+ * autoreloads the objects alive on the stores of this process
+ * clears the caches of :class:`stoqlib.lib.decorators.cached_function`
+   depending on the changed classes
+ * clears the cache of the system parameters, if they changed
+ * calls the callbacks added with :meth:`ChangeListener.add_callback`
+
+Note that only the changes done through the ORM are published, the
+ones done with raw SQL (e.g. ``store.execute(Update(...))``) and by
+triggers are not.
+"""
+
+import json
+import logging
+import os
+
+import glib
+from storm.info import get_cls_info
+
+from stoqlib.database.orm import ORMObject
+from stoqlib.net.socketutils import get_hostname
+
+log = logging.getLogger(__name__)
+
+#: The channel where the changes are notified
+CHANNEL = 'stoq_changes'
+
+#: The maximum size of a notification payload. PostgreSQL limits
+#: it to 8000 bytes
+MAX_PAYLOAD_SIZE = 7500
+
+#: If more than this number of rows of a table were changed, the whole
+#: table is considered changed, instead of sending all the ids
+MAX_IDS_PER_TABLE = 200
+
+#: How many seconds to wait before connecting again when the
+#: listening connection is lost
+RECONNECT_INTERVAL = 30
+
+_origin = None
+_classes_by_table = {}
+_listener = None
+
+
+def get_origin():
+    """Get the identification of this process on the notifications
+
+    :returns: a string with the hostname and the pid of this process
+    """
+    global _origin
+    if _origin is None:
+        _origin = u'%s:%d' % (get_hostname(), os.getpid())
+    return _origin
+
+
+def _load_classes():
+    _classes_by_table.clear()
+    classes = [ORMObject]
+    while classes:
+        cls = classes.pop()
+        classes.extend(cls.__subclasses__())
+        if getattr(cls, '__storm_table__', None) is None:
+            continue
+        table = get_cls_info(cls).table.name
+        _classes_by_table.setdefault(table, []).append(cls)
+
+
+def get_classes_for_table(table):
+    """Get the |orm| classes stored on the given table
+
+    :param table: the name of the table
+    :returns: a list of classes
+    """
+    if table not in _classes_by_table:
+        # Classes may be defined after the last time we looked,
+        # e.g. by plugins, so look again if the table is not known
+        _load_classes()
+    return _classes_by_table.get(table, [])
+
+
+def build_payloads(changes):
+    """Builds the payloads of the notifications for the changes
+
+    :param changes: a dict mapping the table names to sets of ids, or
+      to ``None`` if the whole table changed
+    :returns: a list of payloads, each one smaller than
+      :data:`MAX_PAYLOAD_SIZE`
+    """
+    payloads = []
+    current = {}
+
+    def dump(tables):
+        return json.dumps({'origin': get_origin(), 'changes': tables},
+                          separators=(',', ':'))
+
+    for table, ids in sorted(changes.items()):
+        if ids is not None and len(ids) > MAX_IDS_PER_TABLE:
+            ids = None
+        if ids is not None:
+            ids = sorted(ids)
+
+        current[table] = ids
+        if len(dump(current)) <= MAX_PAYLOAD_SIZE:
+            continue
+
+        # Doesn't fit, put this table on the next payloads
+        del current[table]
+        if current:
+            payloads.append(dump(current))
+        current = {table: ids}
+        # A whole table entry is always small, only lists of ids need to
+        # be split among the payloads
+        while (ids is not None and len(ids) > 1 and
+               len(dump(current)) > MAX_PAYLOAD_SIZE):
+            half = len(ids) // 2
+            payloads.append(dump({table: ids[:half]}))
+            ids = ids[half:]
+            current = {table: ids}
+
+    if current:
+        payloads.append(dump(current))
+    return payloads
+
+
+def publish_changes(store, changes):
+    """Notifies the other stations about the changes
+
+    This should be called inside the transaction that did the changes,
+    the notifications are only delivered if it is committed.
+
+    :param store: a store
+    :param changes: see :func:`build_payloads`
+    """
+    if not changes:
+        return
+    for payload in build_payloads(changes):
+        store.execute(u"SELECT pg_notify(?, ?)", (CHANNEL, payload),
+                      noresult=True)
+
+
+def apply_changes(changes, callbacks=()):
+    """Invalidates what was cached of the changed rows on this process
+
+    :param changes: see :func:`build_payloads`
+    :param callbacks: callables receiving the table name and the
+      set of changed ids, or ``None`` if the whole table changed
+    """
+    # Avoid circular imports
+    from stoqlib.database.runtime import autoreload_rows
+    from stoqlib.lib.decorators import invalidate_dependent_caches
+    from stoqlib.lib.parameters import sysparam
+
+    for table, ids in changes.items():
+        autoreload_rows(table, ids)
+        for cls in get_classes_for_table(table):
+            invalidate_dependent_caches(cls)
+        if table == 'parameter_data':
+            sysparam.clear_cache()
+        for callback in callbacks:
+            callback(table, ids)
+
+
+class ChangeListener(object):
+    """Listens to the changes notified by the other stations
+
+    The notifications are received on a connection of its own, watched by
+    the glib main loop, and applied with :func:`apply_changes`.
+
+    :param database: the storm database to connect to, usually the one
+      of the default store
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._connection = None
+        self._watch_id = None
+        self._reconnect_id = None
+        self._callbacks = []
+
+    #
+    #  Public API
+    #
+
+    def start(self):
+        """Starts listening to the notifications"""
+        if self._connection is not None:
+            return
+
+        # LISTEN only receives notifications outside transactions, so
+        # the connection can't be used by a store
+        self._connection = self.database.raw_connect()
+        self._connection.set_isolation_level(0)
+        cursor = self._connection.cursor()
+        cursor.execute('LISTEN %s' % (CHANNEL, ))
+        cursor.close()
+        self._watch_id = glib.io_add_watch(
+            self._connection.fileno(),
+            glib.IO_IN | glib.IO_ERR | glib.IO_HUP,
+            self._on_connection__io)
+        log.info('listening to the changes on %s' % (CHANNEL, ))
+
+    def stop(self):
+        """Stops listening to the notifications"""
+        for source_id in [self._watch_id, self._reconnect_id]:
+            if source_id is not None:
+                glib.source_remove(source_id)
+        self._watch_id = self._reconnect_id = None
+        self._close_connection()
+
+    def add_callback(self, callback):
+        """Adds a callback to be called for each changed table
+
+        Use this to invalidate caches of the application that are not
+        already handled by :func:`apply_changes`.
+
+        :param callback: a callable receiving the table name and the
+          set of changed ids, or ``None`` if the whole table changed
+        """
+        self._callbacks.append(callback)
+
+    def remove_callback(self, callback):
+        """Removes a callback added with :meth:`.add_callback`"""
+        self._callbacks.remove(callback)
+
+    def poll(self):
+        """Applies the changes notified since the last time
+
+        This is called by the main loop when something arrives on the
+        connection, but it can also be called directly.
+        """
+        self._connection.poll()
+        payloads = [n.payload for n in self._connection.notifies
+                    if n.channel == CHANNEL]
+        del self._connection.notifies[:]
+        self.apply_payloads(payloads)
+
+    def apply_payloads(self, payloads):
+        """Applies the changes of the notification payloads
+
+        The changes done by this process are ignored, they were already
+        applied when the store was committed.
+
+        :param payloads: a list of payloads built by :func:`build_payloads`
+        """
+        changes = {}
+        for payload in payloads:
+            try:
+                data = json.loads(payload)
+            except ValueError:
+                log.warning('invalid change notification: %r' % (payload, ))
+                continue
+            if data.get('origin') == get_origin():
+                continue
+
+            for table, ids in data['changes'].items():
+                table = str(table)
+                if ids is None or changes.get(table, ()) is None:
+                    changes[table] = None
+                else:
+                    changes.setdefault(table, set()).update(ids)
+
+        if changes:
+            log.debug('applying changes of the tables %s' % (
+                ', '.join(sorted(changes)), ))
+            apply_changes(changes, self._callbacks)
+
+    #
+    #  Private
+    #
+
+    def _close_connection(self):
+        if self._connection is None:
+            return
+        try:
+            self._connection.close()
+        except Exception:
+            pass
+        self._connection = None
+
+    def _reconnect(self):
+        try:
+            self.start()
+        except Exception as e:
+            log.warning('could not listen to the changes: %s' % (e, ))
+            self._close_connection()
+            # Try again later
+            return True
+
+        # Something may have changed while we were not listening
+        self._reconnect_id = None
+        _load_classes()
+        apply_changes(dict((table, None) for table in _classes_by_table),
+                      self._callbacks)
+        return False
+
+    #
+    #  Callbacks
+    #
+
+    def _on_connection__io(self, fd, condition):
+        try:
+            self.poll()
+        except Exception as e:
+            log.warning('lost the connection listening to the changes: '
+                        '%s' % (e, ))
+            # Returning False will remove the watch
+            self._watch_id = None
+            self._close_connection()
+            self._reconnect_id = glib.timeout_add_seconds(
+                RECONNECT_INTERVAL, self._reconnect)
+            return False
+        return True
+
+
+def get_change_listener():
+    """Get the :class:`ChangeListener` of this process
+
+    It is created using the database of the default store, but
+    :meth:`ChangeListener.start` needs to be called to start listening.
+    """
+    global _listener
+    if _listener is None:
+        from stoqlib.database.runtime import get_default_store
+        _listener = ChangeListener(get_default_store().get_database())
+    return _listener
@@ -175,9 +175,9 @@ class StoqNormalizeString(NamedFunc):
     it's similar to NLKD normailzation in unicode, but it is run
     inside the database.
 
-    Note, this is very slow and should be avoided.
-    In the future this will be replaced by fulltext search which
-    does normalization in a cheaper way.
+    Searching with this on a column is only fast if the column has a
+    trigram index on this same expression, see
+    :obj:`stoqlib.database.queryexecuter.TRIGRAM_INDEXED_COLUMNS`
     """
     # See functions.sql
     __slots__ = ()
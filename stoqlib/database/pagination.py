@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Keyset (seek) pagination of result sets
+
+Fetching the rows of a position with ``result[start:end]`` becomes an
+``OFFSET``, which makes the database produce and discard every row before
+``start``. Here the rows are fetched after (or before) the sort key of a
+row already known, so the cost of fetching a page doesn't depend on where
+it is.
+"""
+
+import bisect
+import logging
+
+from storm import Undef
+from storm.expr import And, Desc, Eq, Ne, Or
+
+log = logging.getLogger(__name__)
+
+
+class KeysetPaginator(object):
+    """Fetches the rows of a result set by position, using keyset pagination
+
+    The result is ordered by the sort column and then by the id (to make
+    the order deterministic) and the key (sort value, id) of every row
+    fetched is remembered. A page is fetched seeking from the nearest
+    known key, before or after it, so scrolling through the results
+    always costs the same.
+
+    To be able to jump anywhere, :meth:`.load_bookmarks` walks the
+    keys of the result (without loading the rows), keeping one every
+    :attr:`.BOOKMARK_INTERVAL` rows. It also counts the results while
+    doing that, so until it is finished, :attr:`.count` is only an
+    estimate (see :attr:`.count_is_exact`).
+
+    :param result: the result set
+    :param sort_column: the column or expression to order the result by
+    :param id_column: the primary key of the result, e.g. ``Sale.id``
+    :param key_func: a callable that receives a row of the result and
+      returns its ``(sort value, id)`` key
+    :param descending: if the result should be in descending order
+    :param count: the number of results, if already known
+    """
+
+    #: How many rows apart the bookmarks are
+    BOOKMARK_INTERVAL = 1000
+
+    #: The results are only counted (exactly) up to this number of rows
+    #: before being estimated
+    COUNT_LIMIT = 10000
+
+    #: While the results are not counted, :attr:`.count` doesn't go
+    #: further than this many rows after the last one known to exist
+    COUNT_MARGIN = 1000
+
+    def __init__(self, result, sort_column, id_column, key_func,
+                 descending=False, count=None):
+        self.result = result
+        self.sort_column = sort_column
+        self.id_column = id_column
+        self.key_func = key_func
+        self.descending = descending
+
+        # position -> key, and the sorted list of positions
+        self._keys = {}
+        self._positions = []
+        # The position of the last bookmark, -1 is the start
+        self._bookmark_position = -1
+        self._estimate = None
+        self.count_is_exact = False
+        if count is not None:
+            self._set_exact_count(count)
+        else:
+            self.count = self._get_initial_count()
+
+    #
+    #  Public API
+    #
+
+    def get_rows(self, start, end):
+        """Fetches the rows on the positions from *start* to *end*
+
+        :param start: the position of the first row
+        :param end: the position after the last row
+        :returns: a list with the rows
+        """
+        end = min(end, self.count)
+        if start >= end:
+            return []
+
+        before, before_key = self._get_key_before(start)
+        after, after_key = self._get_key_after(end - 1)
+        if after is not None and after - end < start - before - 1:
+            # Closer to a key after the rows, seek backwards
+            rows = list(self._seek(after_key, not self.descending,
+                                   after - end, end - start))
+            rows.reverse()
+        else:
+            rows = list(self._seek(before_key, self.descending,
+                                   start - before - 1, end - start))
+
+        for position, row in enumerate(rows, start):
+            self._add_key(position, self.key_func(row))
+        return rows
+
+    def load_bookmarks(self, steps=1):
+        """Walks the keys of the result, keeping some to be used later
+
+        This will also count the results. Each step walks through
+        :attr:`.BOOKMARK_INTERVAL` keys.
+
+        :param steps: how many steps to do
+        :returns: ``True`` if there is still something to walk
+        """
+        for i in range(steps):
+            if self.count_is_exact:
+                return False
+
+            position = self._bookmark_position
+            key = self._keys.get(position)
+            keys = self._select_keys(key, self.descending,
+                                     offset=self.BOOKMARK_INTERVAL - 1,
+                                     limit=1)
+            if keys:
+                self._bookmark_position = position + self.BOOKMARK_INTERVAL
+                self._add_key(self._bookmark_position, keys[0])
+                self.count = max(self.count, self._get_estimated_count(
+                    self._bookmark_position + 1))
+                continue
+
+            # Less than BOOKMARK_INTERVAL results left, this is the end
+            left = len(self._select_keys(key, self.descending,
+                                         limit=self.BOOKMARK_INTERVAL))
+            self._set_exact_count(position + 1 + left)
+        return not self.count_is_exact
+
+    #
+    #  Private
+    #
+
+    def _get_initial_count(self):
+        # Counting all the results can take a lot of time, only count
+        # them up to COUNT_LIMIT and estimate if there are more than that
+        ids = self._order(self.result.copy(), self.descending).config(
+            limit=self.COUNT_LIMIT + 1).values(self.id_column)
+        count = len(list(ids))
+        if count <= self.COUNT_LIMIT:
+            self._set_exact_count(count)
+            return count
+
+        self._estimate = self.result.estimate_count()
+        return self._get_estimated_count(count)
+
+    def _get_estimated_count(self, known):
+        # The estimate can be far from the real count (e.g. when the
+        # results are filtered). Don't go much further than the rows known
+        # to exist, so there aren't a lot of them to remove once counted
+        return max(known, min(self._estimate, known + self.COUNT_MARGIN))
+
+    def _set_exact_count(self, count):
+        self.count = count
+        self.count_is_exact = True
+        # Rows on the end can be read backwards from here
+        self._add_key(count, None)
+
+    def _add_key(self, position, key):
+        if position not in self._keys:
+            bisect.insort(self._positions, position)
+        self._keys[position] = key
+
+    def _get_key_before(self, position):
+        # The start of the result is a key before position 0
+        i = bisect.bisect_left(self._positions, position) - 1
+        while i >= 0:
+            known = self._positions[i]
+            if known < position and known != self.count:
+                return known, self._keys[known]
+            i -= 1
+        return -1, None
+
+    def _get_key_after(self, position):
+        i = bisect.bisect_right(self._positions, position)
+        if i < len(self._positions):
+            known = self._positions[i]
+            # The end of the result is only known when the count is exact
+            if known != self.count or self.count_is_exact:
+                return known, self._keys[known]
+        return None, None
+
+    def _order(self, result, descending):
+        if descending:
+            return result.order_by(Desc(self.sort_column),
+                                   Desc(self.id_column))
+        return result.order_by(self.sort_column, self.id_column)
+
+    def _get_seek_query(self, key, descending):
+        # PostgreSQL puts NULLs last on ascending orders and first on
+        # descending ones, and they can't be compared with row values
+        value, id_ = key
+        sort_column, id_column = self.sort_column, self.id_column
+        if not descending:
+            if value is None:
+                return And(Eq(sort_column, None), id_column > id_)
+            return Or(sort_column > value,
+                      And(sort_column == value, id_column > id_),
+                      Eq(sort_column, None))
+
+        if value is None:
+            return Or(And(Eq(sort_column, None), id_column < id_),
+                      Ne(sort_column, None))
+        return Or(sort_column < value,
+                  And(sort_column == value, id_column < id_))
+
+    def _seek(self, key, descending, offset, limit):
+        # Using an OFFSET here is fine, it will be at most
+        # BOOKMARK_INTERVAL rows after the bookmarks are loaded
+        result = self.result.copy()
+        if key is not None:
+            query = self._get_seek_query(key, descending)
+            # pylint: disable=W0212
+            if result._group_by is not Undef:
+                # The sort column may be an aggregate (e.g. the stock of
+                # a product), it can only be compared on the having clause
+                having = result._having
+                if having is not Undef:
+                    query = And(having, query)
+                result.having(query)
+            else:
+                result = result.find(query)
+            # pylint: enable=W0212
+        result = self._order(result, descending)
+        return result.config(offset=offset, limit=limit)
+
+    def _select_keys(self, key, descending, offset=0, limit=None):
+        result = self._seek(key, descending, offset, limit)
+        return list(result.values(self.sort_column, self.id_column))
@@ -28,7 +28,8 @@ from lxml import etree
 
 from kiwi.currency import currency
 
-from storm.properties import RawStr, Int, Bool, DateTime, Decimal, Unicode
+from storm.properties import (RawStr, Int, Bool, Date, DateTime, Decimal,
+                              Unicode)
 from storm.properties import SimpleProperty
 from storm.store import AutoReload
 from storm.variables import (DateVariable, DateTimeVariable,
@@ -192,6 +193,7 @@ class XmlCol(SimpleProperty):
 # decimal.Decimal and storm.properties.Decimal
 BLOBCol = RawStr
 BoolCol = Bool
+DateCol = Date
 DecimalCol = Decimal
 IdCol = UUIDCol
 IntCol = Int
@@ -24,26 +24,76 @@
 Kiwi integration for Stoq/Storm
 """
 
+import collections
+import logging
 import re
 import threading
+import time
 import Queue
 
 import glib
 import gobject
+from kiwi.accessor import kgetattr
 from kiwi.python import Settable
 from kiwi.utils import gsignal
 from storm import Undef
 from storm.database import Connection, convert_param_marks
-from storm.expr import compile, And, Or, Like, Not, Alias, State, Lower
+from storm.expr import (compile, And, Or, Like, Not, Alias, State, Lower,
+                        Expr, SQL)
 from storm.tracer import trace
+from storm.variables import UnicodeVariable
 import psycopg2
 import psycopg2.extensions
 
 from stoqlib.database.expr import Date, StoqNormalizeString
 from stoqlib.database.interfaces import ISearchFilter
+from stoqlib.database.pagination import KeysetPaginator
 from stoqlib.database.settings import db_settings
 from stoqlib.database.viewable import Viewable
 
+log = logging.getLogger(__name__)
+
+#: The (table, column) pairs that have a trigram index on
+#: ``stoq_normalize_string(column)``. Those are the ones that can be searched
+#: by :class:`StringQueryState` without a sequential scan.
+#: When adding a new text column to a search, it should be added here and
+#: a patch creating the index should be written. See patch-05-46.sql
+TRIGRAM_INDEXED_COLUMNS = frozenset([
+    ('company', 'cnpj'),
+    ('company', 'fancy_name'),
+    ('individual', 'cpf'),
+    ('payment', 'description'),
+    ('person', 'name'),
+    ('sellable', 'barcode'),
+    ('sellable', 'code'),
+    ('sellable', 'description'),
+    ('sellable_category', 'description'),
+    ('work_order', 'description'),
+])
+
+
+def get_column_table_name(column):
+    """Get the (table, column) names of a storm column
+
+    :param column: a storm :class:`storm.properties.PropertyColumn`
+    :returns: a (table name, column name) tuple or ``None`` if *column*
+        is not a real table column (e.g. a function or a sql expression)
+    """
+    if isinstance(column, Alias):
+        column = column.expr
+    table = getattr(column, 'table', None)
+    name = getattr(column, 'name', None)
+    if table is None or name is None:
+        return None
+    table_name = getattr(table, '__storm_table__', None)
+    if table_name is None:
+        # ClassAlias and Alias tables
+        table_name = getattr(getattr(table, 'expr', None),
+                             '__storm_table__', None)
+        if table_name is None:
+            return None
+    return table_name, name
+
 
 class QueryState(object):
     def __init__(self, search_filter):
@@ -217,11 +267,16 @@ class AsyncQueryOperation(gobject.GObject):
         self.resultset = resultset
         self.expr = expr
 
+        #: the time in seconds the query took to execute on the database,
+        #: or ``None`` if it was not executed yet
+        self.wall_time = None
+
         self._conn = store._connection
         self._async_cursor = None
         self._async_conn = None
         self._statement = None
         self._parameters = None
+        self._executer = None
 
     #
     #  Public API
@@ -248,8 +303,18 @@ class AsyncQueryOperation(gobject.GObject):
 
         trace("connection_raw_execute", self._conn,
               self._async_cursor, self._statement, self._parameters)
-        self._async_cursor.execute(self._statement,
-                                   self._parameters)
+        start = time.time()
+        try:
+            self._async_cursor.execute(self._statement,
+                                       self._parameters)
+        except psycopg2.extensions.QueryCanceledError:
+            # The query was cancelled by pg_cancel_backend, the connection
+            # needs to be rolled back before it can be used again
+            async_conn.rollback()
+            self.status = self.STATUS_CANCELLED
+            return
+        finally:
+            self.wall_time = time.time() - start
 
         # This can happen if another thread cancelled this while the cursor was
         # executing. In that case, it is not interested in the retval anymore
@@ -277,8 +342,16 @@ class AsyncQueryOperation(gobject.GObject):
         return AsyncResultSet(self.resultset, result)
 
     def cancel(self):
-        """Cancel the operation scheduling"""
+        """Cancel the operation
+
+        If the operation is still waiting, it will not be executed.
+        If it is already executing, the query will be cancelled on the
+        database, freeing the connection for the next operation.
+        """
+        status = self.status
         self.status = self.STATUS_CANCELLED
+        if status == self.STATUS_EXECUTING and self._executer is not None:
+            self._executer.cancel_operation(self)
 
     #
     #  Private
@@ -292,33 +365,169 @@ class AsyncQueryOperation(gobject.GObject):
 gobject.type_register(AsyncQueryOperation)
 
 
-class _OperationExecuter(threading.Thread):
+class _OperationWorker(threading.Thread):
+    """A worker thread, with its own connection, for the operation executer
+    """
 
-    _SINGLETON = None
+    def __init__(self, executer):
+        super(_OperationWorker, self).__init__()
+        self.daemon = True
+
+        self.operation = None
+        self.lock = threading.Lock()
+
+        self._executer = executer
+        self._conn = None
+
+    def run(self):
+        queue = self._executer._queue
+        while True:
+            operation = queue.get()
+            try:
+                self._execute(operation)
+            except Exception:
+                log.exception('Error executing %r' % (operation, ))
+                self._reset_connection()
+            finally:
+                queue.task_done()
+
+    def cancel(self, operation):
+        """Cancels the operation if it is still executing on this worker
+
+        :returns: ``True`` if the operation was executing here
+        """
+        with self.lock:
+            if self.operation is not operation or self._conn is None:
+                return False
+            self._executer.cancel_backend(self._conn.get_backend_pid())
+            return True
+
+    def _execute(self, operation):
+        if self._conn is None:
+            # Lazily connect, so idle workers don't hold a connection
+            self._conn = psycopg2.connect(db_settings.get_store_dsn())
+
+        with self.lock:
+            self.operation = operation
+        try:
+            operation.execute(self._conn)
+        finally:
+            with self.lock:
+                self.operation = None
+
+        if operation.wall_time is not None:
+            self._executer.add_timing(operation)
+
+    def _reset_connection(self):
+        with self.lock:
+            if self._conn is not None:
+                try:
+                    self._conn.close()
+                except psycopg2.Error:
+                    pass
+            self._conn = None
 
-    def __init__(self):
-        super(_OperationExecuter, self).__init__()
 
-        self._conn = psycopg2.connect(db_settings.get_store_dsn())
+class _OperationExecuter(object):
+    """A bounded pool of worker threads executing
+    :class:`AsyncQueryOperation` objects.
+
+    Each worker has its own database connection, so a slow query will
+    only block the worker executing it, not every other operation.
+    """
+
+    #: the maximum number of workers (and database connections)
+    POOL_SIZE = 4
+
+    #: how many query timings to keep for diagnostics
+    TIMINGS_SIZE = 100
+
+    _SINGLETON = None
+
+    def __init__(self, pool_size=None):
         self._queue = Queue.Queue()
+        self._workers = []
+        self._pool_size = pool_size or self.POOL_SIZE
+        self._timings = collections.deque(maxlen=self.TIMINGS_SIZE)
+        self._executed = 0
+        self._cancelled = 0
+        self._lock = threading.Lock()
+        self._control_conn = None
 
     @classmethod
     def get_instance(cls):
         if cls._SINGLETON is None:
             cls._SINGLETON = cls()
-            cls._SINGLETON.daemon = True
-            cls._SINGLETON.start()
         return cls._SINGLETON
 
-    def run(self):
-        while True:
-            operation = self._queue.get()
-            operation.execute(self._conn)
-            self._queue.task_done()
-
     def schedule(self, operation):
         assert isinstance(operation, AsyncQueryOperation)
+        operation._executer = self
         self._queue.put(operation)
+        self._maybe_add_worker()
+
+    def cancel_operation(self, operation):
+        """Cancels an operation which is executing on one of the workers
+
+        :param operation: the :class:`AsyncQueryOperation` to cancel
+        """
+        for worker in self._workers[:]:
+            if worker.cancel(operation):
+                with self._lock:
+                    self._cancelled += 1
+                return
+
+    def cancel_backend(self, pid):
+        """Cancels the query running on the backend *pid*
+
+        This uses a separated connection, since the worker one is busy
+        executing the query that is going to be cancelled.
+        """
+        with self._lock:
+            if self._control_conn is None:
+                self._control_conn = psycopg2.connect(
+                    db_settings.get_store_dsn())
+            cursor = self._control_conn.cursor()
+            cursor.execute("SELECT pg_cancel_backend(%s)", (pid, ))
+            cursor.close()
+            self._control_conn.rollback()
+
+    def add_timing(self, operation):
+        with self._lock:
+            self._executed += 1
+            self._timings.append((operation._statement, operation.wall_time))
+        log.debug('async query took %.3fs: %s' % (operation.wall_time,
+                                                   operation._statement))
+
+    def get_stats(self):
+        """Get some statistics about the executer, useful for diagnostics
+
+        :returns: a dict containing the number of operations waiting on the
+          queue (``queue_size``), the number of ``workers`` and how many of
+          them are ``busy``, the number of ``executed`` and ``cancelled``
+          operations and the last query ``timings``, a list of
+          (statement, wall time in seconds) tuples
+        """
+        with self._lock:
+            return dict(
+                queue_size=self._queue.qsize(),
+                workers=len(self._workers),
+                busy=len([w for w in self._workers if w.operation]),
+                executed=self._executed,
+                cancelled=self._cancelled,
+                timings=list(self._timings))
+
+    def _maybe_add_worker(self):
+        with self._lock:
+            if len(self._workers) >= self._pool_size:
+                return
+            # Only start a new worker if all the others are busy
+            idle = [w for w in self._workers if w.operation is None]
+            if len(idle) >= self._queue.qsize():
+                return
+            worker = _OperationWorker(self)
+            self._workers.append(worker)
+        worker.start()
 
 
 class QueryExecuter(object):
@@ -343,7 +552,7 @@ class QueryExecuter(object):
 
     # Public API
 
-    def search(self, states=None, resultset=None, limit=None):
+    def search(self, states=None, resultset=None, limit=None, store=None):
         """
         Execute a search.
 
@@ -352,9 +561,11 @@ class QueryExecuter(object):
           .set_search_spec()
         :param states:
         :param limit: use this limit instead of the one defined by set_limit()
+        :param store: the store to search on, if ``None`` the store of
+          this executer will be used. Ignored if *resultset* is given
         """
         if resultset is None:
-            resultset = self._query(self.store)
+            resultset = self._query(store or self.store)
         resultset = self._parse_states(resultset, states)
         limit = limit or self._limit
         if limit > 0:
@@ -406,6 +617,16 @@ class QueryExecuter(object):
         self._operation_executer.schedule(operation)
         return operation
 
+    def get_async_stats(self):
+        """Get diagnostic information about the asynchronous searches
+
+        This contains the queue depth, how many connections are busy
+        and the wall time of the last queries executed by :meth:`.search_async`
+
+        :returns: a dict, see :meth:`_OperationExecuter.get_stats`
+        """
+        return self._operation_executer.get_stats()
+
     def set_limit(self, limit):
         """
         Set the maximum number of result items to return in a search query.
@@ -430,6 +651,29 @@ class QueryExecuter(object):
         assert not search_filter in self._columns
         self._columns[search_filter] = (columns, use_having)
 
+    def get_text_search_columns(self):
+        """Get the table columns searched by text filters
+
+        This is used to know which columns should have a trigram index,
+        see :obj:`TRIGRAM_INDEXED_COLUMNS`.
+
+        :returns: a set of (table name, column name) tuples
+        """
+        columns = set()
+        for filter_columns, use_having in self._columns.values():
+            for column in filter_columns:
+                if isinstance(column, str):
+                    column = getattr(self.search_spec, column)
+                if isinstance(column, Alias):
+                    column = column.expr
+                factory = getattr(column, 'variable_factory', None)
+                if getattr(factory, 'func', None) is not UnicodeVariable:
+                    continue
+                table_column = get_column_table_name(column)
+                if table_column is not None:
+                    columns.add(table_column)
+        return columns
+
     def set_search_spec(self, search_spec):
         """
         Sets the Storm search_spec for this executer
@@ -500,6 +744,29 @@ class QueryExecuter(object):
 
         return result.order_by(attribute)
 
+    def get_paginator(self, result, attribute, descending=False, count=None):
+        """Get a paginator to fetch the rows of the result by position
+
+        See :class:`stoqlib.database.pagination.KeysetPaginator`.
+
+        :param result: the result set, as returned by :meth:`.search`
+        :param attribute: the name of the attribute to sort the result by
+        :param descending: if the result should be in descending order
+        :param count: the number of results, if already known
+        :returns: a :class:`stoqlib.database.pagination.KeysetPaginator`
+        """
+        column = getattr(self.search_spec, attribute, None)
+        if not isinstance(column, Expr):
+            # Not a column, let the database find it by its name,
+            # just like get_ordered_result does
+            column = SQL(attribute)
+
+        def key_func(row):
+            return kgetattr(row, attribute), row.id
+
+        return KeysetPaginator(result, column, self.search_spec.id, key_func,
+                               descending=descending, count=count)
+
     # Private API
 
     def _default_query(self, store):
@@ -619,6 +886,13 @@ class QueryExecuter(object):
         if not state.text.strip():
             return
 
+        if log.isEnabledFor(logging.DEBUG):
+            table_column = get_column_table_name(table_field)
+            if (table_column is not None and
+                    table_column not in TRIGRAM_INDEXED_COLUMNS):
+                log.debug('%s.%s is searched but has no trigram index' %
+                          table_column)
+
         def _like(value):
             return Like(StoqNormalizeString(table_field),
                         StoqNormalizeString(u'%%%s%%' % value.lower()),
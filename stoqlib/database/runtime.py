@@ -23,20 +23,27 @@
 ##
 """ Runtime routines for applications"""
 
+import collections
 from collections import namedtuple
+import json
 import logging
 import sys
+import time
 import warnings
+import uuid
 import weakref
 import os
 
 from kiwi.component import get_utility, provide_utility
 from storm import Undef
-from storm.expr import SQL, Avg
-from storm.info import get_obj_info
-from storm.store import Store, ResultSet
+from storm.database import convert_param_marks
+from storm.expr import SQL, Avg, State
+from storm.info import get_cls_info, get_obj_info
+from storm.references import Reference
+from storm.store import AutoReload, PENDING_ADD, Store, ResultSet
 from storm.tracer import trace
 
+from stoqlib.database.changes import publish_changes
 from stoqlib.database.exceptions import InterfaceError, OperationalError
 from stoqlib.database.interfaces import (
     ICurrentBranch,
@@ -63,6 +70,9 @@ _default_store = None
 #: should not be used by anything except autoreload_object()
 _stores = weakref.WeakSet()
 
+#: the counters of all the commits done, see get_commit_stats()
+_commit_stats = collections.Counter()
+
 
 def autoreload_object(obj, obj_store=False):
     """Autoreload object in any other existing store.
@@ -85,7 +95,58 @@ def autoreload_object(obj, obj_store=False):
             store.autoreload(alive)
 
 
+def autoreload_rows(table, ids=None):
+    """Autoreload the objects of rows changed by another process
+
+    This will go through every open store and mark the objects of the
+    rows alive on it for autoreload. Objects with pending changes are
+    left alone.
+
+    :param table: the name of the table
+    :param ids: the ids of the rows, or ``None`` to autoreload all
+      the objects of the table
+    """
+    for store in _stores:
+        if store.obsolete:
+            continue
+        for (cls, primary_values), obj in store._alive.items():
+            if get_cls_info(cls).table.name != table:
+                continue
+            if ids is not None and primary_values[0] not in ids:
+                continue
+            if not store._is_dirty(get_obj_info(obj)):
+                store.autoreload(obj)
+
+
+def get_commit_stats():
+    """Get the counters of the commits done by the stores of this process
+
+    The time is in seconds and it is split in the time spent flushing,
+    running the on_create/on_update hooks, committing on the database and
+    autoreloading the objects on the other stores. See also
+    :attr:`StoqlibStore.last_commit_stats`.
+
+    :returns: a dict with the number of ``commits``, the number of
+      ``objects`` changed by them and the ``flush``, ``hooks``,
+      ``commit``, ``autoreload`` and ``total`` times
+    """
+    return dict(_commit_stats)
+
+
 class StoqlibResultSet(ResultSet):
+    #: The default number of rows fetched at a time by :meth:`.stream_iter`
+    STREAM_FETCH_SIZE = 1000
+
+    _prefetch_paths = ()
+
+    def __iter__(self):
+        if not self._prefetch_paths:
+            return super(StoqlibResultSet, self).__iter__()
+
+        objs = list(super(StoqlibResultSet, self).__iter__())
+        self._store.prefetch(objs, *self._prefetch_paths)
+        return iter(objs)
+
     # FIXME: Remove. See bug 4985
     def __nonzero__(self):
         warnings.warn("use self.is_empty()", DeprecationWarning, stacklevel=2)
@@ -138,6 +199,47 @@ class StoqlibResultSet(ResultSet):
 
         return values
 
+    def prefetch(self, *paths):
+        """Loads references of the results together with them
+
+        Accessing a reference (e.g. ``item.sellable``) does one query per
+        object. This returns a copy of this result set that, when
+        iterated, will load the references on *paths* for all the results
+        at once, using one query per reference, and link them to the
+        objects, so accessing them later won't query the database.
+        See :meth:`StoqlibStore.prefetch` for more information.
+
+        For example, to show the items of a sale::
+
+            items = sale.get_items().prefetch('sellable.unit',
+                                              'sellable.product')
+
+        :param paths: dotted attribute paths starting on the objects of
+          this result set
+        :returns: a copy of this result set
+        """
+        resultset = self.copy()
+        resultset._prefetch_paths = self._prefetch_paths + paths
+        return resultset
+
+    def estimate_count(self):
+        """Get the number of results estimated by the query planner
+
+        Unlike :meth:`.count`, the query is not executed, so this is fast
+        even for huge results, but the number can be far from the real one.
+
+        :returns: the estimated number of results
+        """
+        connection = self._store._connection
+        state = State()
+        statement = connection.compile(self._get_select(), state)
+        plan = self._store.execute('EXPLAIN (FORMAT JSON) ' + statement,
+                                   state.parameters).get_one()[0]
+        # Older psycopg2 versions don't convert json values
+        if isinstance(plan, basestring):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
     def find(self, *args, **kwargs):
         # We only need this workaround if we are querying a viewable and the
         # viewable has a group_by
@@ -173,8 +275,7 @@ class StoqlibResultSet(ResultSet):
         else:
             return objects[0]
 
-    def fast_iter(self):
-        # First build all named tuples
+    def _build_named_tuples(self):
         named_tuples = []
         for is_expr, info in self._find_spec._cls_spec_info:
             if is_expr:
@@ -182,6 +283,43 @@ class StoqlibResultSet(ResultSet):
             else:
                 named_tuples.append(namedtuple(info.cls.__name__,
                                                [i.name for i in info.columns]))
+        return named_tuples
+
+    def _execute_server_side(self, fetch_size):
+        connection = self._store._connection
+        state = State()
+        statement = connection.compile(self._get_select(), state)
+        statement = convert_param_marks(statement, "?", connection.param_mark)
+        if type(statement) is unicode:
+            # psycopg2 doesn't like unicode statements
+            statement = statement.encode('utf-8')
+        params = tuple(connection.to_database(state.parameters))
+
+        # Giving the cursor a name makes psycopg2 declare a server side
+        # cursor. Rows will be fetched fetch_size at a time instead of
+        # being buffered on the client all at once.
+        raw_cursor = connection._raw_connection.cursor(
+            'stoq_stream_%s' % (uuid.uuid4().hex, ))
+        raw_cursor.arraysize = fetch_size
+        raw_cursor.itersize = fetch_size
+
+        trace('connection_raw_execute', connection, raw_cursor,
+              statement, params)
+        try:
+            raw_cursor.execute(statement, params)
+        except Exception as e:
+            trace('connection_raw_execute_error', connection, raw_cursor,
+                  statement, params, e)
+            raw_cursor.close()
+            raise
+        trace('connection_raw_execute_success', connection, raw_cursor,
+              statement, params)
+
+        return connection.result_factory(connection, raw_cursor), raw_cursor
+
+    def fast_iter(self):
+        # First build all named tuples
+        named_tuples = self._build_named_tuples()
 
         is_viewable = hasattr(self, '_viewable')
         # Then interate over the results bypassing storm object creation
@@ -191,6 +329,45 @@ class StoqlibResultSet(ResultSet):
                 value = self._load_viewable(value)
             yield value
 
+    def stream_iter(self, fetch_size=None, fast=False):
+        """Iterate over the results using a server side cursor
+
+        Normal iteration makes psycopg2 buffer the whole result on the
+        client before the first row is returned. This will use a named
+        (server side) cursor instead, fetching *fetch_size* rows at a time,
+        so the memory used is the same no matter how many rows the
+        query returns.
+
+        Note that the cursor only lives inside the current transaction, so
+        the store should not be committed or rolled back while iterating.
+
+        :param fetch_size: how many rows to fetch from the server at a time.
+            If ``None``, :attr:`.STREAM_FETCH_SIZE` will be used
+        :param fast: if ``True``, the objects will be loaded as namedtuples,
+            just like :meth:`.fast_iter` does
+        """
+        if fetch_size is None:
+            fetch_size = self.STREAM_FETCH_SIZE
+        if fetch_size < 1:
+            raise ValueError("fetch_size must be a positive integer")
+
+        if fast:
+            named_tuples = self._build_named_tuples()
+        is_viewable = hasattr(self, '_viewable')
+
+        result, raw_cursor = self._execute_server_side(fetch_size)
+        try:
+            for values in result:
+                if fast:
+                    value = self._load_fast_object(named_tuples, values)
+                    if is_viewable:
+                        value = self._load_viewable(value)
+                else:
+                    value = self._load_objects(result, values)
+                yield value
+        finally:
+            raw_cursor.close()
+
 
 class StoqlibStore(Store):
     """The Stoqlib Store.
@@ -226,6 +403,18 @@ class StoqlibStore(Store):
 
     _result_set_factory = StoqlibResultSet
 
+    #: The maximum number of ids in a query done by :meth:`.prefetch`
+    PREFETCH_CHUNK_SIZE = 500
+
+    #: If the transaction entries of the objects being created should be
+    #: allocated by :meth:`.flush`, all at once, instead of by the te_id
+    #: column default, one INSERT for each object
+    batch_transaction_entries = True
+
+    #: If the rows changed by the store should be notified to the other
+    #: stations when it is committed, see :mod:`stoqlib.database.changes`
+    publish_changes = True
+
     def __init__(self, database=None, cache=None):
         """
         Creates a new store
@@ -236,6 +425,15 @@ class StoqlibStore(Store):
         self._committing = False
         self._savepoints = []
         self._pending_count = [0]
+        # The ids of the rows flushed since the last commit, by table
+        self._changes = {}
+        # The obj_infos of the objects flushed since the last commit, and
+        # the ones that still need the before-commited event emitted
+        self._touched = set()
+        self._hooks_pending = set()
+        self._commit_timings = collections.Counter()
+        #: The counters of the last commit, like :func:`get_commit_stats`
+        self.last_commit_stats = None
         self.retval = True
         self.obsolete = False
 
@@ -436,24 +634,36 @@ class StoqlibStore(Store):
         """
         self._check_obsolete()
         self._committing = True
-
-        # the cache will be cleared when commiting, so store them here
-        # and autoreload them after commit
-        touched_objs = []
-        for obj_info in self._cache.get_cached():
-            obj = obj_info.get_obj()
-            if obj is not None:
-                touched_objs.append(obj)
+        self._commit_timings.clear()
+        start = time.time()
 
         super(StoqlibStore, self).commit()
         trace('transaction_commit', self)
+        committed = time.time()
 
         self._pending_count = [0]
         self._savepoints = []
 
-        # Reload objects on all other opened stores
-        for obj in touched_objs:
-            autoreload_object(obj)
+        # Reload the objects changed by this transaction on all other
+        # opened stores. Only them, this store may have a lot of objects
+        # cached that were not changed at all.
+        touched, self._touched = self._touched, set()
+        for obj_info in touched:
+            obj = obj_info.get_obj()
+            if obj is not None:
+                autoreload_object(obj)
+
+        end = time.time()
+        stats = dict(self._commit_timings)
+        stats.update(objects=len(touched),
+                     commit=(committed - start - stats.get('flush', 0) -
+                             stats.get('hooks', 0)),
+                     autoreload=end - committed,
+                     total=end - start)
+        self.last_commit_stats = stats
+        _commit_stats.update(stats)
+        _commit_stats['commits'] += 1
+        log.debug('commit: %(objects)d objects, %(total).3fs' % stats)
 
         if close:
             self.close()
@@ -468,26 +678,66 @@ class StoqlibStore(Store):
         will execute the sql on the transaction, but only will be
         commited when :meth:`.commit` is called.
         """
+        if self.batch_transaction_entries:
+            self._allocate_transaction_entries()
+        flushed = list(self._dirty)
+        start = time.time()
         super(StoqlibStore, self).flush()
+        self._touched.update(flushed)
+        self._hooks_pending.update(flushed)
+        if self.publish_changes:
+            self._add_changes(flushed)
 
         # We only call 'before-commited' when flush is being called by commit
         if not self._committing:
             return
+        self._commit_timings['flush'] += time.time() - start
 
         # We need to block implicit flushes here since if a lot of objects are
         # updated at once, and those objects fetch other objects from the
         # databas during the before-commited hook, the store.get call would
         # trigger another flush and that would end up in an maximum recursion
         # depth error.
+        # Only the objects flushed since the last commit can have pending
+        # hooks, there's no need to go through the whole cache
+        start = time.time()
+        hooks_pending, self._hooks_pending = self._hooks_pending, set()
         self.block_implicit_flushes()
-        for obj_info in self._cache.get_cached():
+        for obj_info in hooks_pending:
             obj_info.event.emit("before-commited")
         self.unblock_implicit_flushes()
+        self._commit_timings['hooks'] += time.time() - start
 
         # If objs got dirty when calling the hooks, flush again
         if self._dirty:
             self.flush()
 
+        # This is the last thing done in the transaction before it is
+        # commited (the flush above will have published everything already)
+        self._publish_changes()
+
+    def allocate_transaction_entries(self, count):
+        """Create transaction entries for objects that will be created
+
+        The entries are created just like the te_id column default would
+        (the ``new_te()`` function), but with a single statement.
+
+        :param count: how many entries to create
+        :returns: a list with the ids of the entries
+        """
+        if count <= 0:
+            return []
+        # This is called by flush, so don't flush again
+        self.block_implicit_flushes()
+        try:
+            result = self.execute(
+                u"INSERT INTO transaction_entry (te_time, dirty) "
+                u"SELECT STATEMENT_TIMESTAMP(), true "
+                u"FROM generate_series(1, ?) RETURNING id", (count, ))
+            return [te_id for (te_id, ) in result]
+        finally:
+            self.unblock_implicit_flushes()
+
     @public(since="1.5.0")
     def rollback(self, name=None, close=True):
         """Rollback the transaction
@@ -506,6 +756,9 @@ class StoqlibStore(Store):
             # If we rollback completely, we need to clear all savepoints
             self._savepoints = []
             self._pending_count = [0]
+            self._changes = {}
+            self._touched = set()
+            self._hooks_pending = set()
 
         # Rolling back resets the application name.
         self._setup_application_name()
@@ -548,6 +801,32 @@ class StoqlibStore(Store):
         else:
             raise TypeError("obj must be a ORMObject or a Viewable, not %r" % (obj, ))
 
+    def prefetch(self, objs, *paths):
+        """Loads the references of the given objects in batches
+
+        Each path is a dotted chain of attributes, like
+        ``'sellable.product.storable'``. For each step of the chain, all
+        the referenced objects are loaded with a single
+        ``SELECT ... WHERE id IN (...)`` query (or a few of them, for
+        lots of objects) and linked to the objects referencing them,
+        just like accessing the reference would do.
+
+        Steps that are not storm references (e.g. a :class:`Viewable`
+        attribute holding a domain object) are simply read from the
+        objects, so ``'sale.client.person'`` works on a ``SaleView``.
+
+        :param objs: a sequence of objects
+        :param paths: dotted attribute paths starting on *objs*
+        :returns: *objs*
+        """
+        for path in paths:
+            current = objs
+            for name in path.split('.'):
+                current = self._prefetch_attribute(current, name)
+                if not current:
+                    break
+        return objs
+
     def remove(self, obj):
         """Remove an objet from the store
 
@@ -626,6 +905,100 @@ class StoqlibStore(Store):
     #  Private
     #
 
+    def _prefetch_attribute(self, objs, name):
+        by_class = collections.OrderedDict()
+        for obj in objs:
+            if obj is not None:
+                by_class.setdefault(type(obj), []).append(obj)
+
+        values = collections.OrderedDict()
+        for cls, cls_objs in by_class.items():
+            reference = getattr(cls, name, None)
+            if not isinstance(reference, Reference):
+                if not hasattr(cls, name):
+                    raise AttributeError("%s has no attribute %s" % (
+                        cls.__name__, name))
+                for obj in cls_objs:
+                    value = getattr(obj, name)
+                    if value is not None:
+                        values[id(value)] = value
+                continue
+
+            for remote in self._prefetch_reference(reference, name, cls_objs):
+                values[id(remote)] = remote
+
+        return values.values()
+
+    def _prefetch_reference(self, reference, name, objs):
+        # pylint: disable=W0212
+        relation = reference._relation
+        # pylint: enable=W0212
+        if len(relation.local_key) != 1:
+            # Composed keys are not used by the domain, let storm load them
+            remotes = [getattr(obj, name) for obj in objs]
+            return [remote for remote in remotes if remote is not None]
+
+        loaded = []
+        pending = collections.OrderedDict()
+        for obj in objs:
+            remote = relation.get_remote(obj)
+            if remote is not None:
+                loaded.append(remote)
+                continue
+            value = relation.get_local_variables(obj)[0].get()
+            if value is not None:
+                pending.setdefault(value, []).append(obj)
+
+        remote_column = relation.remote_key[0]
+        keys = pending.keys()
+        for i in range(0, len(keys), self.PREFETCH_CHUNK_SIZE):
+            chunk = keys[i:i + self.PREFETCH_CHUNK_SIZE]
+            remotes = self.find(relation.remote_cls,
+                                remote_column.is_in(chunk))
+            for remote in remotes:
+                value = get_obj_info(remote).variables[remote_column].get()
+                for obj in pending.get(value, []):
+                    relation.link(obj, remote)
+                loaded.append(remote)
+
+        return loaded
+
+    def _allocate_transaction_entries(self):
+        variables = []
+        for obj_info in self._dirty:
+            if obj_info.get('pending') is not PENDING_ADD:
+                continue
+            column = getattr(obj_info.cls_info.cls, 'te_id', None)
+            variable = obj_info.variables.get(column)
+            if variable is not None and variable.get_lazy() is AutoReload:
+                variables.append(variable)
+
+        te_ids = self.allocate_transaction_entries(len(variables))
+        for variable, te_id in zip(variables, te_ids):
+            # from_db=True since the entry is already on the database
+            # and this shouldn't be seen as a change to the object
+            variable.set(te_id, from_db=True)
+
+    def _add_changes(self, obj_infos):
+        for obj_info in obj_infos:
+            primary_vars = obj_info.primary_vars
+            if len(primary_vars) != 1:
+                continue
+            row_id = primary_vars[0].get()
+            if row_id is None:
+                continue
+            table = obj_info.cls_info.table.name
+            self._changes.setdefault(table, set()).add(row_id)
+
+    def _publish_changes(self):
+        changes, self._changes = self._changes, {}
+        # This is called by flush, so don't flush again
+        self.block_implicit_flushes()
+        try:
+            publish_changes(self, changes)
+        finally:
+            self.unblock_implicit_flushes()
+
     def _setup_application_name(self):
         """Sets a friendly name for postgres connection
 
@@ -50,7 +50,8 @@ _tables = [
     ('account', ['Account',
                  'AccountTransaction',
                  'BankAccount',
-                 'BillOption']),
+                 'BillOption',
+                 'AccountBalanceDaily']),
     ('profile', ["UserProfile", "ProfileSettings"]),
     ('person', ["Person"]),
     ('address', ["CityLocation", "Address"]),
@@ -73,7 +74,8 @@ _tables = [
                 "ClientCategory",
                 "ClientSalaryHistory",
                 "CreditCheckHistory",
-                "UserBranchAccess"]),
+                "UserBranchAccess",
+                "ClientCreditLedger"]),
     ('synchronization', ["BranchSynchronization"]),
     ('station', ["BranchStation"]),
     ('till', ["Till", "TillEntry"]),
@@ -114,7 +116,8 @@ _tables = [
                  "ProductAttribute",
                  "ProductOptionMap",
                  "Storable",
-                 'StorableBatch']),
+                 'StorableBatch',
+                 'ProductStockSummary']),
     ('purchase', ["PurchaseOrder",
                   "Quotation",
                   "PurchaseItem",
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Tests for module :class:`stoqlib.database.bulkinsert`"""
+
+from stoqlib.database.bulkinsert import BulkInserter
+from stoqlib.domain.person import Client, Person
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+class TestBulkInserter(DomainTest):
+    def test_add_flush(self):
+        inserter = BulkInserter(self.store, chunk_size=2)
+        person_ids = []
+        for i in range(5):
+            person_id = inserter.add(Person, name=u'Bulk person %d' % i)
+            inserter.add(Client, person_id=person_id)
+            person_ids.append(person_id)
+        self.assertEqual(len(inserter), 10)
+
+        self.assertEqual(inserter.flush(), 10)
+        self.assertEqual(len(inserter), 0)
+        self.assertEqual(inserter.inserted, 10)
+        # Nothing else to insert
+        self.assertEqual(inserter.flush(), 0)
+
+        clients = self.store.find(Client, Client.person_id.is_in(person_ids))
+        self.assertEqual(clients.count(), 5)
+        for client in clients:
+            self.assertTrue(client.person.name.startswith(u'Bulk person'))
+            # The python default was used
+            self.assertEqual(client.status, Client.STATUS_SOLVENT)
+            # And the database default too
+            self.assertIsNotNone(client.te)
+
+    def test_add_invalid_column(self):
+        inserter = BulkInserter(self.store)
+        with self.assertRaisesRegexp(TypeError, 'Person has no columns '
+                                                'named foo'):
+            inserter.add(Person, name=u'Foo', foo=1)
+        self.assertEqual(len(inserter), 0)
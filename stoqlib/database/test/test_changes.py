@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Tests for module :class:`stoqlib.database.changes`"""
+
+import json
+
+import mock
+
+from stoqlib.database.changes import (ChangeListener, build_payloads,
+                                      get_classes_for_table,
+                                      MAX_IDS_PER_TABLE, MAX_PAYLOAD_SIZE)
+from stoqlib.domain.parameter import ParameterData
+from stoqlib.domain.person import Client, Person
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+def _get_payload(changes, origin=u'other-station:1'):
+    return json.dumps({'origin': origin, 'changes': changes})
+
+
+class TestChanges(DomainTest):
+    def test_get_classes_for_table(self):
+        self.assertIn(Person, get_classes_for_table('person'))
+        self.assertIn(Client, get_classes_for_table('client'))
+        self.assertEqual(get_classes_for_table('no_such_table'), [])
+
+    def test_build_payloads(self):
+        payloads = build_payloads({'person': set([u'1', u'2']),
+                                   'client': set([u'3'])})
+        self.assertEqual(len(payloads), 1)
+        self.assertEqual(json.loads(payloads[0])['changes'],
+                         {u'client': [u'3'], u'person': [u'1', u'2']})
+
+        # Too many ids, the whole table is considered changed
+        ids = set(unicode(i) for i in range(MAX_IDS_PER_TABLE + 1))
+        payloads = build_payloads({'person': ids})
+        self.assertEqual(json.loads(payloads[0])['changes'],
+                         {u'person': None})
+
+    def test_build_payloads_split(self):
+        ids = set(u'%036d' % i for i in range(MAX_IDS_PER_TABLE))
+        changes = {'person': ids, 'client': ids, 'sale': set([u'1'])}
+        payloads = build_payloads(changes)
+        self.assertTrue(len(payloads) > 2)
+
+        received = {}
+        for payload in payloads:
+            self.assertTrue(len(payload) <= MAX_PAYLOAD_SIZE)
+            for table, table_ids in json.loads(payload)['changes'].items():
+                received.setdefault(table, set()).update(table_ids)
+        self.assertEqual(received, changes)
+
+    def test_build_payloads_split_whole_table(self):
+        # An id big enough to almost fill the payload, so the whole table
+        # entry of 'sale' has to go to the next one
+        empty = build_payloads({'person': set([u''])})[0]
+        big_id = u'x' * (MAX_PAYLOAD_SIZE - len(empty) - 5)
+        sale_ids = set(unicode(i) for i in range(MAX_IDS_PER_TABLE + 1))
+        payloads = build_payloads({'person': set([big_id]),
+                                   'sale': sale_ids})
+        self.assertEqual(len(payloads), 2)
+        for payload in payloads:
+            self.assertTrue(len(payload) <= MAX_PAYLOAD_SIZE)
+        self.assertEqual(json.loads(payloads[0])['changes'],
+                         {u'person': [big_id]})
+        self.assertEqual(json.loads(payloads[1])['changes'],
+                         {u'sale': None})
+
+    def test_store_changes(self):
+        person = self.create_person()
+        self.store.flush()
+        self.assertIn(person.id, self.store._changes['person'])
+
+        person.name = u'Changed'
+        client = self.create_client(person=person)
+        self.store.flush()
+        with mock.patch('stoqlib.database.runtime.publish_changes') as publish:
+            self.store._publish_changes()
+        changes = publish.call_args[0][1]
+        self.assertIn(person.id, changes['person'])
+        self.assertIn(client.id, changes['client'])
+        self.assertEqual(self.store._changes, {})
+
+    def test_apply_payloads(self):
+        person = self.create_person()
+        self.store.flush()
+        listener = ChangeListener(None)
+        callback = mock.Mock()
+        listener.add_callback(callback)
+
+        with mock.patch.object(self.store, 'autoreload') as autoreload:
+            listener.apply_payloads([_get_payload({'person': [u'xxx']})])
+            self.assertFalse(autoreload.called)
+            callback.assert_called_once_with('person', set([u'xxx']))
+
+            listener.apply_payloads(['invalid', _get_payload(
+                {'person': [person.id]})])
+            autoreload.assert_called_once_with(person)
+
+            # Everything changed on the table
+            autoreload.reset_mock()
+            listener.apply_payloads([_get_payload({'person': None})])
+            autoreload.assert_any_call(person)
+
+            # Objects with pending changes are left alone
+            autoreload.reset_mock()
+            person.name = u'Changed'
+            listener.apply_payloads([_get_payload({'person': None})])
+            self.assertNotIn(mock.call(person), autoreload.call_args_list)
+
+    def test_apply_payloads_own_changes(self):
+        listener = ChangeListener(None)
+        callback = mock.Mock()
+        listener.add_callback(callback)
+        with mock.patch('stoqlib.database.changes.get_origin') as get_origin:
+            get_origin.return_value = u'this-station:1'
+            listener.apply_payloads([_get_payload(
+                {'person': [u'xxx']}, origin=u'this-station:1')])
+        self.assertFalse(callback.called)
+
+    def test_apply_payloads_sysparam(self):
+        listener = ChangeListener(None)
+        param = self.store.find(ParameterData).any()
+        with mock.patch('stoqlib.lib.parameters.sysparam.clear_cache') as clear:
+            listener.apply_payloads([_get_payload(
+                {'parameter_data': [param.id]})])
+        clear.assert_called_once_with()
+
+    def test_apply_payloads_cached_function(self):
+        listener = ChangeListener(None)
+        with mock.patch('stoqlib.lib.decorators.invalidate_dependent_caches') as invalidate:
+            listener.apply_payloads([_get_payload({'client': [u'xxx']})])
+        invalidate.assert_any_call(Client)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Tests for module :class:`stoqlib.database.pagination`"""
+
+import mock
+from storm.expr import Like
+
+from stoqlib.database.pagination import KeysetPaginator
+from stoqlib.domain.person import Person
+from stoqlib.domain.test.domaintest import DomainTest
+
+
+class _Paginator(KeysetPaginator):
+    BOOKMARK_INTERVAL = 3
+    COUNT_LIMIT = 5
+    COUNT_MARGIN = 1
+
+
+class TestKeysetPaginator(DomainTest):
+    def setUp(self):
+        super(TestKeysetPaginator, self).setUp()
+        # Some repeated names, to make sure the id is used to break ties
+        for name in [u'Page 3', u'Page 1', u'Page 2', u'Page 1', u'Page 5',
+                     u'Page 4', u'Page 2', u'Page 6']:
+            self.create_person(name=name)
+        self.store.flush()
+        self.result = self.store.find(Person, Like(Person.name, u'Page %'))
+
+    def _get_paginator(self, descending=False, count=None):
+        return _Paginator(self.result, Person.name, Person.id,
+                          lambda p: (p.name, p.id), descending=descending,
+                          count=count)
+
+    def _get_expected(self, descending=False):
+        return sorted(self.result, key=lambda p: (p.name, p.id),
+                      reverse=descending)
+
+    def test_get_rows(self):
+        paginator = self._get_paginator(count=8)
+        expected = self._get_expected()
+        self.assertEqual(paginator.get_rows(0, 2), expected[0:2])
+        self.assertEqual(paginator.get_rows(2, 5), expected[2:5])
+        # Jump ahead and then backwards
+        self.assertEqual(paginator.get_rows(6, 8), expected[6:8])
+        self.assertEqual(paginator.get_rows(5, 6), expected[5:6])
+        self.assertEqual(paginator.get_rows(1, 4), expected[1:4])
+        self.assertEqual(paginator.get_rows(7, 20), expected[7:8])
+        self.assertEqual(paginator.get_rows(8, 10), [])
+
+    def test_get_rows_descending(self):
+        paginator = self._get_paginator(descending=True, count=8)
+        expected = self._get_expected(descending=True)
+        self.assertEqual(paginator.get_rows(0, 3), expected[0:3])
+        self.assertEqual(paginator.get_rows(5, 8), expected[5:8])
+        self.assertEqual(paginator.get_rows(3, 5), expected[3:5])
+
+    def test_get_rows_null(self):
+        # NULLs are last on ascending orders and first on descending ones
+        for i, person in enumerate(self._get_expected()):
+            person.email = None if i % 3 == 0 else u'%d@example.com' % (i % 2)
+        self.store.flush()
+        for descending in [False, True]:
+            paginator = _Paginator(self.result, Person.email, Person.id,
+                                   lambda p: (p.email, p.id),
+                                   descending=descending, count=8)
+            expected = list(
+                self.result.copy().order_by(Person.email, Person.id))
+            if descending:
+                expected.reverse()
+            rows = []
+            for i in range(0, 9, 3):
+                rows.extend(paginator.get_rows(i, i + 3))
+            self.assertEqual(rows, expected)
+            # And backwards, from the end
+            paginator = _Paginator(self.result, Person.email, Person.id,
+                                   lambda p: (p.email, p.id),
+                                   descending=descending, count=8)
+            self.assertEqual(paginator.get_rows(4, 8), expected[4:8])
+
+    def test_load_bookmarks(self):
+        paginator = self._get_paginator()
+        # More than COUNT_LIMIT rows, the count is just an estimate
+        self.assertFalse(paginator.count_is_exact)
+
+        self.assertTrue(paginator.load_bookmarks())
+        self.assertTrue(paginator.load_bookmarks())
+        self.assertFalse(paginator.load_bookmarks())
+        self.assertTrue(paginator.count_is_exact)
+        self.assertEqual(paginator.count, 8)
+        self.assertFalse(paginator.load_bookmarks())
+
+        # The end is known now, the last rows can be read backwards
+        expected = self._get_expected()
+        self.assertEqual(paginator.get_rows(6, 8), expected[6:8])
+        self.assertEqual(paginator.get_rows(0, 8), expected)
+
+    def test_load_bookmarks_estimate(self):
+        with mock.patch.object(self.result, 'estimate_count',
+                               return_value=500000):
+            paginator = self._get_paginator()
+        # Only a little further than the COUNT_LIMIT + 1 rows known to exist
+        self.assertEqual(paginator.count, 7)
+        self.assertTrue(paginator.load_bookmarks())
+        self.assertEqual(paginator.count, 7)
+        # The bookmark on the position 5, the 6th row
+        self.assertTrue(paginator.load_bookmarks())
+        self.assertEqual(paginator.count, 7)
+        self.assertFalse(paginator.load_bookmarks())
+        self.assertEqual(paginator.count, 8)
+
+        # Nor further than the estimate
+        with mock.patch.object(self.result, 'estimate_count',
+                               return_value=3):
+            paginator = self._get_paginator()
+        self.assertEqual(paginator.count, 6)
+
+    def test_count(self):
+        paginator = self._get_paginator(count=8)
+        self.assertTrue(paginator.count_is_exact)
+        self.assertEqual(paginator.count, 8)
+        self.assertFalse(paginator.load_bookmarks())
+
+        paginator = _Paginator(self.result.find(Person.name != u'Page 1'),
+                               Person.name, Person.id,
+                               lambda p: (p.name, p.id))
+        self.assertTrue(paginator.count_is_exact)
+        self.assertEqual(paginator.count, 6)
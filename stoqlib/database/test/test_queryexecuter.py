@@ -23,12 +23,16 @@
 ##
 """ This module tests stoq/database/database.py """
 
+import time
+
 import mock
+from storm.expr import SQL
 
 from stoqlib.domain.test.domaintest import DomainTest
-from stoqlib.domain.person import ClientCategory
-from stoqlib.database.queryexecuter import (QueryExecuter,
-                                            StringQueryState)
+from stoqlib.domain.person import ClientCategory, ClientView
+from stoqlib.database.queryexecuter import (AsyncQueryOperation, QueryExecuter,
+                                            StringQueryState,
+                                            TRIGRAM_INDEXED_COLUMNS)
 
 
 class QueryExecuterTest(DomainTest):
@@ -135,3 +139,62 @@ class QueryExecuterTest(DomainTest):
         finally:
             self.clean_domain([ClientCategory])
             self.store.commit()
+
+    def test_search_async_stats(self):
+        executer = self.qe._operation_executer
+        executed = executer.get_stats()['executed']
+        self._search_string_all_async(u'eye')
+
+        stats = self.qe.get_async_stats()
+        self.assertEqual(stats['queue_size'], 0)
+        self.assertEqual(stats['busy'], 0)
+        self.assertEqual(stats['executed'], executed + 1)
+        self.assertTrue(1 <= stats['workers'] <= executer.POOL_SIZE)
+        statement, wall_time = stats['timings'][-1]
+        self.assertTrue('client_category' in statement)
+        self.assertTrue(wall_time >= 0)
+
+    def test_search_async_cancel_waiting(self):
+        op = self.qe.search_async([
+            StringQueryState(filter=self.sfilter,
+                             mode=StringQueryState.CONTAINS_ALL,
+                             text=u'eye')])
+        op.cancel()
+        self.qe._operation_executer._queue.join()
+        self.assertEqual(op.status, op.STATUS_CANCELLED)
+
+    def test_search_async_cancel_executing(self):
+        executer = self.qe._operation_executer
+        op = AsyncQueryOperation(self.store, None, SQL('SELECT pg_sleep(10)'))
+        executer.schedule(op)
+        # Wait until the query is actually executing on the database
+        while op.status != op.STATUS_EXECUTING:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+        start = time.time()
+        op.cancel()
+        executer._queue.join()
+        self.assertEqual(op.status, op.STATUS_CANCELLED)
+        self.assertTrue(time.time() - start < 5)
+
+    def test_get_text_search_columns(self):
+        self.assertEqual(self.qe.get_text_search_columns(),
+                         set([('client_category', 'name')]))
+
+        qe = QueryExecuter(self.store)
+        qe.set_search_spec(ClientView)
+        qe.set_filter_columns(self.sfilter, ['name', 'cpf', 'status'])
+        self.assertEqual(qe.get_text_search_columns(),
+                         set([('person', 'name'), ('individual', 'cpf')]))
+
+    def test_trigram_indexes(self):
+        indexes = self.store.execute(
+            "SELECT tablename, indexdef FROM pg_indexes "
+            "WHERE indexdef LIKE '%trgm_ops%'").get_all()
+        for table, column in TRIGRAM_INDEXED_COLUMNS:
+            expr = 'stoq_normalize_string(%s)' % (column, )
+            found = [indexdef for tablename, indexdef in indexes
+                     if tablename == table and expr in indexdef]
+            self.assertTrue(found, "%s.%s has no trigram index" % (
+                table, column))
@@ -25,12 +25,14 @@
 """Tests for module :class:`stoqlib.database.runtime`"""
 
 import mock
+from storm.tracer import BaseStatementTracer, install_tracer, remove_tracer_type
 
 from stoqlib.database.exceptions import InterfaceError
 from stoqlib.database.properties import UnicodeCol
-from stoqlib.database.runtime import new_store
+from stoqlib.database.runtime import get_commit_stats, new_store
 from stoqlib.domain.base import Domain
 from stoqlib.domain.person import Person, Client, ClientView
+from stoqlib.domain.sale import SaleItem, SaleView
 from stoqlib.domain.test.domaintest import DomainTest
 
 
@@ -207,6 +209,34 @@ class StoqlibStoreTest(DomainTest):
         self.assertTrue(obj.te.dirty)
         store.close()
 
+    def test_batch_transaction_entries(self):
+        store = new_store()
+        objs = [WillBeCommitted(store=store) for i in range(3)]
+        with _TransactionEntryCounter() as counter:
+            store.flush()
+        # One statement for all the objects
+        self.assertEqual(counter.inserts, 1)
+        self.assertEqual(len(set(obj.te_id for obj in objs)), 3)
+        for obj in objs:
+            self.assertTrue(obj.te.dirty)
+            self.assertIsNotNone(obj.te.te_time)
+
+        # Updating is still tracked by the update_te rule
+        objs[0].te.dirty = False
+        store.flush()
+        objs[0].test_var = u'foo'
+        store.flush()
+        store.invalidate(objs[0].te)
+        self.assertTrue(objs[0].te.dirty)
+
+        store.batch_transaction_entries = False
+        obj = WillBeCommitted(store=store)
+        with _TransactionEntryCounter() as counter:
+            store.flush()
+        self.assertEqual(counter.inserts, 0)
+        self.assertTrue(obj.te.dirty)
+        store.rollback()
+
     def test_rollback_to_savepoint(self):
         obj = WillBeCommitted(store=self.store, test_var=u'XXX')
         obj2 = WillBeCommitted(store=self.store, test_var=u'foo')
@@ -329,6 +359,40 @@ class StoqlibStoreTest(DomainTest):
         self._assert_nothing_made(dummy_obj)
         obj.reset()
 
+    def test_commit_dirty_objects(self):
+        obj = WillBeCommitted(store=self.store, test_var=u'AAA')
+        other_obj = WillBeCommitted(store=self.store, test_var=u'BBB')
+        self.store.commit()
+        obj.reset()
+        other_obj.reset()
+
+        # Only the modified object is autoreloaded on the other stores,
+        # even with the other one cached
+        obj.test_var = u'CCC'
+        with mock.patch('stoqlib.database.runtime.autoreload_object') as autoreload:
+            self.store.commit()
+        self.assertCalledOnceWith(autoreload, obj)
+        self._assert_updated(obj)
+        self._assert_nothing_made(other_obj)
+
+        stats = self.store.last_commit_stats
+        self.assertEqual(stats['objects'], 1)
+        for counter in ['flush', 'hooks', 'commit', 'autoreload', 'total']:
+            self.assertTrue(stats[counter] >= 0)
+
+        # Flushed before the commit, the hooks are still called on it
+        obj.reset()
+        commits = get_commit_stats().get('commits', 0)
+        obj.test_var = u'DDD'
+        self.store.flush()
+        self.store.commit()
+        self._assert_updated(obj)
+        self.assertEqual(get_commit_stats()['commits'], commits + 1)
+
+        # Nothing changed
+        self.store.commit()
+        self.assertEqual(self.store.last_commit_stats['objects'], 0)
+
     #
     #  Private
     #
@@ -358,6 +422,31 @@ class StoqlibStoreTest(DomainTest):
         self.assertEqual(obj.on_update_called_count, 0)
 
 
+class _SelectCounter(BaseStatementTracer):
+    def __init__(self):
+        self.selects = 0
+
+    def connection_raw_execute(self, connection, cursor, statement, params):
+        if statement.startswith('SELECT'):
+            self.selects += 1
+
+    def __enter__(self):
+        install_tracer(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        remove_tracer_type(type(self))
+
+
+class _TransactionEntryCounter(_SelectCounter):
+    def __init__(self):
+        self.inserts = 0
+
+    def connection_raw_execute(self, connection, cursor, statement, params):
+        if statement.startswith('INSERT INTO transaction_entry'):
+            self.inserts += 1
+
+
 class TestStoqlibResultSet(DomainTest):
 
     def test_fast_iter_single_table(self):
@@ -396,3 +485,98 @@ class TestStoqlibResultSet(DomainTest):
         for obj, tpl in zip(results, results.fast_iter()):
             for prop in ['name', 'status', 'cpf']:
                 self.assertEqual(getattr(obj, prop), getattr(tpl, prop))
+
+    def test_stream_iter(self):
+        results = self.store.find(Person).order_by(Person.te_id)
+        # Make sure there are results so the test makes sense
+        assert results.count() > 2
+        streamed = list(results.stream_iter(fetch_size=2))
+        self.assertEqual(streamed, list(results))
+
+    def test_stream_iter_fast(self):
+        results = self.store.find((Person, Client.id),
+                                  Person.id == Client.person_id)
+        results = results.order_by(Person.te_id)
+
+        # Make sure there are results so the test makes sense
+        assert results.count()
+        for objs, tpls in zip(results, results.stream_iter(fast=True)):
+            self.assertEquals(objs[0].id, tpls[0].id)
+            self.assertEquals(objs[0].name, tpls[0].name)
+            self.assertEquals(objs[1], tpls[1])
+
+    def test_stream_iter_viewable(self):
+        results = self.store.find(ClientView).order_by(Client.te_id)
+        # Make sure there are results so the test makes sense
+        assert results.count()
+
+        for obj, streamed in zip(results, results.stream_iter(fetch_size=1)):
+            self.assertTrue(isinstance(streamed, ClientView))
+            for prop in ['id', 'name', 'status', 'cpf']:
+                self.assertEqual(getattr(obj, prop), getattr(streamed, prop))
+
+        for obj, tpl in zip(results, results.stream_iter(fast=True)):
+            for prop in ['name', 'status', 'cpf']:
+                self.assertEqual(getattr(obj, prop), getattr(tpl, prop))
+
+    def test_stream_iter_invalid_fetch_size(self):
+        results = self.store.find(Person)
+        with self.assertRaises(ValueError):
+            list(results.stream_iter(fetch_size=0))
+
+    def _create_sale_items(self):
+        sale = self.create_sale()
+        for i in range(3):
+            self.create_sale_item(sale=sale)
+        sale_id = sale.id
+        self.store.flush()
+        # Forget about the objects (and the references between them)
+        # created above, so they are loaded again from the database
+        self.store.reset()
+        return self.store.get(type(sale), sale_id)
+
+    def test_prefetch(self):
+        sale = self._create_sale_items()
+        items = sale.get_items().prefetch('sellable.product', 'sellable.unit')
+
+        with _SelectCounter() as counter:
+            items = list(items)
+        # One for the items, one for the sellables and one for the products.
+        # The sellables don't have units, so there's nothing to load
+        self.assertEqual(counter.selects, 3)
+        self.assertEqual(len(items), 3)
+
+        with _SelectCounter() as counter:
+            for item in items:
+                self.assertEqual(item.sellable.id, item.sellable_id)
+                self.assertEqual(item.sellable.product.id, item.sellable_id)
+        self.assertEqual(counter.selects, 0)
+
+    def test_prefetch_chunks(self):
+        sale = self._create_sale_items()
+        with mock.patch.object(self.store, 'PREFETCH_CHUNK_SIZE', 2):
+            with _SelectCounter() as counter:
+                items = list(sale.get_items().prefetch('sellable'))
+        # One for the items and two for the sellables
+        self.assertEqual(counter.selects, 3)
+        self.assertEqual(set(item.sellable.id for item in items),
+                         set(item.sellable_id for item in items))
+
+    def test_prefetch_viewable(self):
+        sale_id = self.create_sale(client=self.create_client()).id
+        self.store.flush()
+        self.store.reset()
+        views = self.store.find(SaleView, id=sale_id).prefetch('client.person')
+
+        with _SelectCounter() as counter:
+            view = list(views)[0]
+            self.assertEqual(view.client.person.name, u'Client')
+        # One for the view and one for the person
+        self.assertEqual(counter.selects, 2)
+
+    def test_prefetch_invalid_attribute(self):
+        self.create_sale_item()
+        items = self.store.find(SaleItem).prefetch('foobar')
+        with self.assertRaisesRegexp(AttributeError,
+                                     'SaleItem has no attribute foobar'):
+            list(items)
@@ -41,6 +41,7 @@ from stoqlib.database.orm import ORMObject
 from stoqlib.database.properties import IntCol, IdCol, UnicodeCol, Identifier
 from stoqlib.domain.events import DomainMergeEvent
 from stoqlib.domain.system import TransactionEntry
+from stoqlib.lib.decorators import invalidate_dependent_caches
 
 log = logging.getLogger(__name__)
 
@@ -145,6 +146,7 @@ class Domain(ORMObject):
             obj_info['stoq-status'] = None
         else:
             self.on_delete()
+            invalidate_dependent_caches(type(self))
 
         # This is emited right before the object is removed from the store.
         # We must also remove the transaction entry, but the entry should be
@@ -164,6 +166,10 @@ class Domain(ORMObject):
             self.on_create()
         elif stoq_pending == _OBJ_UPDATED:
             self.on_update()
+        else:
+            return
+
+        invalidate_dependent_caches(type(self))
 
     #
     # Public API
@@ -430,7 +436,8 @@ class Domain(ORMObject):
             yield value
 
     @classmethod
-    def get_max_value(cls, store, attr, validate_attr=True, query=Undef):
+    def get_max_value(cls, store, attr, validate_attr=True, query=Undef,
+                      counter=None):
         """Get the maximum value for a given attr
 
         On text columns, trying to find the max value for them using MAX()
@@ -443,11 +450,22 @@ class Domain(ORMObject):
 
         :para store: a store
         :param attr: the attribute to find the max value for
+        :param counter: the name of the counter the database keeps for
+          *attr*, e.g. ``u'sellable.code'`` (see patch-05-51.sql). When
+          there's no *query*, the value is read from it instead of
+          comparing the values of all the rows
         :returns: the maximum value for the attr
         """
         if validate_attr:
             cls.validate_attr(attr, expected_type=UnicodeCol)
 
+        if counter is not None and (query is Undef or query is None):
+            row = store.execute(u"""
+                SELECT lpad(max_value, max_length, '0')
+                    FROM max_value_counter WHERE name = ?""",
+                (counter, )).get_one()
+            return (row and row[0]) or u''
+
         max_length = Alias(
             Select(columns=[Alias(Max(CharLength(attr)), 'max_length')],
                    tables=[cls], where=query),
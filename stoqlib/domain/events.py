@@ -101,6 +101,30 @@ class ProductStockUpdateEvent(Event):
     """
 
 
+class SellableCreateEvent(Event):
+    """
+    This event is emitted when a |sellable| is created.
+
+    :param sellable: the created |sellable|
+    """
+
+
+class SellableEditEvent(Event):
+    """
+    This event is emitted when a |sellable| is edited.
+
+    :param sellable: the edited |sellable|
+    """
+
+
+class SellableRemoveEvent(Event):
+    """
+    This event is emitted when a |sellable| is about to be removed.
+
+    :param sellable: the removed |sellable|
+    """
+
+
 class SellableCheckTaxesEvent(Event):
     """
     This event is emitted to check the sellable fiscal data.
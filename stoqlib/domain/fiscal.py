@@ -282,21 +282,50 @@ class Invoice(Domain):
         super(Invoice, self).__init__(**kw)
 
     @classmethod
-    def get_next_invoice_number(cls, store, mode=None, series=None):
-        return Invoice.get_last_invoice_number(store, series, mode) + 1
+    def get_next_invoice_number(cls, store, mode=None, series=None,
+                                lock=False):
+        """Returns the next invoice number
+
+        :param store: a store
+        :param mode: the mode of the invoice
+        :param series: the series of the invoice
+        :param lock: see :meth:`.get_last_invoice_number`
+        :returns: an integer representing the next invoice number
+        """
+        return Invoice.get_last_invoice_number(store, series, mode,
+                                               lock=lock) + 1
 
     @classmethod
-    def get_last_invoice_number(cls, store, series=None, mode=None):
+    def get_last_invoice_number(cls, store, series=None, mode=None,
+                                lock=False):
         """Returns the last invoice number. If there is not an invoice
         number used, the returned value will be zero.
 
+        The number is read from a counter kept by the database for each
+        branch, series and mode (so this doesn't need to look at all the
+        invoices). Note that the counter never decreases, even if the
+        invoice using the last number is removed.
+
         :param store: a store
+        :param series: the series of the invoice
+        :param mode: the mode of the invoice
+        :param lock: if the counter should be locked until the end of the
+          transaction. Use this when the next number is going to be used
+          right away, so other stations will wait for this transaction
+          instead of getting the same number
         :returns: an integer representing the last sale invoice number
         """
         current_branch = get_current_branch(store)
-        last = store.find(cls, branch=current_branch, series=series,
-                          mode=mode).max(cls.invoice_number)
-        return last or 0
+        if lock:
+            query = u"SELECT lock_invoice_number_counter(?, ?, ?)"
+        else:
+            query = u"""
+                SELECT last_number FROM invoice_number_counter
+                    WHERE branch_id = ? AND
+                          COALESCE(series, -1) = COALESCE(?, -1) AND
+                          COALESCE(mode, '') = COALESCE(?, '')"""
+        row = store.execute(query, (current_branch.id, series, mode)).get_one()
+        return (row and row[0]) or 0
 
     def save_nfe_info(self, cnf, key):
         """ Save the CNF and KEY generated in NF-e.
@@ -60,14 +60,15 @@ import operator
 
 from kiwi.currency import currency
 from kiwi.datatypes import converter
-from storm.expr import (And, Coalesce, Eq, Join, LeftJoin, Or, Update, Select,
-                        Alias, Sum)
+from storm.expr import (And, Coalesce, Eq, Join, LeftJoin, Ne, Or, Update,
+                        Select, Alias, Sum)
 from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
 from zope.interface import implementer
 
 from stoqlib.database.expr import (Age, Case, Concat, Date, DateTrunc, Interval,
                                    Field, NotIn, StoqNormalizeString)
+from stoqlib.database.orm import ORMObject
 from stoqlib.database.properties import (BoolCol, DateTimeCol,
                                          IntCol, PercentCol,
                                          PriceCol, EnumCol,
@@ -1055,14 +1056,8 @@ class Client(Domain):
 
     @property
     def remaining_store_credit(self):
-        from stoqlib.domain.payment.views import InPaymentView
-        status_query = Or(InPaymentView.status == Payment.STATUS_PENDING,
-                          InPaymentView.status == Payment.STATUS_CONFIRMED)
-        query = And(InPaymentView.person_id == self.person.id,
-                    status_query,
-                    InPaymentView.method_name == u'store_credit')
-
-        debit = self.store.find(InPaymentView, query).sum(InPaymentView.value) or currency('0.0')
+        debit = ClientCreditLedger.get_balances(self.store,
+                                                self.person_id)[1]
         return currency(self.credit_limit - debit)
 
     def get_credit_transactions(self):
@@ -1096,16 +1091,7 @@ class Client(Domain):
         """Returns a client's credit balance.
 
         :returns: The client's credit balance."""
-        transactions = self.get_credit_transactions()
-
-        balance = 0
-        for payment in transactions:
-            if payment.payment_type == payment.TYPE_OUT:
-                balance += payment.paid_value
-            else:
-                balance -= payment.paid_value
-
-        return currency(balance)
+        return ClientCreditLedger.get_balances(self.store, self.person_id)[0]
 
     @property
     def salary(self):
@@ -1169,6 +1155,116 @@ class Client(Domain):
         return True
 
 
+class ClientCreditLedger(ORMObject):
+    """The credit balances of a |person|, used by its |client|
+
+    This holds the sums used by :obj:`Client.credit_account_balance`
+    and :obj:`Client.remaining_store_credit`, so they don't need to sum
+    all the payments of the client on every read.
+
+    This table is updated by triggers on payment and payment_group and
+    should never be modified directly. Use :meth:`.rebuild` if it ever
+    gets out of sync, which :meth:`.find_inconsistencies` can tell.
+    """
+
+    __storm_table__ = 'client_credit_ledger'
+    __storm_primary__ = 'person_id'
+
+    person_id = IdCol()
+
+    #: the |person| paying the payments
+    person = Reference(person_id, 'Person.id')
+
+    #: the paid values of the credit payments, the out ones giving credit
+    #: to the client and the in ones using it
+    credit_balance = PriceCol(default=0)
+
+    #: the values of the pending and confirmed in store credit payments
+    store_credit_debit = PriceCol(default=0)
+
+    @classmethod
+    def get_balances(cls, store, person_id):
+        """Get the credit balances of a |person|
+
+        :param store: a store
+        :param person_id: the id of the |person|
+        :returns: a (credit_balance, store_credit_debit) tuple
+        """
+        # Select just the values, the triggers may have changed them after
+        # the object was loaded, and this will flush the pending payments
+        balances = store.find(
+            (cls.credit_balance, cls.store_credit_debit),
+            cls.person_id == person_id).one()
+        if balances is None:
+            return currency(0), currency(0)
+        return balances
+
+    @classmethod
+    def rebuild(cls, store, person=None):
+        """Rebuild the ledger from the payments
+
+        :param store: a store
+        :param person: the |person| to rebuild the ledger of, or ``None``
+          to rebuild the whole ledger
+        """
+        person_id = person and person.id
+        store.execute(u"SELECT rebuild_client_credit_ledger(?)",
+                      (person_id, ))
+        store.invalidate()
+
+    @classmethod
+    def find_inconsistencies(cls, store):
+        """Compare the ledger to the sum of the payments
+
+        :param store: a store
+        :returns: a list of (person_id, ledger_balances, payments_balances)
+          tuples for every |person| whose ledger balances, a
+          (credit_balance, store_credit_debit) tuple, don't match the
+          ones calculated from the payments
+        """
+        expected = collections.defaultdict(lambda: [0, 0])
+        tables = [Payment,
+                  Join(PaymentGroup, PaymentGroup.id == Payment.group_id),
+                  Join(PaymentMethod, PaymentMethod.id == Payment.method_id)]
+
+        credit_payments = store.using(*tables).find(
+            (PaymentGroup.payer_id, Payment.payment_type,
+             Sum(Payment.paid_value)),
+            And(PaymentMethod.method_name == u'credit',
+                Payment.status == Payment.STATUS_PAID,
+                Ne(PaymentGroup.payer_id, None)))
+        credit_payments = credit_payments.group_by(PaymentGroup.payer_id,
+                                                   Payment.payment_type)
+        for person_id, payment_type, value in credit_payments:
+            if payment_type == Payment.TYPE_IN:
+                value = -value
+            expected[person_id][0] += value or 0
+
+        debits = store.using(*tables).find(
+            (PaymentGroup.payer_id, Sum(Payment.value)),
+            And(PaymentMethod.method_name == u'store_credit',
+                Payment.payment_type == Payment.TYPE_IN,
+                Payment.status.is_in([Payment.STATUS_PENDING,
+                                      Payment.STATUS_CONFIRMED]),
+                Ne(PaymentGroup.payer_id, None)))
+        for person_id, value in debits.group_by(PaymentGroup.payer_id):
+            expected[person_id][1] += value or 0
+
+        ledger = dict(
+            (person_id, (credit_balance, store_credit_debit))
+            for person_id, credit_balance, store_credit_debit in store.find(
+                (cls.person_id, cls.credit_balance, cls.store_credit_debit)))
+
+        inconsistencies = []
+        for person_id in set(expected) | set(ledger):
+            balances = ledger.get(person_id, (0, 0))
+            payments_balances = tuple(expected.get(person_id, (0, 0)))
+            if balances != payments_balances:
+                inconsistencies.append(
+                    (person_id, balances, payments_balances))
+        return inconsistencies
+
+
 @implementer(IActive)
 @implementer(IDescribable)
 class Supplier(Domain):
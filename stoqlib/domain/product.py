@@ -92,6 +92,7 @@ from zope.interface import implementer
 from stoqlib.database.expr import (Field, TransactionTimestamp,
                                    ArrayAgg, Contains, IsContainedBy,
                                    SplitPart)
+from stoqlib.database.orm import ORMObject
 from stoqlib.database.properties import (BoolCol, DateTimeCol, DecimalCol,
                                          EnumCol, IdCol, IntCol, PercentCol,
                                          PriceCol, QuantityCol, UnicodeCol)
@@ -696,7 +697,8 @@ class Product(Domain):
         """
         assert not self.child_exists(options)
 
-        new_code = Sellable.get_max_value(self.store, Sellable.code)
+        new_code = Sellable.get_max_value(self.store, Sellable.code,
+                                          counter=u'sellable.code')
 
         child = self.copy_product()
         child.parent = self
@@ -1139,6 +1141,47 @@ class ProductStockItem(Domain):
                                batch=self.batch)
 
 
+class ProductStockSummary(ORMObject):
+    """The stock of a |storable| on a |branch|
+
+    This is the sum of all the stock items of the storable on the branch
+    (there is one for each |batch|), used by the stock views so they don't
+    need to sum the stock items on every search.
+
+    This table is updated by a trigger on product_stock_item and should
+    never be modified directly. Use :meth:`.rebuild` if it ever gets out
+    of sync.
+    """
+
+    __storm_table__ = 'product_stock_summary'
+    __storm_primary__ = 'storable_id', 'branch_id'
+
+    storable_id = IdCol()
+
+    #: the |storable|
+    storable = Reference(storable_id, 'Storable.id')
+
+    branch_id = IdCol()
+
+    #: the |branch|
+    branch = Reference(branch_id, 'Branch.id')
+
+    #: the sum of the stock items quantities
+    stock = QuantityCol(default=0)
+
+    #: the sum of the stock items quantities times their stock cost
+    total_stock_cost = DecimalCol(default=0)
+
+    @classmethod
+    def rebuild(cls, store):
+        """Rebuild the whole summary from the stock items
+
+        :param store: a store
+        """
+        store.execute(u"SELECT rebuild_product_stock_summary()")
+        store.invalidate()
+
+
 class Storable(Domain):
     '''Storable represents the stock of a |product|.
 
@@ -1239,6 +1282,20 @@ class Storable(Domain):
         ProductStockUpdateEvent.emit(self.product, branch, old_quantity,
                                      stock_item.quantity)
 
+    @classmethod
+    def validate_stock_decrease(cls, stock_item, quantity):
+        """Verifies if *quantity* can be decreased from a stock item
+
+        :param stock_item: the |productstockitem| to decrease, or ``None``
+          if there is no stock item yet
+        :param quantity: the amount to decrease
+        :raises: :exc:`stoqlib.exceptions.StockError` if there is not
+          enough stock
+        """
+        if stock_item is None or quantity > stock_item.quantity:
+            raise StockError(
+                _('Quantity to decrease is greater than the available stock.'))
+
     def decrease_stock(self, quantity, branch, type, object_id,
                        cost_center=None, batch=None):
         """When receiving a product, update the stock reference for the sold item
@@ -1264,9 +1321,7 @@ class Storable(Domain):
             raise ValueError(u"branch cannot be None")
 
         stock_item = self.get_stock_item(branch, batch)
-        if stock_item is None or quantity > stock_item.quantity:
-            raise StockError(
-                _('Quantity to decrease is greater than the available stock.'))
+        self.validate_stock_decrease(stock_item, quantity)
 
         old_quantity = stock_item.quantity
         stock_transaction = StockTransactionHistory(
@@ -1470,7 +1525,9 @@ class StorableBatch(Domain):
     @classmethod
     def get_max_batch_number(cls, store):
         attr = SplitPart(cls.batch_number, u'-', 1)
-        return StorableBatch.get_max_value(store, attr, validate_attr=False)
+        return StorableBatch.get_max_value(
+            store, attr, validate_attr=False,
+            counter=u'storable_batch.batch_number')
 
     #
     #  Public API
@@ -40,6 +40,7 @@ from storm.info import ClassAlias
 from storm.references import Reference, ReferenceSet
 from zope.interface import implementer
 
+from stoqlib.database.bulkinsert import BulkInserter
 from stoqlib.database.expr import (Concat, Date, Distinct, Field, NullIf,
                                    TransactionTimestamp)
 from stoqlib.database.properties import (UnicodeCol, DateTimeCol, IntCol,
@@ -50,7 +51,7 @@ from stoqlib.database.runtime import (get_current_user,
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.address import Address, CityLocation
 from stoqlib.domain.base import Domain
-from stoqlib.domain.costcenter import CostCenter
+from stoqlib.domain.costcenter import CostCenter, CostCenterEntry
 from stoqlib.domain.event import Event
 from stoqlib.domain.events import (SaleStatusChangedEvent,
                                    SaleCanCancelEvent,
@@ -58,6 +59,7 @@ from stoqlib.domain.events import (SaleStatusChangedEvent,
                                    SaleItemBeforeDecreaseStockEvent,
                                    SaleItemBeforeIncreaseStockEvent,
                                    SaleItemAfterSetBatchesEvent,
+                                   ProductStockUpdateEvent,
                                    DeliveryStatusChangedEvent,
                                    StockOperationConfirmedEvent,
                                    ECFGetPrinterUserNumberEvent)
@@ -68,7 +70,8 @@ from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.person import (Person, Client, Branch, LoginUser,
                                    SalesPerson, Company, Individual,
                                    ClientCategory)
-from stoqlib.domain.product import (Product, ProductHistory, Storable,
+from stoqlib.domain.product import (Product, ProductHistory,
+                                    ProductStockItem, Storable,
                                     StockTransactionHistory, StorableBatch)
 from stoqlib.domain.returnedsale import ReturnedSale, ReturnedSaleItem
 from stoqlib.domain.sellable import Sellable, SellableCategory
@@ -298,10 +301,17 @@ class SaleItem(Domain):
     #  Public API
     #
 
-    def sell(self, branch):
-        store = self.store
+    def check_sell(self, branch):
+        """Verifies if this item can be sold on *branch*
+
+        This is called before decreasing the stock of the item, by
+        :meth:`.sell` and by :meth:`Sale.confirm` for the whole sale.
+
+        :param branch: the |branch| where the item is being sold
+        :raises: :exc:`stoqlib.exceptions.SellError` if it can't be sold
+        """
         if not (branch and
-                branch.id == get_current_branch(store).id):
+                branch.id == get_current_branch(self.store).id):
             raise SellError(_(u"Stoq still doesn't support sales for "
                               u"branch companies different than the "
                               u"current one"))
@@ -311,11 +321,14 @@ class SaleItem(Domain):
                               u"available first and then try again.") % (
                 self.sellable.get_description()))
 
-        # This is emitted here instead of inside the if bellow because one can
-        # connect on it and change this item in a way that, if it wasn't going
-        # to decrease stock before, it will after
+        # This is emitted here instead of where the stock is decreased
+        # because one can connect on it and change this item in a way that,
+        # if it wasn't going to decrease stock before, it will after
         SaleItemBeforeDecreaseStockEvent.emit(self)
 
+    def sell(self, branch):
+        self.check_sell(branch)
+
         quantity_to_decrease = self.quantity - self.quantity_decreased
         storable = self.sellable.product_storable
         if storable and quantity_to_decrease:
@@ -1071,13 +1084,8 @@ class Sale(Domain):
         assert self.branch
 
         # FIXME: We should use self.branch, but it's not supported yet
-        store = self.store
-        branch = get_current_branch(store)
-        for item in self.get_items():
-            self.validate_batch(item.batch, sellable=item.sellable)
-            if item.sellable.product:
-                ProductHistory.add_sold_item(store, branch, item)
-            item.sell(branch)
+        branch = get_current_branch(self.store)
+        self._sell_items(branch)
 
         self.total_amount = self.get_total_sale_amount()
 
@@ -1118,12 +1126,12 @@ class Sale(Domain):
                         u"confirmed with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
                     client_name=self.client.person.name,
-                    total_value=self.get_total_sale_amount())
+                    total_value=self.total_amount)
             else:
                 msg = _(u"Sale {sale_number} without a client was "
                         u"confirmed with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
-                    total_value=self.get_total_sale_amount())
+                    total_value=self.total_amount)
             Event.log(self.store, Event.TYPE_SALE, msg)
 
         StockOperationConfirmedEvent.emit(self, old_status)
@@ -1153,7 +1161,7 @@ class Sale(Domain):
                         u"and confirmed with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
                     client_name=self.client.person.name,
-                    total_value=self.get_total_sale_amount())
+                    total_value=self.total_amount)
             else:
                 msg = _(u"Sale {sale_number} without a client was paid "
                         u"and confirmed with value {total_value:.2f}.").format(
@@ -1165,7 +1173,7 @@ class Sale(Domain):
                         u"with value {total_value:.2f}.").format(
                     sale_number=self.identifier,
                     client_name=self.client.person.name,
-                    total_value=self.get_total_sale_amount())
+                    total_value=self.total_amount)
             else:
                 msg = _(u"Sale {sale_number} without a client was paid "
                         u"with value {total_value:.2f}.").format(
@@ -1282,7 +1290,7 @@ class Sale(Domain):
         """
         new_total = currency(0)
         items = []
-        for item in self.get_items():
+        for item in self.get_items().prefetch('sellable.product'):
             sellable = item.sellable
             if sellable.product and sellable.product.is_package:
                 # We should not set discount for package_products
@@ -1429,7 +1437,7 @@ class Sale(Domain):
         available_discount = currency(0)
         used_discount = currency(0)
 
-        for item in self.get_items():
+        for item in self.get_items().prefetch('sellable'):
             if item == exclude_item:
                 continue
             # Don't put surcharges on the discount, or it can end up negative
@@ -1804,6 +1812,109 @@ class Sale(Domain):
         # discount/surchage cannot have more than 2 decimal points
         return quantize(currency(perc_value))
 
+    def _sell_items(self, branch):
+        # This does the same as calling ProductHistory.add_sold_item and
+        # SaleItem.sell for each item, but big sales would do a lot of
+        # queries that way. Here the sellables, storables and stock items
+        # are fetched once, the stock is validated for the whole sale and
+        # the stock transactions are inserted in bulk
+        store = self.store
+        items = list(self.get_items())
+        sellable_ids = set(item.sellable_id for item in items)
+        # Sellable.product and Sellable.product_storable are resolved with
+        # a query each, so keep the products and storables by id
+        list(store.find(Sellable, Sellable.id.is_in(sellable_ids)))
+        products = dict((p.id, p) for p in
+                        store.find(Product, Product.id.is_in(sellable_ids)))
+        storables = dict((s.id, s) for s in
+                         store.find(Storable, Storable.id.is_in(sellable_ids)))
+        stock_items = {}
+        if storables:
+            query = And(ProductStockItem.branch_id == branch.id,
+                        ProductStockItem.storable_id.is_in(storables.keys()))
+            for stock_item in store.find(ProductStockItem, query):
+                key = (stock_item.storable_id, stock_item.batch_id)
+                stock_items[key] = stock_item
+
+        for item in items:
+            storable = storables.get(item.sellable_id)
+            if item.batch is not None or storable is not None:
+                self.validate_batch(item.batch, sellable=item.sellable,
+                                    storable=storable)
+            item.check_sell(branch)
+
+        # Validate the stock for the whole sale, the same stock item
+        # can be used by more than one item
+        to_decrease = []
+        decreased = collections.OrderedDict()
+        for item in items:
+            quantity = item.quantity - item.quantity_decreased
+            storable = storables.get(item.sellable_id)
+            if storable and quantity:
+                if quantity < 0:
+                    raise ValueError(_(u"quantity must be a positive number"))
+                key = (storable.id, item.batch_id)
+                decreased[key] = decreased.get(key, 0) + quantity
+            to_decrease.append((item, storable, quantity))
+
+        for key, quantity in decreased.items():
+            try:
+                Storable.validate_stock_decrease(stock_items.get(key),
+                                                 quantity)
+            except StockError as err:
+                raise SellError(str(err))
+
+        user = get_current_user(store)
+        sold_date = store.execute(Select(TransactionTimestamp())).get_one()[0]
+        inserter = BulkInserter(store)
+        for item, storable, quantity in to_decrease:
+            if item.sellable_id in products:
+                inserter.add(ProductHistory,
+                             branch_id=branch.id,
+                             sellable_id=item.sellable_id,
+                             quantity_sold=item.quantity,
+                             sold_date=sold_date)
+            if not (storable and quantity):
+                continue
+
+            stock_item = stock_items[(storable.id, item.batch_id)]
+            transaction_id = inserter.add(
+                StockTransactionHistory,
+                storable_id=storable.id,
+                branch_id=branch.id,
+                batch_id=item.batch_id,
+                quantity=-quantity,
+                unit_cost=stock_item.stock_cost,
+                responsible_id=user and user.id,
+                type=StockTransactionHistory.TYPE_SELL,
+                object_id=item.id)
+            if self.cost_center is not None:
+                assert self.cost_center.is_active
+                inserter.add(CostCenterEntry,
+                             cost_center_id=self.cost_center.id,
+                             stock_transaction_id=transaction_id)
+            item.average_cost = stock_item.stock_cost
+        inserter.flush()
+
+        for item, storable, quantity in to_decrease:
+            item.quantity_decreased += quantity
+            item.update_tax_values()
+
+        # The stock items were updated by the database when the
+        # transactions were inserted
+        quantities = collections.OrderedDict()
+        for (storable_id, batch_id), quantity in decreased.items():
+            stock_item = stock_items[(storable_id, batch_id)]
+            old_quantity, new_quantity = quantities.get(storable_id, (0, 0))
+            quantities[storable_id] = (
+                old_quantity + stock_item.quantity,
+                new_quantity + stock_item.quantity - quantity)
+            store.invalidate(stock_item)
+
+        for storable_id, (old_quantity, new_quantity) in quantities.items():
+            ProductStockUpdateEvent.emit(products[storable_id], branch,
+                                         old_quantity, new_quantity)
+
     def _add_inpayments(self, till=None):
         payments = self.payments
         if not payments.count():
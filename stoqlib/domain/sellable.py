@@ -48,7 +48,8 @@ from stoqlib.database.properties import (BoolCol, DateTimeCol, EnumCol,
                                          PriceCol, UnicodeCol)
 from stoqlib.domain.base import Domain
 from stoqlib.domain.events import (CategoryCreateEvent, CategoryEditEvent,
-                                   SellableCheckTaxesEvent)
+                                   SellableCheckTaxesEvent, SellableCreateEvent,
+                                   SellableEditEvent, SellableRemoveEvent)
 from stoqlib.domain.interfaces import IDescribable
 from stoqlib.domain.image import Image
 from stoqlib.exceptions import SellableError, TaxError
@@ -859,9 +860,16 @@ class Sellable(Domain):
     # Domain hooks
     #
 
+    def on_create(self):
+        SellableCreateEvent.emit(self)
+
     def on_update(self):
         obj = self.product or self.service
         obj.on_update()
+        SellableEditEvent.emit(self)
+
+    def on_delete(self):
+        SellableRemoveEvent.emit(self)
 
     def on_object_changed(self, attr, old_value, value):
         if attr == 'cost':
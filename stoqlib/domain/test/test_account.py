@@ -27,7 +27,8 @@ __tests__ = 'stoqlib/domain/account.py'
 import datetime
 from storm.exceptions import OrderLoopError
 
-from stoqlib.domain.account import (Account, AccountTransaction,
+from stoqlib.domain.account import (Account, AccountBalanceDaily,
+                                    AccountTransaction,
                                     AccountTransactionView,
                                     BillOption)
 from stoqlib.domain.purchase import PurchaseOrder
@@ -233,6 +234,63 @@ class TestAccount(DomainTest):
         self.assertEquals(
             a.get_total_for_interval(start, end), 200)
 
+    def test_get_totals_for_interval(self):
+        root = self.create_account()
+        child = self.create_account()
+        child.parent = root
+        grandchild = self.create_account()
+        grandchild.parent = child
+        other = self.create_account()
+        start = datetime.datetime(2010, 1, 1)
+        end = datetime.datetime(2010, 12, 31)
+
+        for account, source, value, date in [
+                (root, other, 10, datetime.datetime(2010, 1, 1, 12)),
+                (child, root, 20, datetime.datetime(2010, 12, 31, 23)),
+                (grandchild, other, 40, datetime.datetime(2010, 6, 1)),
+                # Out of the interval
+                (grandchild, other, 80, datetime.datetime(2011, 1, 1)),
+                # From the account to itself, doesn't count
+                (child, child, 160, datetime.datetime(2010, 6, 1))]:
+            transaction = self.create_account_transaction(
+                account, value=value, source=source)
+            transaction.date = date
+
+        totals = Account.get_totals_for_interval(self.store, start, end,
+                                                 root=root)
+        self.assertEqual(totals, {root.id: -10, child.id: 20,
+                                  grandchild.id: 40})
+        for account in [root, child, grandchild, other]:
+            self.assertEqual(
+                Account.get_totals_for_interval(self.store, start,
+                                                end)[account.id],
+                account.get_total_for_interval(start, end))
+        self.assertEqual(other.get_total_for_interval(start, end), -50)
+
+        # Moving and removing transactions update the balances
+        transaction.account = grandchild
+        self.assertEqual(child.get_total_for_interval(start, end), -140)
+        self.assertEqual(grandchild.get_total_for_interval(start, end), 200)
+        transaction.source_account = other
+        self.assertEqual(child.get_total_for_interval(start, end), 20)
+        self.assertEqual(grandchild.get_total_for_interval(start, end), 200)
+        self.assertEqual(other.get_total_for_interval(start, end), -210)
+        self.store.remove(transaction)
+        self.assertEqual(grandchild.get_total_for_interval(start, end), 40)
+
+    def test_rebuild_balances(self):
+        account = self.create_account()
+        transaction = self.create_account_transaction(account, value=100)
+        transaction.date = datetime.datetime(2010, 6, 1)
+        start = datetime.datetime(2010, 1, 1)
+        end = datetime.datetime(2010, 12, 31)
+
+        self.store.execute(u"DELETE FROM account_balance_daily "
+                           u"WHERE account_id = ?", (account.id, ))
+        self.assertEqual(account.get_total_for_interval(start, end), 0)
+        AccountBalanceDaily.rebuild(self.store)
+        self.assertEqual(account.get_total_for_interval(start, end), 100)
+
     def test_get_total_for_interval_error(self):
         a = self.create_account()
         good = datetime.datetime(2010, 1, 1)
@@ -28,6 +28,7 @@ import json
 
 import mock
 from storm.exceptions import NotOneError
+from storm.info import get_obj_info
 from storm.references import Reference
 
 from stoqlib.database.properties import (IntCol, UnicodeCol, BoolCol, IdCol,
@@ -35,6 +36,7 @@ from stoqlib.database.properties import (IntCol, UnicodeCol, BoolCol, IdCol,
 from stoqlib.domain.base import Domain
 
 from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.lib.decorators import cached_function
 
 
 class Ding(Domain):
@@ -290,6 +292,27 @@ class TestSelect(DomainTest):
         new_dung.identifier = Dung.get_temporary_identifier(self.store)
         self.assertEquals(new_dung.identifier, -2)
 
+    def test_invalidate_dependent_caches(self):
+        @cached_function(depends_on=['Ding'])
+        def count_dings():
+            return self.store.find(Ding).count()
+
+        ding = Ding(store=self.store)
+        self.store.flush()
+        self.assertEqual(count_dings(), 1)
+
+        Ding(store=self.store)
+        self.store.flush()
+        self.assertEqual(count_dings(), 1)
+
+        # This is emitted when committing, after the objects are flushed
+        get_obj_info(ding).event.emit('before-commited')
+        self.assertEqual(count_dings(), 2)
+
+        self.store.remove(ding)
+        self.assertEqual(count_dings(), 1)
+        self.assertEqual(count_dings.cache_info()['misses'], 3)
+
     def test_serialize(self):
         ding = Ding(store=self.store, str_field=u'Sambiquira', int_field=666)
         self.assertEquals(ding.serialize(), {
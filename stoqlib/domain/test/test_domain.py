@@ -28,7 +28,7 @@ from kiwi.currency import currency
 from storm import Undef
 from storm.properties import PropertyColumn
 from storm.references import Reference
-from storm.variables import (BoolVariable, DateTimeVariable,
+from storm.variables import (BoolVariable, DateTimeVariable, DateVariable,
                              RawStrVariable, DecimalVariable,
                              IntVariable, UnicodeVariable)
 from stoqlib.domain.product import Storable
@@ -40,7 +40,7 @@ from stoqlib.database.tables import get_table_types
 from stoqlib.domain.sellable import SellableCategory
 from stoqlib.domain.production import ProductionProducedItem
 from stoqlib.domain.test.domaintest import DomainTest
-from stoqlib.lib.dateutils import localnow
+from stoqlib.lib.dateutils import localnow, localtoday
 
 
 class ORMTestError(Exception):
@@ -66,6 +66,8 @@ def orm_get_random(column):
         value = ''
     elif issubclass(variable, DateTimeVariable):
         value = localnow()
+    elif issubclass(variable, DateVariable):
+        value = localtoday().date()
     elif issubclass(variable, IntVariable):
         value = None
     elif issubclass(variable, PriceVariable):
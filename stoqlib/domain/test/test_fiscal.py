@@ -182,3 +182,35 @@ class TestInvoice(DomainTest):
         sale.invoice.on_create()
         sale.invoice.invoice_number = 2
         sale.invoice.on_update()
+
+    def test_get_last_invoice_number_counter(self):
+        branch = get_current_branch(self.store)
+        self.assertEqual(
+            Invoice.get_last_invoice_number(self.store, series=7,
+                                            mode=Invoice.NFE_MODE), 0)
+        # Locking creates the counter
+        self.assertEqual(
+            Invoice.get_next_invoice_number(self.store, series=7,
+                                            mode=Invoice.NFE_MODE,
+                                            lock=True), 1)
+
+        sale = self.create_sale(branch=branch)
+        sale.invoice.series = 7
+        sale.invoice.mode = Invoice.NFE_MODE
+        sale.invoice.invoice_number = 10
+        self.assertEqual(
+            Invoice.get_last_invoice_number(self.store, series=7,
+                                            mode=Invoice.NFE_MODE), 10)
+        # Other series and modes have their own numbers
+        self.assertEqual(
+            Invoice.get_last_invoice_number(self.store, series=7), 0)
+        self.assertEqual(
+            Invoice.get_last_invoice_number(self.store, series=8,
+                                            mode=Invoice.NFE_MODE), 0)
+
+        # The counter never decreases
+        sale.invoice.invoice_number = 5
+        self.assertEqual(
+            Invoice.get_last_invoice_number(self.store, series=7,
+                                            mode=Invoice.NFE_MODE,
+                                            lock=True), 10)
@@ -48,6 +48,7 @@ from stoqlib.domain.fiscal import CfopData
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.person import (Branch, Client, ClientCategory,
+                                   ClientCreditLedger,
                                    ClientSalaryHistory, Company,
                                    Employee, EmployeeRole,
                                    EmployeeRoleHistory, Individual,
@@ -802,6 +803,86 @@ class TestClient(_PersonFacetTest, DomainTest):
         self.assertEquals(client.credit_account_balance, -100)
 
 
+class TestClientCreditLedger(DomainTest):
+    def _create_payment(self, client, method_name, payment_type, value):
+        method = PaymentMethod.get_by_name(self.store, method_name)
+        group = self.create_payment_group(payer=client.person)
+        payment = self.create_payment(payment_type=payment_type, value=value,
+                                      method=method, group=group)
+        payment.set_pending()
+        return payment
+
+    def test_credit_account_balance(self):
+        client = self.create_client()
+        self.assertEqual(client.credit_account_balance, 0)
+
+        payment = self._create_payment(client, u'credit', Payment.TYPE_OUT,
+                                       100)
+        # Only paid payments count
+        self.assertEqual(client.credit_account_balance, 0)
+        payment.pay()
+        self.assertEqual(client.credit_account_balance, 100)
+
+        payment = self._create_payment(client, u'credit', Payment.TYPE_IN, 30)
+        payment.pay()
+        self.assertEqual(client.credit_account_balance, 70)
+
+        self.store.remove(payment)
+        self.assertEqual(client.credit_account_balance, 100)
+        self.assertEqual(ClientCreditLedger.find_inconsistencies(self.store),
+                         [])
+
+    def test_remaining_store_credit(self):
+        client = self.create_client()
+        client.credit_limit = 1000
+        self.assertEqual(client.remaining_store_credit, 1000)
+
+        payment = self._create_payment(client, u'store_credit',
+                                       Payment.TYPE_IN, 200)
+        self.assertEqual(client.remaining_store_credit, 800)
+        # Other methods don't count
+        self._create_payment(client, u'money', Payment.TYPE_IN, 50)
+        self.assertEqual(client.remaining_store_credit, 800)
+
+        payment.value = 300
+        self.assertEqual(client.remaining_store_credit, 700)
+        payment.pay()
+        self.assertEqual(client.remaining_store_credit, 1000)
+        self.assertEqual(ClientCreditLedger.find_inconsistencies(self.store),
+                         [])
+
+    def test_change_payer(self):
+        client = self.create_client()
+        other_client = self.create_client()
+        payment = self._create_payment(client, u'credit', Payment.TYPE_OUT,
+                                       100)
+        payment.pay()
+        self.assertEqual(client.credit_account_balance, 100)
+
+        payment.group.payer = other_client.person
+        self.assertEqual(client.credit_account_balance, 0)
+        self.assertEqual(other_client.credit_account_balance, 100)
+
+    def test_rebuild(self):
+        client = self.create_client()
+        payment = self._create_payment(client, u'credit', Payment.TYPE_OUT,
+                                       100)
+        payment.pay()
+        self.store.execute(u"UPDATE client_credit_ledger "
+                           u"SET credit_balance = 10 WHERE person_id = ?",
+                           (client.person_id, ))
+        self.assertEqual(client.credit_account_balance, 10)
+        self.assertEqual(ClientCreditLedger.find_inconsistencies(self.store),
+                         [(client.person_id, (10, 0), (100, 0))])
+
+        ClientCreditLedger.rebuild(self.store, client.person)
+        self.assertEqual(client.credit_account_balance, 100)
+        ClientCreditLedger.rebuild(self.store)
+        self.assertEqual(client.credit_account_balance, 100)
+        self.assertEqual(ClientCreditLedger.find_inconsistencies(self.store),
+                         [])
+
+
 class TestClientCategory(DomainTest):
     def test_get_description(self):
         category = self.create_client_category(name=u'Control')
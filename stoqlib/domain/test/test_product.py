@@ -27,14 +27,17 @@ __tests__ = 'stoqlib/domain/product.py'
 
 from decimal import Decimal
 
+from storm.expr import Coalesce, Delete, Select, Sum
+
 from stoqlib.exceptions import StockError
+from stoqlib.database.exceptions import PostgreSQLError
 from stoqlib.database.runtime import get_current_branch, new_store
 from stoqlib.domain.events import (ProductCreateEvent, ProductEditEvent,
                                    ProductRemoveEvent)
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment
 from stoqlib.domain.product import (ProductSupplierInfo, Product,
-                                    ProductStockItem,
+                                    ProductStockItem, ProductStockSummary,
                                     ProductHistory, ProductComponent,
                                     ProductQualityTest, Storable,
                                     StorableBatch, StorableBatchView,
@@ -1150,6 +1153,122 @@ class TestProductManufacturer(DomainTest):
         self.assertEquals(results, 0)
 
 
+class TestProductStockItem(DomainTest):
+    def _update_manually(self, storable):
+        self.store.savepoint('manual_update')
+        try:
+            self.store.execute(
+                u"UPDATE product_stock_item SET quantity = quantity + 1 "
+                u"WHERE storable_id = ?", (storable.id, ))
+        finally:
+            self.store.rollback_to_savepoint('manual_update')
+
+    def test_manual_update(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=10, unit_cost=5)
+        with self.assertRaisesRegexp(PostgreSQLError,
+                                     'product_stock_item should not be'):
+            self._update_manually(storable)
+
+    def test_manual_update_after_transaction(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=10, unit_cost=5)
+        storable.increase_stock(2, branch,
+                                StockTransactionHistory.TYPE_INITIAL, None,
+                                unit_cost=5)
+        self.store.flush()
+        # Inserting a stock_transaction_history should not allow the
+        # stock items to be changed manually for the rest of the transaction
+        with self.assertRaisesRegexp(PostgreSQLError,
+                                     'product_stock_item should not be'):
+            self._update_manually(storable)
+        self.assertEqual(storable.get_balance_for_branch(branch), 12)
+
+
+class TestProductStockSummary(DomainTest):
+    def _get_expected(self):
+        # The aggregation the stock views used to do
+        query = Select(
+            columns=[ProductStockItem.storable_id, ProductStockItem.branch_id,
+                     Coalesce(Sum(ProductStockItem.quantity), 0),
+                     Coalesce(Sum(ProductStockItem.quantity *
+                                  ProductStockItem.stock_cost), 0)],
+            tables=[ProductStockItem],
+            group_by=[ProductStockItem.storable_id,
+                      ProductStockItem.branch_id])
+        return self._as_dict(self.store.execute(query))
+
+    def _get_summary(self):
+        # Not using the objects since they may have been cached before the
+        # trigger updated the table
+        query = Select(
+            columns=[ProductStockSummary.storable_id,
+                     ProductStockSummary.branch_id,
+                     ProductStockSummary.stock,
+                     ProductStockSummary.total_stock_cost],
+            tables=[ProductStockSummary])
+        return self._as_dict(self.store.execute(query))
+
+    def _as_dict(self, rows):
+        # A summary with nothing in stock is the same as no summary
+        return dict(((storable_id, branch_id), (stock, total_stock_cost))
+                    for storable_id, branch_id, stock, total_stock_cost in rows
+                    if stock or total_stock_cost)
+
+    def test_stock_changes(self):
+        branch1 = get_current_branch(self.store)
+        branch2 = self.create_branch()
+        storable = self.create_storable(branch=branch1, stock=10,
+                                        unit_cost=5)
+        storable.increase_stock(5, branch2,
+                                StockTransactionHistory.TYPE_INITIAL, None,
+                                unit_cost=Decimal('3.33'))
+        storable.increase_stock(2, branch1,
+                                StockTransactionHistory.TYPE_INITIAL, None,
+                                unit_cost=Decimal('7.12345'))
+        storable.decrease_stock(4, branch1,
+                                StockTransactionHistory.TYPE_INITIAL, None)
+        storable.update_stock_cost(Decimal('1.5'), branch2)
+
+        batch_storable, batch1 = self.create_storable(
+            branch=branch1, stock=3, unit_cost=2, is_batch=True)
+        batch2 = self.create_storable_batch(batch_storable, batch_number=u'2')
+        batch_storable.increase_stock(7, branch1,
+                                      StockTransactionHistory.TYPE_INITIAL,
+                                      None, unit_cost=4, batch=batch2)
+        batch_storable.decrease_stock(1, branch1,
+                                      StockTransactionHistory.TYPE_INITIAL,
+                                      None, batch=batch1)
+
+        summary = self._get_summary()
+        self.assertEqual(summary, self._get_expected())
+        self.assertEqual(summary[(storable.id, branch1.id)][0], 8)
+        self.assertEqual(summary[(storable.id, branch2.id)],
+                         (5, Decimal('7.5')))
+        self.assertEqual(summary[(batch_storable.id, branch1.id)],
+                         (9, 2 * 2 + 7 * 4))
+
+    def test_delete_stock_item(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=10, unit_cost=5)
+        self.store.execute(Delete(ProductStockItem.storable_id == storable.id,
+                                  table=ProductStockItem))
+        summary = self._get_summary()
+        self.assertNotIn((storable.id, branch.id), summary)
+        self.assertEqual(summary, self._get_expected())
+
+    def test_rebuild(self):
+        branch = get_current_branch(self.store)
+        storable = self.create_storable(branch=branch, stock=10, unit_cost=5)
+        self.store.execute(u"UPDATE product_stock_summary SET stock = 1")
+        self.assertNotEqual(self._get_summary(), self._get_expected())
+
+        ProductStockSummary.rebuild(self.store)
+        summary = self._get_summary()
+        self.assertEqual(summary, self._get_expected())
+        self.assertEqual(summary[(storable.id, branch.id)], (10, 50))
+
+
 class TestStorable(DomainTest):
     def test_register_initial_stock(self):
         b1 = self.create_branch()
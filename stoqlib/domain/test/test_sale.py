@@ -40,7 +40,8 @@ from stoqlib.domain.events import SaleIsExternalEvent
 from stoqlib.domain.fiscal import FiscalBookEntry
 from stoqlib.domain.payment.method import PaymentMethod
 from stoqlib.domain.payment.payment import Payment, PaymentChangeHistory
-from stoqlib.domain.product import Storable, StockTransactionHistory
+from stoqlib.domain.product import (ProductHistory, Storable,
+                                    StockTransactionHistory)
 from stoqlib.domain.returnedsale import ReturnedSaleItem
 from stoqlib.domain.sale import (Sale, SalePaymentMethodView,
                                  ReturnedSaleView,
@@ -556,6 +557,65 @@ class TestSale(DomainTest):
         self.assertEqual(storable3.get_balance_for_branch(branch),
                          stock3 - 10)
 
+    def test_confirm_same_storable(self):
+        sale = self.create_sale()
+        branch = sale.branch
+        sellable = self.add_product(sale, quantity=60)
+        sale.add_sellable(sellable, quantity=30)
+        service = self.create_service()
+        sale.add_sellable(service.sellable, quantity=1)
+        sale.order()
+        self.add_payments(sale)
+        storable = sellable.product_storable
+        stock = storable.get_balance_for_branch(branch)
+
+        sale.confirm()
+
+        self.assertEqual(storable.get_balance_for_branch(branch), stock - 90)
+        transactions = self.store.find(
+            StockTransactionHistory, storable=storable,
+            type=StockTransactionHistory.TYPE_SELL)
+        self.assertEqual(sorted(t.quantity for t in transactions), [-60, -30])
+        history = self.store.find(ProductHistory, sellable=sellable)
+        self.assertEqual(sorted(h.quantity_sold for h in history), [30, 60])
+        self.assertEqual(
+            self.store.find(ProductHistory,
+                            sellable=service.sellable).count(), 0)
+        for item in sale.get_items():
+            self.assertEqual(item.quantity_decreased, item.quantity)
+
+    def test_confirm_same_storable_without_stock(self):
+        sale = self.create_sale()
+        # Each item can be decreased, but not both
+        sellable = self.add_product(sale, quantity=60)
+        sale.add_sellable(sellable, quantity=60)
+        sale.order()
+        self.add_payments(sale)
+
+        with self.assertRaisesRegexp(SellError, 'Quantity to decrease is '
+                                                'greater than the available '
+                                                'stock.'):
+            sale.confirm()
+
+    @mock.patch('stoqlib.domain.sale.ProductStockUpdateEvent.emit')
+    def test_confirm_stock_update_event(self, emit):
+        sale = self.create_sale()
+        branch = sale.branch
+        sellable1 = self.add_product(sale, quantity=10)
+        sale.add_sellable(sellable1, quantity=5)
+        sellable2 = self.add_product(sale, quantity=2)
+        sale.order()
+        self.add_payments(sale)
+        # Ignore the initial stock
+        emit.reset_mock()
+
+        sale.confirm()
+
+        # Emitted once for each product
+        self.assertEqual(emit.call_count, 2)
+        emit.assert_any_call(sellable1.product, branch, 100, 85)
+        emit.assert_any_call(sellable2.product, branch, 100, 98)
+
     def test_pay(self):
         sale = self.create_sale()
         self.failIf(sale.can_set_paid())
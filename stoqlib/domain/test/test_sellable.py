@@ -203,6 +203,15 @@ class TestSellable(DomainTest):
                                           suggested_markup=10,
                                           store=self.store)
 
+    def test_get_max_value_counter(self):
+        for code in [u'9', u'10', u'AB1', u'']:
+            self.create_sellable(code=code)
+        self.store.flush()
+        self.assertEqual(
+            Sellable.get_max_value(self.store, Sellable.code,
+                                   counter=u'sellable.code'),
+            Sellable.get_max_value(self.store, Sellable.code))
+
     def test_get_description(self):
         sellable = self.create_sellable()
         sellable.category = self._category
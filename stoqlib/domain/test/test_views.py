@@ -29,8 +29,10 @@ import datetime
 from decimal import Decimal
 
 from kiwi.datatypes import converter
+from storm.expr import Alias, And, Join, LeftJoin, Select, Sum
 
-from stoqlib.database.expr import Date
+
+from stoqlib.database.expr import Date, Field
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.database.viewable import Viewable
 from stoqlib.domain.payment.method import PaymentMethod
@@ -39,6 +41,7 @@ from stoqlib.domain.payment.views import (BasePaymentView, InPaymentView,
                                           OutPaymentView, CardPaymentView,
                                           InCheckPaymentView,
                                           PaymentChangeHistoryView)
+from stoqlib.domain.person import Branch
 from stoqlib.domain.product import (ProductSupplierInfo, ProductStockItem,
                                     Storable, Product, StockTransactionHistory)
 from stoqlib.domain.purchase import PurchaseOrder, QuoteGroup
@@ -51,6 +54,7 @@ from stoqlib.domain.views import ProductComponentView
 from stoqlib.domain.views import ProductFullStockView
 from stoqlib.domain.views import ProductFullStockItemView
 from stoqlib.domain.views import ProductFullStockItemSupplierView
+from stoqlib.domain.views import ProductWithStockBranchView
 from stoqlib.domain.views import QuotationView
 from stoqlib.domain.views import SellableCategoryView
 from stoqlib.domain.views import SellableFullStockView
@@ -582,6 +586,96 @@ class TestSellableFullStockView(DomainTest):
         self.assertEquals(results[0].price, Decimal('10.15'))
 
 
+# The subselect used by the stock views before product_stock_summary
+# existed. The results of the views should not change
+_OldStockBranchSummary = Alias(Select(
+    columns=[Alias(Storable.id, 'storable_id'),
+             Alias(Branch.id, 'branch_id'),
+             Alias(Sum(ProductStockItem.quantity), 'stock'),
+             Alias(Sum(ProductStockItem.quantity *
+                       ProductStockItem.stock_cost), 'total_stock_cost')],
+    tables=[Storable,
+            Join(Branch, And(True)),
+            LeftJoin(ProductStockItem,
+                     And(ProductStockItem.branch_id == Branch.id,
+                         ProductStockItem.storable_id == Storable.id))],
+    group_by=[Storable.id, Branch.id]), '_old_stock_summary')
+
+
+class TestStockSummaryEquivalence(DomainTest):
+    def setUp(self):
+        super(TestStockSummaryEquivalence, self).setUp()
+        self.branch = get_current_branch(self.store)
+        self.other_branch = self.create_branch()
+
+        self.create_product(branch=self.branch, stock=10)
+        product = self.create_product(branch=self.other_branch, stock=3)
+        product.storable.increase_stock(
+            2, self.branch, StockTransactionHistory.TYPE_INITIAL, None,
+            unit_cost=Decimal('2.5'))
+        # Storable without any stock
+        self.create_product(storable=True)
+        storable, batch = self.create_storable(branch=self.branch, stock=4,
+                                               unit_cost=3, is_batch=True)
+        batch2 = self.create_storable_batch(storable, batch_number=u'2')
+        storable.increase_stock(6, self.branch,
+                                StockTransactionHistory.TYPE_INITIAL, None,
+                                unit_cost=1, batch=batch2)
+
+    def _get_old_stock(self):
+        # {(storable_id, branch_id): (stock, total_stock_cost)}
+        rows = self.store.execute(Select(
+            columns=[Field('_old_stock_summary', 'storable_id'),
+                     Field('_old_stock_summary', 'branch_id'),
+                     Field('_old_stock_summary', 'stock'),
+                     Field('_old_stock_summary', 'total_stock_cost')],
+            tables=[_OldStockBranchSummary]))
+        return dict(((storable_id, branch_id), (stock or 0, cost or 0))
+                    for storable_id, branch_id, stock, cost in rows)
+
+    def test_product_full_stock_view(self):
+        old_stock = self._get_old_stock()
+
+        for branch in self.store.find(Branch):
+            results = ProductFullStockView.find_by_branch(self.store, branch)
+            for view in results:
+                if view.storable_id is None:
+                    continue
+                self.assertEqual((view.stock, view.total_stock_cost),
+                                 old_stock[(view.storable_id, branch.id)])
+
+        totals = {}
+        for (storable_id, branch_id), (stock, cost) in old_stock.items():
+            total_stock, total_cost = totals.get(storable_id, (0, 0))
+            totals[storable_id] = (total_stock + stock, total_cost + cost)
+        for view in self.store.find(ProductFullStockView):
+            if view.storable_id is None:
+                continue
+            self.assertEqual((view.stock, view.total_stock_cost),
+                             totals[view.storable_id])
+
+    def test_product_with_stock_branch_view(self):
+        old_stock = self._get_old_stock()
+        results = list(self.store.find(ProductWithStockBranchView,
+                                       branch_id=self.other_branch.id))
+        self.assertTrue(results)
+        for view in results:
+            self.assertEqual(
+                view.stock,
+                old_stock[(view.storable_id, self.other_branch.id)][0])
+
+    def test_sellable_full_stock_view(self):
+        old_stock = self._get_old_stock()
+
+        for branch in [self.branch, self.other_branch]:
+            results = SellableFullStockView.find_by_branch(self.store, branch)
+            stock = dict((view.id, view.stock) for view in results)
+            for (storable_id, branch_id), (old, cost) in old_stock.items():
+                if branch_id != branch.id:
+                    continue
+                self.assertEqual(stock[storable_id], old)
+
+
 class TestSellableCategoryView(DomainTest):
     def test_category(self):
         category = self.create_sellable_category()
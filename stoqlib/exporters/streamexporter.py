@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Export search results to CSV and XLSX files, streaming them
+
+:class:`stoqlib.exporters.xlsexporter.XLSExporter` exports the rows of an
+ObjectList, so all the results need to be loaded in it first, and the
+``.xls`` format is limited to 65536 rows.
+
+:class:`StreamExporter` exports a result set instead (usually the one
+returned by :meth:`stoqlib.database.queryexecuter.QueryExecuter.search`),
+iterating over it with a server side cursor and writing each row to the
+file as it arrives, so the memory used doesn't depend on the number of
+results. The XLSX file is written by hand, its sheet is streamed to a
+temporary file and zipped in the end.
+
+The values are formatted using the columns of the search: numbers and
+dates are written as such (so they can be used in formulas), unless the
+column has a ``format_func``, in which case the value is written just
+like it is displayed on the search.
+"""
+
+import codecs
+import csv
+import datetime
+import decimal
+import logging
+import os
+import re
+import tempfile
+import threading
+import zipfile
+from xml.sax.saxutils import escape, quoteattr
+
+from kiwi.currency import currency
+
+from stoqlib.exporters.xlsutils import get_date_format, get_number_format
+from stoqlib.lib.threadutils import schedule_in_main_thread, threadit
+from stoqlib.lib.translation import stoqlib_gettext
+
+_ = stoqlib_gettext
+log = logging.getLogger(__name__)
+
+FORMAT_CSV = 'csv'
+FORMAT_XLSX = 'xlsx'
+
+#: The mime types of the formats
+MIME_TYPES = {
+    FORMAT_CSV: 'text/csv',
+    FORMAT_XLSX: ('application/vnd.openxmlformats-officedocument.'
+                  'spreadsheetml.sheet'),
+}
+
+#: How many rows are exported between each call of the progress callback
+PROGRESS_INTERVAL = 500
+
+_NUMBER_TYPES = (int, long, float, decimal.Decimal, currency)
+_DATE_TYPES = (datetime.date, datetime.datetime)
+
+# Characters not allowed on XML documents
+_INVALID_XML_CHARS = re.compile(u'[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+class ExportColumn(object):
+    """A column of the exported file
+
+    :param column: a kiwi column, usually a
+      :class:`stoqlib.gui.search.searchcolumns.SearchColumn`
+    """
+
+    def __init__(self, column):
+        self.column = column
+        self.title = getattr(column, 'long_title', None) or column.title
+        self.data_type = column.data_type
+        # Columns with a format_func are exported as they are displayed,
+        # the others keep their numbers and dates
+        self.formatted = (bool(getattr(column, 'format_func', None)) or
+                          self.data_type not in _NUMBER_TYPES + _DATE_TYPES)
+
+    def get_value(self, obj):
+        """Get the value of the column for an object
+
+        :param obj: an object of the result set
+        :returns: ``None``, an unicode string, a number or a date
+        """
+        value = self.column.get_attribute(obj, self.column.attribute, None)
+        if not self.formatted:
+            return value
+        if value is None and not getattr(self.column, 'format_func', None):
+            return None
+
+        value = self.column.as_string(value, obj)
+        if isinstance(value, str):
+            value = unicode(value, 'utf-8')
+        return value
+
+
+class CSVWriter(object):
+    """Writes rows to a CSV file
+
+    The file is encoded in utf-8, with a BOM, so spreadsheet applications
+    can find out the encoding.
+
+    :param filename: the name of the file
+    """
+
+    def __init__(self, filename):
+        self._fp = open(filename, 'wb')
+        self._fp.write(codecs.BOM_UTF8)
+        self._writer = csv.writer(self._fp)
+
+    def set_columns(self, columns):
+        self.write_header([c.title for c in columns])
+
+    def write_header(self, titles):
+        self.write_row(titles)
+
+    def write_row(self, values):
+        self._writer.writerow([self._format(v) for v in values])
+
+    def close(self):
+        self._fp.close()
+
+    def _format(self, value):
+        if value is None:
+            return ''
+        elif isinstance(value, unicode):
+            return value.encode('utf-8')
+        elif isinstance(value, (datetime.date, datetime.datetime)):
+            return value.isoformat()
+        return str(value)
+
+
+class XLSXWriter(object):
+    """Writes rows to a XLSX file
+
+    Only what is needed for a single sheet of data is written: the
+    strings are inline (so there's no shared string table to keep in
+    memory) and there are only styles for the header, numbers and dates.
+
+    :param filename: the name of the file
+    :param sheet_name: the name of the sheet
+    """
+
+    # The indexes of the cellXfs on the styles
+    STYLE_GENERAL = 0
+    STYLE_HEADER = 1
+    STYLE_NUMBER = 2
+    STYLE_DATE = 3
+
+    _epoch = datetime.datetime(1899, 12, 30)
+
+    def __init__(self, filename, sheet_name=None):
+        self.filename = filename
+        self.sheet_name = sheet_name or _('Stoq sheet')
+        self._n_rows = 0
+        self._styles = []
+        self._column_names = []
+        self._sheet = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+        self._sheet.write(
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<worksheet xmlns="http://schemas.openxmlformats.org/'
+            'spreadsheetml/2006/main"><sheetData>')
+
+    def set_columns(self, columns):
+        styles = []
+        for column in columns:
+            if column.formatted:
+                styles.append(self.STYLE_GENERAL)
+            elif column.data_type in _DATE_TYPES:
+                styles.append(self.STYLE_DATE)
+            elif column.data_type in (int, long):
+                styles.append(self.STYLE_GENERAL)
+            else:
+                styles.append(self.STYLE_NUMBER)
+        self._styles = styles
+        self.write_header([c.title for c in columns])
+
+    def write_header(self, titles):
+        self._write_row(titles, [self.STYLE_HEADER] * len(titles))
+
+    def write_row(self, values):
+        self._write_row(values, self._styles)
+
+    def close(self):
+        self._sheet.write('</sheetData></worksheet>')
+        self._sheet.close()
+        try:
+            with zipfile.ZipFile(self.filename, 'w',
+                                 zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr('[Content_Types].xml', self._get_content_types())
+                zf.writestr('_rels/.rels', self._get_rels())
+                zf.writestr('xl/workbook.xml', self._get_workbook())
+                zf.writestr('xl/_rels/workbook.xml.rels',
+                            self._get_workbook_rels())
+                zf.writestr('xl/styles.xml', self._get_styles())
+                zf.write(self._sheet.name, 'xl/worksheets/sheet1.xml')
+        finally:
+            os.unlink(self._sheet.name)
+
+    def abort(self):
+        """Discards the rows written so far"""
+        self._sheet.close()
+        os.unlink(self._sheet.name)
+
+    #
+    #  Private
+    #
+
+    def _get_column_name(self, i):
+        while len(self._column_names) <= i:
+            n = len(self._column_names) + 1
+            name = ''
+            while n:
+                n, remainder = divmod(n - 1, 26)
+                name = chr(ord('A') + remainder) + name
+            self._column_names.append(name)
+        return self._column_names[i]
+
+    def _write_row(self, values, styles):
+        self._n_rows += 1
+        cells = []
+        for i, value in enumerate(values):
+            if value is None or value == u'':
+                continue
+            ref = '%s%d' % (self._get_column_name(i), self._n_rows)
+            style = styles[i] if i < len(styles) else self.STYLE_GENERAL
+            cells.append(self._get_cell(ref, value, style))
+        self._sheet.write('<row r="%d">%s</row>' % (self._n_rows,
+                                                   ''.join(cells)))
+
+    def _get_cell(self, ref, value, style):
+        if isinstance(value, bool):
+            value = unicode(value)
+        elif isinstance(value, (datetime.date, datetime.datetime)):
+            if not isinstance(value, datetime.datetime):
+                value = datetime.datetime.combine(value, datetime.time())
+            delta = value - self._epoch
+            value = delta.days + delta.seconds / 86400.0
+            return '<c r="%s" s="%d"><v>%r</v></c>' % (ref, style, value)
+        elif isinstance(value, _NUMBER_TYPES):
+            return '<c r="%s" s="%d"><v>%s</v></c>' % (ref, style, value)
+        elif isinstance(value, str):
+            value = unicode(value, 'utf-8')
+        elif not isinstance(value, unicode):
+            value = unicode(value)
+
+        value = _INVALID_XML_CHARS.sub(u'', value)
+        return '<c r="%s" s="%d" t="inlineStr"><is><t xml:space="preserve">' \
+               '%s</t></is></c>' % (ref, style, escape(value).encode('utf-8'))
+
+    def _get_content_types(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+            'content-types">'
+            '<Default Extension="rels" ContentType="application/'
+            'vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/worksheets/sheet1.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.'
+            'spreadsheetml.worksheet+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/'
+            'vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '</Types>')
+
+    def _get_rels(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+            '2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/officeDocument" '
+            'Target="xl/workbook.xml"/>'
+            '</Relationships>')
+
+    def _get_workbook(self):
+        # Excel doesn't allow those on sheet names, and they are
+        # limited to 31 characters
+        name = re.sub(r'[\[\]:*?/\\]', ' ', self.sheet_name)[:31]
+        if isinstance(name, str):
+            name = unicode(name, 'utf-8')
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<workbook xmlns="http://schemas.openxmlformats.org/'
+            'spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats'
+            '.org/officeDocument/2006/relationships">'
+            '<sheets><sheet name=%s sheetId="1" r:id="rId1"/></sheets>'
+            '</workbook>') % (quoteattr(name).encode('utf-8'), )
+
+    def _get_workbook_rels(self):
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/'
+            '2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/worksheet" '
+            'Target="worksheets/sheet1.xml"/>'
+            '<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/'
+            'officeDocument/2006/relationships/styles" Target="styles.xml"/>'
+            '</Relationships>')
+
+    def _get_styles(self):
+        date_format = get_date_format()
+        if isinstance(date_format, str):
+            date_format = unicode(date_format, 'utf-8')
+        return (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+            '<styleSheet xmlns="http://schemas.openxmlformats.org/'
+            'spreadsheetml/2006/main">'
+            '<numFmts count="2">'
+            '<numFmt numFmtId="164" formatCode=%s/>'
+            '<numFmt numFmtId="165" formatCode=%s/>'
+            '</numFmts>'
+            '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+            '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+            '<fill><patternFill patternType="gray125"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/>'
+            '<diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" '
+            'borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="4">'
+            '<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" '
+            'applyFont="1"/>'
+            '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" '
+            'applyNumberFormat="1"/>'
+            '<xf numFmtId="165" fontId="0" fillId="0" borderId="0" xfId="0" '
+            'applyNumberFormat="1"/>'
+            '</cellXfs>'
+            '</styleSheet>') % (quoteattr(get_number_format()),
+                                quoteattr(date_format).encode('utf-8'))
+
+
+class StreamExporter(object):
+    """Exports a result set to a CSV or XLSX file
+
+    The result set is iterated with
+    :meth:`stoqlib.database.runtime.StoqlibResultSet.stream_iter`, so its
+    store should not be used by anything else during the export. When
+    using :meth:`.start`, it should be a store of its own (e.g. created
+    with :func:`stoqlib.api.api.new_store`), since the export will run on
+    another thread.
+
+    :param resultset: the result set to export
+    :param columns: the kiwi columns to export
+    :param file_format: :data:`FORMAT_CSV` or :data:`FORMAT_XLSX`
+    :param name: the name of the sheet, for XLSX files
+    :param fast: if the objects should be loaded as namedtuples, see
+      :meth:`stoqlib.database.runtime.StoqlibResultSet.fast_iter`
+    :param fetch_size: how many rows to fetch from the database at a time
+    """
+
+    def __init__(self, resultset, columns, file_format=FORMAT_XLSX,
+                 name=None, fast=False, fetch_size=None):
+        if file_format not in MIME_TYPES:
+            raise ValueError("Invalid format: %r" % (file_format, ))
+
+        self.resultset = resultset
+        self.columns = [ExportColumn(c) for c in columns]
+        self.file_format = file_format
+        self.name = name
+        self.fast = fast
+        self.fetch_size = fetch_size
+        self._cancel_event = threading.Event()
+
+    #
+    #  Public API
+    #
+
+    @property
+    def mime_type(self):
+        return MIME_TYPES[self.file_format]
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Cancels the export
+
+        This can be called from any thread, the export will stop
+        on the next row.
+        """
+        self._cancel_event.set()
+
+    def export(self, filename, progress_callback=None):
+        """Exports the result set to a file
+
+        :param filename: the name of the file
+        :param progress_callback: a callable receiving the number of rows
+          exported so far and the total number of rows
+        :returns: the number of rows exported, or ``None`` if the export
+          was cancelled, in which case the file is removed
+        """
+        total = self.resultset.count()
+        writer = self._create_writer(filename)
+        writer.set_columns(self.columns)
+
+        exported = 0
+        try:
+            for obj in self.resultset.stream_iter(self.fetch_size,
+                                                  fast=self.fast):
+                if self.cancelled:
+                    break
+                writer.write_row([c.get_value(obj) for c in self.columns])
+                exported += 1
+                if progress_callback and exported % PROGRESS_INTERVAL == 0:
+                    progress_callback(exported, total)
+        except Exception:
+            self._abort(writer, filename)
+            raise
+
+        if self.cancelled:
+            self._abort(writer, filename)
+            return None
+
+        writer.close()
+        if progress_callback:
+            progress_callback(exported, total)
+        return exported
+
+    def save(self, prefix='', progress_callback=None):
+        """Exports the result set to a temporary file
+
+        :param prefix: a prefix for the name of the file
+        :param progress_callback: see :meth:`.export`
+        :returns: the temporary file, just like
+          :meth:`stoqlib.exporters.xlsexporter.XLSExporter.save`, or
+          ``None`` if the export was cancelled
+        """
+        if prefix:
+            prefix = 'Stoq-%s-' % (prefix, )
+        else:
+            prefix = 'Stoq-'
+
+        temporary = tempfile.NamedTemporaryFile(
+            prefix=prefix, suffix='.' + self.file_format, delete=False)
+        temporary.close()
+        if self.export(temporary.name, progress_callback) is None:
+            return None
+        return open(temporary.name, 'rb')
+
+    def start(self, finish_callback, filename=None, prefix='',
+              progress_callback=None):
+        """Exports the result set on another thread
+
+        The callbacks are called on the main thread.
+
+        :param finish_callback: a callable receiving the file exported
+          (``None`` if it was cancelled) and the exception that
+          happened, if any. If *filename* is given, the file is that
+          name, otherwise it is the temporary file returned by :meth:`.save`
+        :param filename: the name of the file, if ``None`` a temporary
+          file will be created
+        :param prefix: the prefix of the temporary file, see :meth:`.save`
+        :param progress_callback: see :meth:`.export`
+        :returns: the thread
+        """
+        if progress_callback is not None:
+            callback = progress_callback
+
+            def progress_callback(exported, total):
+                schedule_in_main_thread(callback, exported, total)
+
+        def run():
+            result = error = None
+            try:
+                if filename is None:
+                    result = self.save(prefix, progress_callback)
+                elif self.export(filename, progress_callback) is not None:
+                    result = filename
+            except Exception as e:
+                log.exception('Could not export %s' % (filename or prefix, ))
+                error = e
+            schedule_in_main_thread(finish_callback, result, error)
+
+        return threadit(run)
+
+    #
+    #  Private
+    #
+
+    def _create_writer(self, filename):
+        if self.file_format == FORMAT_CSV:
+            return CSVWriter(filename)
+        return XLSXWriter(filename, self.name)
+
+    def _abort(self, writer, filename):
+        if isinstance(writer, XLSXWriter):
+            writer.abort()
+        else:
+            writer.close()
+        if os.path.exists(filename):
+            os.unlink(filename)
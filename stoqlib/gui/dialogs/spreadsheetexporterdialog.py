@@ -29,8 +29,11 @@ import gtk
 
 from stoqlib.api import api
 
+from stoqlib.exporters.streamexporter import (StreamExporter, FORMAT_CSV,
+                                              FORMAT_XLSX, MIME_TYPES)
 from stoqlib.exporters.xlsexporter import XLSExporter
-from stoqlib.lib.message import yesno
+from stoqlib.gui.dialogs.progressdialog import ProgressDialog
+from stoqlib.lib.message import warning, yesno
 from stoqlib.lib.translation import stoqlib_gettext
 
 _ = stoqlib_gettext
@@ -47,15 +50,80 @@ class SpreadSheetExporter:
         temporary = xls.save(filename_prefix)
         self.export_temporary(temporary)
 
-    def export_temporary(self, temporary):
-        mime_type = 'application/vnd.ms-excel'
+    def export_search(self, search, name, filename_prefix):
+        """Exports all the results of a search
+
+        Unlike :meth:`.export`, the results are not loaded on the
+        search, they are streamed from the database to the file by a
+        :class:`stoqlib.exporters.streamexporter.StreamExporter`, on
+        another thread, while a progress dialog is displayed.
+
+        :param search: a :class:`stoqlib.gui.search.searchslave.SearchSlave`
+        :param name: the name of the sheet
+        :param filename_prefix: the prefix of the file name
+        """
+        # The export runs on another thread, so it needs a store of its own
+        store = api.new_store()
+        executer = search.get_query_executer()
+        resultset = executer.search(search.get_last_states(), limit=-1,
+                                    store=store)
+        if resultset._store is not store:
+            # The query of this search doesn't use the store it is given,
+            # fallback to exporting the objects from the search
+            store.close()
+            model = search.result_view.get_model()
+            if hasattr(model, 'load_all_items'):
+                model.load_all_items()
+            self.export(object_list=search.result_view, name=name,
+                        filename_prefix=filename_prefix)
+            return
+
+        mime_type = MIME_TYPES[FORMAT_XLSX]
+        action = self._get_action(mime_type)
+        filename = None
+        file_format = FORMAT_XLSX
+        if action == 'save':
+            filename = self._choose_filename(file_formats=[FORMAT_XLSX,
+                                                           FORMAT_CSV])
+            if filename is None:
+                store.close()
+                return
+            if filename.endswith('.' + FORMAT_CSV):
+                file_format = FORMAT_CSV
+
+        columns = [c for c in search.result_view.get_visible_columns()
+                   if c.data_type is not gtk.gdk.Pixbuf]
+        exporter = StreamExporter(resultset, columns, file_format=file_format,
+                                  name=name)
+        progress_dialog = ProgressDialog(_('Exporting the results'),
+                                         pulse=False)
+        progress_dialog.connect('cancel',
+                                lambda dialog: exporter.cancel())
+        progress_dialog.start(wait=0)
+
+        def progress(exported, total):
+            progress_dialog.set_text('%d/%d' % (exported, total))
+            if total:
+                progress_dialog.progressbar.set_fraction(
+                    min(exported / float(total), 1))
+
+        def finish(result, error):
+            progress_dialog.stop()
+            store.close()
+            if error is not None:
+                warning(_("Could not export the results"), str(error))
+            elif result is not None and filename is None:
+                self.export_temporary(result, mime_type=mime_type,
+                                      action=action)
+
+        exporter.start(finish, filename=filename, prefix=filename_prefix,
+                       progress_callback=progress)
+
+    def export_temporary(self, temporary, mime_type='application/vnd.ms-excel',
+                         action=None):
+        if action is None:
+            action = self._get_action(mime_type)
         app_info = gio.app_info_get_default_for_type(mime_type, False)
-        if app_info:
-            action = api.user_settings.get('spreadsheet-action')
-            if action is None:
-                action = 'open'
-        else:
-            action = 'save'
 
         if action == 'ask':
             action = self._ask(app_info)
@@ -66,6 +134,16 @@ class SpreadSheetExporter:
         elif action == 'save':
             self._save(temporary)
 
+    def _get_action(self, mime_type):
+        app_info = gio.app_info_get_default_for_type(mime_type, False)
+        if not app_info:
+            return 'save'
+
+        action = api.user_settings.get('spreadsheet-action')
+        if action is None:
+            action = 'open'
+        return action
+
     def _ask(self, app_info):
         # FIXME: What if the user presses esc? Esc will return False
         # and open action will be executed. Esc should cancel the action
@@ -83,7 +161,13 @@ class SpreadSheetExporter:
         gfile = gio.File(path=filename)
         app_info.launch([gfile])
 
-    def _save(self, temp):
+    def _choose_filename(self, file_formats):
+        filters = {
+            'xls': (_('Excel Files'), '*.xls'),
+            FORMAT_XLSX: (_('Excel Files'), '*.xlsx'),
+            FORMAT_CSV: (_('CSV Files'), '*.csv'),
+        }
+
         chooser = gtk.FileChooserDialog(
             _("Export Spreadsheet..."), None,
             gtk.FILE_CHOOSER_ACTION_SAVE,
@@ -91,10 +175,13 @@ class SpreadSheetExporter:
              gtk.STOCK_SAVE, gtk.RESPONSE_OK))
         chooser.set_do_overwrite_confirmation(True)
 
-        xls_filter = gtk.FileFilter()
-        xls_filter.set_name(_('Excel Files'))
-        xls_filter.add_pattern('*.xls')
-        chooser.add_filter(xls_filter)
+        for file_format in file_formats:
+            name, pattern = filters[file_format]
+            file_filter = gtk.FileFilter()
+            file_filter.set_name(name)
+            file_filter.add_pattern(pattern)
+            file_filter.set_data('format', file_format)
+            chooser.add_filter(file_filter)
 
         response = chooser.run()
 
@@ -104,12 +191,19 @@ class SpreadSheetExporter:
             return
 
         filename = chooser.get_filename()
-        ext = '.xls'
+        ext = '.' + chooser.get_filter().get_data('format')
 
         chooser.destroy()
 
         if not filename.endswith(ext):
             filename += ext
+        return filename
+
+    def _save(self, temp):
+        ext = temp.name.rsplit('.', 1)[-1]
+        filename = self._choose_filename(file_formats=[ext])
+        if filename is None:
+            return
 
         # Open in binary format so windows dont replace '\n' with '\r\n'
         open(filename, 'wb').write(temp.read())
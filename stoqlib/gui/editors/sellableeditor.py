@@ -314,7 +314,8 @@ class SellableEditor(BaseEditor):
             query = (Sellable.category_id == category.id)
             code = Sellable.get_max_value(self.store, Sellable.code, query=query)
         else:
-            code = Sellable.get_max_value(self.store, Sellable.code)
+            code = Sellable.get_max_value(self.store, Sellable.code,
+                                          counter=u'sellable.code')
         self.code.update(next_value_for(code))
 
     def _update_price(self):
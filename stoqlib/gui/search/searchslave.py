@@ -107,6 +107,7 @@ class SearchSlave(SlaveDelegate):
         self._auto_search = True
         self._lazy_search = False
         self._last_results = None
+        self._last_states = None
         self._model = None
         self._query_executer = None
         self._restore_name = restore_name
@@ -577,6 +578,13 @@ class SearchSlave(SlaveDelegate):
     def get_last_results(self):
         return self._last_results
 
+    def get_last_states(self):
+        """Get the states of the filters used on the last search
+
+        :returns: a list of states, or ``None`` if no search was done yet
+        """
+        return self._last_states
+
     def set_result_view(self, result_view_class, refresh=False):
         """
         Creates a new result view and attaches it to this search container.
@@ -25,9 +25,11 @@
 import gtk
 import mock
 
-from kiwi.ui.objectlist import ObjectList
+from kiwi.ui.objectlist import Column, ObjectList
 
 from stoqlib.api import api
+from stoqlib.domain.sellable import Sellable
+from stoqlib.exporters.streamexporter import MIME_TYPES, FORMAT_XLSX
 from stoqlib.gui.dialogs.spreadsheetexporterdialog import SpreadSheetExporter
 from stoqlib.gui.test.uitestutils import GUITest
 
@@ -68,3 +70,34 @@ class TestXLSExporter(GUITest):
             ('A spreadsheet has been created, what do '
              'you want to do with it?'), gtk.RESPONSE_NO, 'Save it to disk',
             'Open with App Name')
+
+    @mock.patch('stoqlib.gui.dialogs.spreadsheetexporterdialog.ProgressDialog')
+    @mock.patch('stoqlib.gui.dialogs.spreadsheetexporterdialog.api.new_store')
+    @mock.patch('stoqlib.exporters.streamexporter.schedule_in_main_thread',
+                new=lambda func, *args: func(*args))
+    @mock.patch('stoqlib.exporters.streamexporter.threadit',
+                new=lambda func: func())
+    def test_export_search(self, new_store, progress_dialog):
+        api.user_settings.set('spreadsheet-action', 'open')
+        new_store.return_value = self.store
+
+        search = mock.Mock()
+        search.get_query_executer.return_value.search.return_value = (
+            self.store.find(Sellable))
+        search.result_view.get_visible_columns.return_value = [
+            Column('description', data_type=str)]
+
+        sse = SpreadSheetExporter()
+        path = 'stoqlib.gui.dialogs.spreadsheetexporterdialog.gio.app_info_get_default_for_type'
+        with mock.patch(path):
+            with mock.patch.object(sse, '_open_application') as _open:
+                with mock.patch.object(self.store, 'close'):
+                    sse.export_search(search, name='Title',
+                                      filename_prefix='name-prefix')
+
+        search.get_query_executer.return_value.search.assert_called_once_with(
+            search.get_last_states.return_value, limit=-1, store=self.store)
+        mime_type, filename = _open.call_args[0]
+        self.assertEqual(mime_type, MIME_TYPES[FORMAT_XLSX])
+        self.assertTrue(filename.endswith('.xlsx'))
+        progress_dialog.return_value.stop.assert_called_once_with()
@@ -33,6 +33,7 @@ import gtk
 import pango
 
 from stoqlib.gui.base.dialogs import get_current_toplevel
+from stoqlib.gui.dialogs.progressdialog import ProgressDialog
 from stoqlib.gui.events import PrintReportEvent
 from stoqlib.lib.message import warning
 from stoqlib.lib.osutils import get_application_dir
@@ -41,7 +42,7 @@ from stoqlib.lib.template import render_template_string
 from stoqlib.lib.threadutils import (schedule_in_main_thread,
                                      terminate_thread)
 from stoqlib.lib.translation import stoqlib_gettext
-from stoqlib.reporting.report import HTMLReport
+from stoqlib.reporting.report import HTMLReport, TableReport
 from stoqlib.reporting.labelreport import LabelReport
 
 
@@ -366,6 +367,37 @@ def describe_search_filters_for_reports(filters, **kwargs):
     return kwargs
 
 
+class _ReportProgress(object):
+    """Displays the progress of a report while it is being saved
+
+    The dialog is only created on the first update, when the report
+    is being saved, so it doesn't get in the way of the print dialog.
+    The report is saved on the main thread, so the pending events are
+    processed on each update to keep the interface responsive
+    """
+
+    def __init__(self, title):
+        self._title = title
+        self._dialog = None
+
+    def update(self, current, total):
+        if self._dialog is None:
+            self._dialog = ProgressDialog(self._title, pulse=False)
+            self._dialog.set_transient_for(get_current_toplevel())
+            self._dialog.start(wait=0)
+            self._dialog.cancel.hide()
+
+        self._dialog.set_text('%d/%d' % (current, total))
+        self._dialog.progressbar.set_fraction(current / float(total))
+        while gtk.events_pending():
+            gtk.main_iteration(False)
+
+    def stop(self):
+        if self._dialog is not None:
+            self._dialog.stop()
+            self._dialog = None
+
+
 def print_report(report_class, *args, **kwargs):
     rv = PrintReportEvent.emit(report_class, *args, **kwargs)
     if rv:
@@ -375,6 +407,22 @@ def print_report(report_class, *args, **kwargs):
     if filters:
         kwargs = describe_search_filters_for_reports(filters, **kwargs)
 
+    # Reports that take long to save (e.g. a lot of bills) can report
+    # their progress, see BillReport.progress_title
+    progress = None
+    progress_title = getattr(report_class, 'progress_title', None)
+    if progress_title is not None and 'progress_callback' not in kwargs:
+        progress = _ReportProgress(progress_title)
+        kwargs['progress_callback'] = progress.update
+
+    try:
+        return _print_report(report_class, *args, **kwargs)
+    finally:
+        if progress is not None:
+            progress.stop()
+
+
+def _print_report(report_class, *args, **kwargs):
     tmp = tempfile.mktemp(suffix='.pdf', prefix='stoqlib-reporting')
     report = report_class(tmp, *args, **kwargs)
     report.filename = tmp
@@ -385,7 +433,12 @@ def print_report(report_class, *args, **kwargs):
         os.startfile(report.filename)
         return
 
-    if isinstance(report, HTMLReport):
+    if isinstance(report, TableReport) and report.can_save_chunked():
+        # Big reports are saved in chunks on a process pool, print the
+        # resulting pdf. Don't save it on a thread, forking while other
+        # threads hold locks (glib, logging, etc) can deadlock the children
+        op = PrintOperationPoppler(report)
+    elif isinstance(report, HTMLReport):
         op = PrintOperationWEasyPrint(report)
         op.set_threaded()
     else:
@@ -22,6 +22,7 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 #
 
+import glib
 import gtk
 
 from kiwi.datatypes import number
@@ -79,6 +80,7 @@ class LazyObjectModel(gtk.GenericTreeModel, gtk.TreeSortable):
         self._initial_count = initial_count
         self._iters = []
         self._orig_result = result
+        self._paginator = None
         self._post_result = None
         self._result = None
         self._values = []
@@ -92,17 +94,60 @@ class LazyObjectModel(gtk.GenericTreeModel, gtk.TreeSortable):
         self._load_result_set(result)
 
     def _load_result_set(self, result):
+        self._result = result
+        reloading = self._paginator is not None
+        # When changing the sort order, the results were already counted
+        count = None
+        if reloading and self._paginator.count_is_exact:
+            count = self._paginator.count
+        self._paginator = self._executer.get_paginator(
+            result, self._get_order_attribute(),
+            descending=self._sort_order == gtk.SORT_DESCENDING, count=count)
         self._post_result = self._executer.get_post_result(result)
         if self._post_result is not None:
             count = self._post_result.count
         else:
-            count = result.count()
-        self._count = count
-        self._iters = list(range(0, count))
-        self._result = result
-        self._values = [empty_marker] * count
+            # This may be an estimate, see update_count
+            count = self._paginator.count
+        if reloading:
+            # The view still has the old number of rows, which may differ
+            # from the new paginator's estimate, so resize through
+            # _set_count to keep them consistent
+            self._values = [empty_marker] * self._count
+            self._set_count(count)
+        else:
+            self._count = count
+            self._iters = list(range(0, count))
+            self._values = [empty_marker] * count
         self.load_items_from_results(0, self._initial_count)
 
+    def _get_order_attribute(self):
+        column = self._objectlist.get_columns()[self._sort_column_id]
+        if hasattr(column, 'search_attribute'):
+            # Even if it's defined, it could be None
+            return column.search_attribute or column.attribute
+        return column.attribute
+
+    def _set_count(self, count):
+        old_count = self._count
+        if count < old_count:
+            # The estimate was too high. Removing the extra rows one by one
+            # would emit a signal for each of them, so detach the model from
+            # the treeview while they are removed instead
+            treeview = self._objectlist.get_treeview()
+            treeview.set_model(None)
+            del self._values[count:]
+            del self._iters[count:]
+            self._count = count
+            treeview.set_model(self)
+            return
+
+        for i in range(old_count, count):
+            self._values.append(empty_marker)
+            self._iters.append(i)
+            self._count = i + 1
+            self.row_inserted((i, ), self.create_tree_iter(i))
+
     # GtkTreeModel
 
     @debug
@@ -255,25 +300,9 @@ class LazyObjectModel(gtk.GenericTreeModel, gtk.TreeSortable):
         # If we moved the start value in the for above, also move the end value
         end = min(start + load_total, self._count)
 
-        column = self._objectlist.get_columns()[self._sort_column_id]
-        if hasattr(column, 'search_attribute'):
-            # Even if it's defined, it could be None
-            order_attr = column.search_attribute or column.attribute
-        else:
-            order_attr = column.attribute
-        self._result = self._executer.get_ordered_result(self._orig_result,
-                                                         order_attr)
-
-        if self._sort_order == gtk.SORT_DESCENDING:
-            # Results should be reversed, so we need to invert the start and
-            # end values, and use the end of the list as a reference.
-            # This should be as easy as reversed(self._results[-end:-start])
-            # but storm does not support this.
-            start_ = self._count - end
-            end_ = self._count - start
-            results = reversed(list(self._result[start_:end_]))
-        else:
-            results = list(self._result[start:end])
+        # The rows are fetched after/before the ones already loaded instead
+        # of using an OFFSET, so this costs the same anywhere in the list
+        results = self._paginator.get_rows(start, end)
 
         has_loaded = False
         for i, item in enumerate(results, start):
@@ -291,6 +320,27 @@ class LazyObjectModel(gtk.GenericTreeModel, gtk.TreeSortable):
 
         return has_loaded
 
+    def update_count(self):
+        """Walks some more of the results to count them
+
+        While the results are not counted, the number of rows of the model
+        is an estimate, updated as they are counted. That also allows
+        the rows to be fetched from anywhere in the list as fast as
+        the first ones.
+
+        :returns: ``True`` if there is still something to count
+        """
+        pending = self._paginator.load_bookmarks()
+        if self._post_result is None:
+            self._set_count(self._paginator.count)
+        return pending
+
+    def load_all_items(self):
+        """Load all the rows of the model"""
+        while self.update_count():
+            pass
+        self.load_items_from_results(0, self._count)
+
     def get_post_data(self):
         return self._post_result
 
@@ -314,6 +364,7 @@ class LazyObjectListUpdater(object):
     THRESHOLD = 250
 
     def __init__(self, search, objectlist):
+        self._count_source_id = None
         self._executer = search.get_query_executer()
         self._model = None
         self._objectlist = objectlist
@@ -337,6 +388,22 @@ class LazyObjectListUpdater(object):
                                       self._executer,
                                       initial_count=self.INITIAL_ROWS)
         self._objectlist.set_model(self._model)
+        self._schedule_update_count()
+
+    def _schedule_update_count(self):
+        # Count the results on the background, which also allows us to
+        # jump to any row of the list without scrolling through all of them
+        if self._count_source_id is not None:
+            glib.source_remove(self._count_source_id)
+
+        def idle_func():
+            if self._model.update_count():
+                return True
+            self._count_source_id = None
+            return False
+
+        self._count_source_id = glib.idle_add(idle_func,
+                                              priority=glib.PRIORITY_LOW)
 
     def _load_result_set(self, start, end):
         self._treeview.freeze_notify()
@@ -393,6 +460,8 @@ class LazyObjectListUpdater(object):
 
     def _on_resuls__sorting_changed(self, objectlist, attribute, sort_type):
         self._treeview.scroll_to_point(0, 0)
+        if self._model is not None:
+            self._schedule_update_count()
 
 
 class LazySummaryLabel(ListLabel):
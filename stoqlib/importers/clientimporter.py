@@ -29,6 +29,8 @@ from stoqlib.importers.csvimporter import CSVImporter
 
 
 class ClientImporter(CSVImporter):
+    supports_bulk = True
+
     fields = ['name',
               'phone_number',
               'mobile_number',
@@ -70,3 +72,31 @@ class ClientImporter(CSVImporter):
         )
 
         Client(person=person, store=store)
+
+    def process_one_bulk(self, data, fields, inserter, store):
+        person_id = inserter.add(
+            Person,
+            name=data.name,
+            phone_number=data.phone_number,
+            mobile_number=data.mobile_number)
+
+        inserter.add(Individual,
+                     person_id=person_id,
+                     cpf=data.cpf,
+                     rg_number=data.rg)
+
+        ctloc = CityLocation.get_or_create(store=store,
+                                           city=data.city,
+                                           state=data.state,
+                                           country=data.country)
+        streetnumber = data.streetnumber and int(data.streetnumber) or None
+        inserter.add(
+            Address,
+            is_main_address=True,
+            person_id=person_id,
+            city_location_id=ctloc.id,
+            street=data.street,
+            streetnumber=streetnumber,
+            district=data.district)
+
+        inserter.add(Client, person_id=person_id)
@@ -28,8 +28,6 @@ CSV import classes
 """
 
 import csv
-import datetime
-import time
 
 from stoqlib.database.runtime import new_store
 from stoqlib.importers.importer import Importer
@@ -86,11 +84,33 @@ class CSVImporter(Importer):
         return len(self.rows)
 
     def process_item(self, store, item_no):
-        t = time.time()
+        return self._process_row(item_no, self.process_one, store)
+
+    def process_item_bulk(self, inserter, store, item_no):
+        return self._process_row(item_no, self.process_one_bulk,
+                                 inserter, store)
+
+    def _process_row(self, item_no, process_one, *args):
+        row = self._parse_row(item_no)
+        if row is None:
+            return False
+
+        try:
+            process_one(row, row.fields, *args)
+        except Exception:
+            print()
+            print('Error while processing row %d %r' % (self.lineno, row, ))
+            print()
+            raise
+
+        self.lineno += 1
+        return True
+
+    def _parse_row(self, item_no):
         item = self.rows[item_no]
         if not item or item[0].startswith('%'):
             self.lineno += 1
-            return False
+            return None
         if len(item) < len(self.fields):
             raise ValueError(
                 "line %d in file %s has %d fields, but we need at "
@@ -109,25 +129,7 @@ class CSVImporter(Importer):
                                                  len(field_names),
                                                  item))
 
-        row = CSVRow(item, field_names)
-        try:
-            self.process_one(row, row.fields, store)
-        except Exception:
-            print()
-            print('Error while processing row %d %r' % (self.lineno, row, ))
-            print()
-            raise
-
-        if self.items != -1:
-            if self.lineno % self.items == 0:
-                t2 = time.time()
-                print('%s Imported %d entries in %2.2f sec total=%d' % (
-                    datetime.datetime.now().strftime('%H:%M:%S'), self.items,
-                    t2 - t, self.lineno))
-                t = t2
-
-        self.lineno += 1
-        return True
+        return CSVRow(item, field_names)
 
     def parse_date(self, data):
         return localdate(*map(int, data.split('-')))
@@ -154,6 +156,18 @@ class CSVImporter(Importer):
         """
         raise NotImplementedError
 
+    def process_one_bulk(self, row, fields, inserter, store):
+        """Like :meth:`.process_one`, but used on bulk imports.
+
+        The rows should be added to *inserter* instead of creating domain
+        objects, see :meth:`Importer.process_item_bulk`.
+        :param row: object representing a row in the input
+        :param fields: a list of fields set in data
+        :param inserter: a :class:`stoqlib.database.bulkinsert.BulkInserter`
+        :param store: a store
+        """
+        raise NotImplementedError
+
     def read(self, iterable):
         """This can be overridden by as subclass which wishes to specialize
         the CSV reader.
@@ -147,8 +147,9 @@ class GnuCashXMLImporter(Importer):
 
     def _get_text(self, node, tag, default=None):
         child = node.find(tag)
-        if child is not None:
-            return child.text
+        if child is not None and child.text is not None:
+            # ElementTree gives us str for ascii only text
+            return unicode(child.text)
         return default
 
     def _import_account(self, store, node):
@@ -30,6 +30,7 @@ import time
 from kiwi.python import namedAny
 import pango
 
+from stoqlib.database.bulkinsert import BulkInserter
 from stoqlib.database.runtime import new_store
 
 log = logging.getLogger(__name__)
@@ -62,15 +63,20 @@ _available_importers = {
 class Importer(object):
     """Class to assist the process of importing csv files.
 
+    :cvar supports_bulk: if the importer implements
+      :meth:`.process_item_bulk` and can be used with ``bulk=True``
+      on :meth:`.process`
     """
 
+    supports_bulk = False
+
     def __init__(self, items=500, dry=False):
         """
         Create a new Importer object.
         :param items: see :class:`set_items_per_commit`
         :param dry: see :class:`set_dry`
         """
-        self.items = items
+        self.items_per_commit = items
         self.dry = dry
 
     def feed_file(self, filename):
@@ -86,7 +92,7 @@ class Importer(object):
         before committing
         :param items: number of items or
         """
-        self.n_items = items
+        self.items_per_commit = items
 
     def set_dry(self, dry):
         """Tells the CSVImporter to run in dry mode, eg without committing
@@ -95,8 +101,20 @@ class Importer(object):
         """
         self.dry = dry
 
-    def process(self, store=None):
-        """Do the main logic, create stores, import items etc"""
+    def process(self, store=None, bulk=False):
+        """Do the main logic, create stores, import items etc
+
+        :param store: the store to use. If ``None``, a new one will be
+          created and a new one will be used after each commit
+        :param bulk: if ``True``, the rows will be batched and inserted with
+          multi-row INSERTs by a
+          :class:`stoqlib.database.bulkinsert.BulkInserter`, see
+          :meth:`.process_item_bulk`
+        """
+        if bulk and not self.supports_bulk:
+            raise ValueError("%s does not support bulk imports" % (
+                self.__class__.__name__, ))
+
         n_items = self.get_n_items()
         log.info('Importing %d items' % (n_items, ))
         create_log.info('ITEMS:%d' % (n_items, ))
@@ -105,14 +123,29 @@ class Importer(object):
         imported_items = 0
         if not store:
             store = new_store()
+        inserter = BulkInserter(store) if bulk else None
         self.before_start(store)
         for i in range(n_items):
-            if self.process_item(store, i):
+            if bulk:
+                imported = self.process_item_bulk(inserter, store, i)
+            else:
+                imported = self.process_item(store, i)
+            if imported:
                 create_log.info('ITEM:%d' % (i + 1, ))
                 imported_items += 1
-            if not self.dry and i + 1 % 100 == 0:
-                store.commit(close=True)
-                store = new_store()
+            if (self.items_per_commit > 0 and
+                    (i + 1) % self.items_per_commit == 0):
+                if inserter is not None:
+                    inserter.flush()
+                if not self.dry:
+                    store.commit(close=True)
+                    store = new_store()
+                    if inserter is not None:
+                        inserter.store = store
+                self.report_progress(i + 1, n_items, time.time() - t1)
+
+        if inserter is not None:
+            inserter.flush()
 
         if not self.dry:
             store.commit(close=True)
@@ -124,11 +157,27 @@ class Importer(object):
             store.commit(close=True)
 
         t2 = time.time()
+        self.report_progress(n_items, n_items, t2 - t1)
         log.info('%s Imported %d entries in %2.2f sec' % (
             datetime.datetime.now().strftime('%H:%M:%S'), n_items,
             t2 - t1))
         create_log.info('IMPORTED-ITEMS:%d' % (imported_items, ))
 
+    def report_progress(self, processed, total, elapsed):
+        """Report the import progress
+
+        This is called after each commit and when the import finishes.
+        Subclasses can override this to display the progress somewhere else.
+
+        :param processed: the number of items processed so far
+        :param total: the total number of items
+        :param elapsed: the time elapsed since the import started, in seconds
+        """
+        rate = processed / elapsed if elapsed else 0
+        log.info('%s Processed %d of %d items (%.1f items/sec)' % (
+            datetime.datetime.now().strftime('%H:%M:%S'), processed,
+            total, rate))
+
     def feed(self, fp, filename='<stdin>'):
         """Feeds csv data from an iterable
         :param fp: a file descriptor
@@ -145,6 +194,19 @@ class Importer(object):
         """
         raise NotImplementedError
 
+    def process_item_bulk(self, inserter, store, item_no):
+        """Like :meth:`.process_item`, but used on bulk imports
+
+        Instead of creating domain objects, the rows should be added to
+        *inserter*, parents before children. *store* can still be used
+        to find or create shared objects, like categories.
+
+        :param inserter: a :class:`stoqlib.database.bulkinsert.BulkInserter`
+        :param store: a store
+        :returns True if the item was imported, False if not
+        """
+        raise NotImplementedError
+
     #
     # Optional to implement
     #
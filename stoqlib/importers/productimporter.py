@@ -38,6 +38,8 @@ from stoqlib.lib.parameters import sysparam
 
 
 class ProductImporter(CSVImporter):
+    supports_bulk = True
+
     fields = ['base_category',
               'barcode',
               'category',
@@ -77,7 +79,7 @@ class ProductImporter(CSVImporter):
             obj = table(store=store, **attributes)
         return obj
 
-    def process_one(self, data, fields, store):
+    def _get_category(self, data, store):
         base_category = self._get_or_create(
             SellableCategory, store,
             suggested_markup=Decimal(data.markup),
@@ -92,20 +94,27 @@ class ProductImporter(CSVImporter):
             installments_value=Decimal(data.commission2),
             category=base_category)
 
-        category = self._get_or_create(
+        return self._get_or_create(
             SellableCategory, store,
             description=data.category,
             suggested_markup=Decimal(data.markup2),
             category=base_category)
 
+    def _get_next_code(self):
+        code = u'%02d' % self._code
+        self._code += 1
+        return code
+
+    def process_one(self, data, fields, store):
+        category = self._get_category(data, store)
+
         sellable = Sellable(store=store,
                             cost=Decimal(data.cost),
                             category=category,
                             description=data.description,
                             price=Decimal(data.price))
         sellable.barcode = data.barcode
-        sellable.code = u'%02d' % self._code
-        self._code += 1
+        sellable.code = self._get_next_code()
         if u'unit' in fields:
             if not data.unit in self.units:
                 raise ValueError(u"invalid unit: %s" % data.unit)
@@ -121,3 +130,32 @@ class ProductImporter(CSVImporter):
                             base_cost=Decimal(data.cost),
                             product=product)
         Storable(product=product, store=store)
+
+    def process_one_bulk(self, data, fields, inserter, store):
+        category = self._get_category(data, store)
+
+        unit_id = None
+        if u'unit' in fields:
+            if not data.unit in self.units:
+                raise ValueError(u"invalid unit: %s" % data.unit)
+            unit_id = self.units[data.unit].id
+
+        # Sellable, Product and Storable share the same id
+        sellable_id = inserter.add(
+            Sellable,
+            cost=Decimal(data.cost),
+            category_id=category.id,
+            commission=category.get_commission() or 0,
+            description=data.description,
+            base_price=Decimal(data.price),
+            barcode=data.barcode,
+            code=self._get_next_code(),
+            unit_id=unit_id,
+            tax_constant_id=self.tax_constant_id)
+        inserter.add(Product, id=sellable_id)
+        inserter.add(ProductSupplierInfo,
+                     supplier_id=self.supplier.id,
+                     is_main_supplier=True,
+                     base_cost=Decimal(data.cost),
+                     product_id=sellable_id)
+        inserter.add(Storable, id=sellable_id)
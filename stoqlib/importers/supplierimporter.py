@@ -30,6 +30,8 @@ from stoqlib.lib.parameters import sysparam
 
 
 class SupplierImporter(CSVImporter):
+    supports_bulk = True
+
     fields = ['name',
               'phone_number',
               'mobile_number',
@@ -43,7 +45,10 @@ class SupplierImporter(CSVImporter):
               'streetnumber',
               'district']
 
-    suppliers = []
+    def __init__(self, lines=500, dry=False):
+        super(SupplierImporter, self).__init__(lines=lines, dry=dry)
+        self.suppliers = []
+        self.supplier_ids = []
 
     def process_one(self, data, fields, store):
         person = Person(
@@ -76,10 +81,43 @@ class SupplierImporter(CSVImporter):
         supplier = Supplier(person=person, store=store)
         self.suppliers.append(supplier)
 
+    def process_one_bulk(self, data, fields, inserter, store):
+        person_id = inserter.add(
+            Person,
+            name=data.name,
+            phone_number=data.phone_number,
+            mobile_number=data.mobile_number)
+
+        inserter.add(Company,
+                     person_id=person_id,
+                     cnpj=data.cnpj,
+                     fancy_name=data.name,
+                     state_registry=data.state_registry)
+
+        ctloc = CityLocation.get_or_create(store=store,
+                                           city=data.city,
+                                           state=data.state,
+                                           country=data.country)
+        streetnumber = data.streetnumber and int(data.streetnumber) or None
+        inserter.add(
+            Address,
+            is_main_address=True,
+            person_id=person_id,
+            city_location_id=ctloc.id,
+            street=data.street,
+            streetnumber=streetnumber,
+            district=data.district)
+
+        self.supplier_ids.append(inserter.add(Supplier, person_id=person_id))
+
     def when_done(self, store):
         if sysparam.has_object('SUGGESTED_SUPPLIER'):
             return
 
-        if not self.suppliers:
+        if self.suppliers:
+            supplier = self.suppliers[0]
+        elif self.supplier_ids:
+            supplier = store.get(Supplier, self.supplier_ids[0])
+        else:
             return
-        sysparam.set_object(store, 'SUGGESTED_SUPPLIER', self.suppliers[0])
+        sysparam.set_object(store, 'SUGGESTED_SUPPLIER', supplier)
@@ -46,6 +46,8 @@ from stoqlib.lib.translation import stoqlib_gettext
 _ = stoqlib_gettext
 log = logging.getLogger(__name__)
 
+_logo_paths = {}
+
 
 (BILL_OPTION_BANK_BRANCH,
  BILL_OPTION_BANK_ACCOUNT,
@@ -127,6 +129,10 @@ class BankInfo(object):
     validate_field_func = None
     validate_field_dv = None
 
+    #: The :class:`stoqlib.lib.cnab.base.Cnab` used to generate the
+    #: remittance files and parse the return files of this bank
+    cnab_class = None
+
     nosso_numero = custom_property('nosso_numero', 13)
     agencia = custom_property('agencia', 4)
     conta = custom_property('conta', 7)
@@ -142,10 +148,7 @@ class BankInfo(object):
         for key, value in props.items():
             setattr(self, key, value)
 
-        self.logo_image_path = ""
-        if self.logo:
-            self.logo_image_path = environ.get_resource_filename(
-                'stoq', 'pixmaps', self.logo)
+        self.logo_image_path = self.get_logo_image_path()
 
     def get_properties(self, payment):
         """Get values necesary for bill emission.
@@ -219,7 +222,7 @@ class BankInfo(object):
         demonstrativo = [payment.group.get_description().capitalize()]
         sale = payment.group.sale
         if sale:
-            for item in sale.get_items():
+            for item in sale.get_items().prefetch('sellable'):
                 demonstrativo.append(' - %s' % item.get_description())
         return demonstrativo
 
@@ -349,6 +352,52 @@ class BankInfo(object):
         cnab.setup(payments)
         return cnab.as_string()
 
+    @classmethod
+    def get_logo_image_path(cls):
+        """Get the path of the logo of this bank
+
+        The path is cached, since it is needed for every bill printed.
+
+        :returns: the path, or an empty string if the bank has no logo
+        """
+        if not cls.logo:
+            return ""
+        path = _logo_paths.get(cls.logo)
+        if path is None:
+            path = environ.get_resource_filename('stoq', 'pixmaps', cls.logo)
+            _logo_paths[cls.logo] = path
+        return path
+
+    @classmethod
+    def parse_return(cls, data):
+        """Parses a return file sent by the bank
+
+        :param data: the content of the file
+        :returns: a list of :class:`stoqlib.lib.cnab.base.ReturnEntry`
+        """
+        if cls.cnab_class is None:
+            raise BoletoException(
+                _("Return files are not supported for %s") % (
+                    cls.description, ))
+        return cls.cnab_class.parse_return(data)
+
+    @classmethod
+    def get_identifier(cls, nosso_numero, options):
+        """Get the identifier of the payment of a nosso número
+
+        This does the opposite of what :meth:`.get_properties` does
+        to build the nosso número from the payment identifier.
+
+        :param nosso_numero: the nosso número, without the verifier digit
+        :param options: a dict with the bill options of the bank account
+        :returns: the identifier, or ``None`` if it is not a valid
+          nosso número
+        """
+        try:
+            return int(nosso_numero)
+        except ValueError:
+            return None
+
     @classmethod
     def get_extra_options(cls):
         rv = []
@@ -574,6 +623,13 @@ class BankBB(BankInfo):
             nn = val.zfill(9)
         self._nosso_numero = nn
 
+    @classmethod
+    def get_identifier(cls, nosso_numero, options):
+        # The nosso número is prefixed by the convenio, see nosso_numero
+        len_convenio = len(options.get(u'convenio') or '') or 7
+        return super(BankBB, cls).get_identifier(
+            nosso_numero[len_convenio:], options)
+
     @property
     def convenio(self):
         return self._convenio
@@ -650,6 +706,14 @@ class BankCaixa(BankInfo):
         self._nosso_numero = (self.inicio_nosso_numero +
                               self.formata_numero(val, 8))
 
+    @classmethod
+    def get_identifier(cls, nosso_numero, options):
+        nosso_numero = nosso_numero.lstrip('0')
+        if (len(nosso_numero) == len(cls.inicio_nosso_numero) + 8 and
+                nosso_numero.startswith(cls.inicio_nosso_numero)):
+            nosso_numero = nosso_numero[len(cls.inicio_nosso_numero):]
+        return super(BankCaixa, cls).get_identifier(nosso_numero, options)
+
     @property
     def dv_nosso_numero(self):
         resto2 = modulo11(self.nosso_numero.split('-')[0], 9, 1)
@@ -20,6 +20,7 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
+import datetime
 from decimal import Decimal
 
 from kiwi.python import strip_accents
@@ -27,6 +28,24 @@ from kiwi.python import strip_accents
 from stoqlib.lib.dateutils import localnow
 
 
+class CnabException(Exception):
+    pass
+
+
+def parse_date(value):
+    """Parses a date of a CNAB file
+
+    :param value: the date formated as ``DDMMYYYY`` or ``DDMMYY``
+    :returns: a date or ``None`` if *value* is empty or zero
+    """
+    value = str(value).strip()
+    if not value or not int(value):
+        return None
+    if len(value) == 6:
+        return datetime.datetime.strptime(value, '%d%m%y').date()
+    return datetime.datetime.strptime(value.zfill(8), '%d%m%Y').date()
+
+
 class Field(object):
     """A field in an CNAB Record.
 
@@ -102,6 +121,26 @@ class Field(object):
 
         return value or ''
 
+    def parse(self, value):
+        """Parses the string representation of this field
+
+        This is the opposite of :meth:`.as_string`, used to read
+        the return files.
+
+        :param value: the string, with :attr:`.size` characters
+        :returns: the value of the field
+        """
+        if self.type is str:
+            return value.strip()
+
+        value = value.strip()
+        if not value:
+            return self.type(0)
+        if self.type is int:
+            return int(value)
+        elif self.type is Decimal:
+            return Decimal(value) / (10 ** self.decimals)
+
 
 class Record(object):
     """A record in a CNAB file.
@@ -170,9 +209,73 @@ class Record(object):
         assert len(value) == self.size, (len(value), self.size)
         return value
 
+    def parse(self, line):
+        """Parses a line of a return file
+
+        :param line: the line, with at least :attr:`.size` characters
+        :returns: a dict mapping the names of the fields to their values
+        """
+        if len(line) < self.size:
+            raise CnabException("Expected a line with %d characters, "
+                                "got %d" % (self.size, len(line)))
+
+        values = {}
+        pos = 0
+        for field in self._fields:
+            raw = line[pos:pos + field.size]
+            pos += field.size
+            if field.name in ('cnab', '_'):
+                continue
+            try:
+                values[field.name] = field.parse(raw)
+            except ValueError:
+                raise CnabException("Invalid value for %s: %r" % (
+                    field.name, raw))
+        return values
+
+
+class ReturnEntry(object):
+    """A bill which had a movement on a return file
+
+    :param nosso_numero: the nosso número of the bill, without
+      the verifier digit
+    :param movement_code: the movement code (or *ocorrência*) informed
+      by the bank
+    :param value: the value of the bill
+    :param paid_value: the value paid by the payer, or ``None`` if the
+      file doesn't inform it
+    :param interest: the interest and penalty paid
+    :param discount: the discount given, including the abatimento
+    :param paid_date: the date the bill was paid
+    :param credit_date: the date the value was credited on the account
+    :param line_number: the line of the file where the bill is
+    :param paid: if this movement is a payment of the bill
+    """
+
+    def __init__(self, nosso_numero, movement_code, value, paid_value,
+                 interest=0, discount=0, paid_date=None, credit_date=None,
+                 line_number=None, paid=False):
+        self.nosso_numero = nosso_numero
+        self.movement_code = movement_code
+        self.value = value
+        self.paid_value = paid_value
+        self.interest = interest
+        self.discount = discount
+        self.paid_date = paid_date
+        self.credit_date = credit_date
+        self.line_number = line_number
+        self.paid = paid
+
+    def __repr__(self):  # pragma no cover
+        return '<ReturnEntry nosso_numero={} movement_code={}>'.format(
+            self.nosso_numero, self.movement_code)
+
 
 class Cnab(object):
 
+    #: The movement codes meaning that the bill was paid
+    paid_movement_codes = ()
+
     def __init__(self, branch, bank, bank_info):
         self.bank_info = bank_info
         self.records = []
@@ -221,5 +324,24 @@ class Cnab(object):
         # Cnab requires an extra \r\n at the last line
         return '\r\n'.join(r.as_string() for r in self.records) + '\r\n'
 
+    @classmethod
+    def parse_return(cls, data):
+        """Parses a return file sent by the bank
+
+        :param data: the content of the file
+        :returns: a list of :class:`ReturnEntry`
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def get_lines(cls, data):
+        """Get the lines of a file, skipping the empty ones
+
+        :param data: the content of the file
+        :returns: a list of (line number, line) tuples
+        """
+        return [(i, line) for i, line in enumerate(data.splitlines(), 1)
+                if line.strip()]
+
     def __repr__(self):  # pragma no cover
         return '<{} records={}>'.format(self.__class__.__name__, len(self.records))
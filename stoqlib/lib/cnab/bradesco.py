@@ -21,7 +21,7 @@
 ##
 
 from stoqlib.lib.cnab.base import Field
-from stoqlib.lib.cnab.febraban import (RecordP,
+from stoqlib.lib.cnab.febraban import (RecordP, RecordT,
                                        FebrabanCnab)
 
 
@@ -38,8 +38,21 @@ class BradescoRecordP(RecordP):
     }
 
 
+class BradescoRecordT(RecordT):
+
+    replace_fields = {
+        'nosso_numero': [
+            Field('identificacao_produto', int, 3),
+            Field('_', int, 5, 0),
+            Field('nosso_numero', int, 11),
+            Field('dv_nosso_numero', str, 1),
+        ],
+    }
+
+
 class BradescoCnab(FebrabanCnab):
     RecordP = BradescoRecordP
+    RecordT = BradescoRecordT
 
     file_version = 84
     batch_version = 42
@@ -23,7 +23,7 @@
 from stoqlib.lib.cnab.base import Field
 from stoqlib.lib.cnab.febraban import (FileHeader, FileTrailer, BatchHeader,
                                        BatchTrailer, RecordQ, RecordP, RecordR,
-                                       FebrabanCnab)
+                                       RecordT, FebrabanCnab)
 
 
 class CaixaFileHeader(FileHeader):
@@ -80,6 +80,22 @@ class CaixaRecordR(RecordR):
     ]
 
 
+class CaixaRecordT(RecordT):
+    replace_fields = {
+        'account': [Field('codigo_convenio', int, 6)],
+        'account_dv': [Field('_', int, 7, 0)],
+        'nosso_numero': [
+            Field('_', int, 3, 0),
+            Field('modalidade_carteira', int, 2, 0),
+            Field('nosso_numero', int, 15),
+        ],
+        'numero_documento': [
+            Field('numero_documento', str, 11),
+            Field('_', str, 4, ''),
+        ],
+    }
+
+
 class CaixaBatchTrailer(BatchTrailer):
 
     replace_fields = {
@@ -105,6 +121,7 @@ class CaixaCnab(FebrabanCnab):
     RecordP = CaixaRecordP
     RecordQ = CaixaRecordQ
     RecordR = CaixaRecordR
+    RecordT = CaixaRecordT
 
     file_version = 50
     batch_version = 30
@@ -28,7 +28,8 @@ the fields available, or have different default values for the fields.
 
 from decimal import Decimal
 
-from stoqlib.lib.cnab.base import Record, Field, Cnab
+from stoqlib.lib.cnab.base import (Record, Field, Cnab, CnabException,
+                                   ReturnEntry, parse_date)
 from stoqlib.lib.formatters import format_address
 
 
@@ -58,6 +59,11 @@ MOVEMENT_TYPE_ADD_DISCOUNT = 4
 MOVEMENT_TYPE_CANCEL_DISCOUNT = 5
 # and so on ...
 
+# Movement type constants on return files
+# See field description C044
+MOVEMENT_TYPE_PAID = 6
+MOVEMENT_TYPE_PAID_AFTER_WRITE_OFF = 17
+
 # Wallet type constants
 # See field description C006
 WALLET_SIMPLE_CHARGING = 1
@@ -366,6 +372,97 @@ class RecordR(Record):
         super(RecordR, self).__init__(**kwargs)
 
 
+class RecordT(Record):
+    """Bill information on the return file
+
+    This is followed by a :class:`RecordU` with the paid values
+    """
+    fields = [
+        # Control data 1 - 3
+        Field('bank_number', int, 3),
+        Field('batch', int, 4),
+        Field('registry_type', int, 1, REGISTER_DETAIL),
+
+        # Service 4 - 7
+        Field('registry_sequence', int, 5),
+        Field('segment', str, 1, 'T'),
+        Field('cnab', str, 1, ''),
+        Field('movement_code', int, 2),  # C044
+
+        # account data 8 - 12
+        Field('agency', int, 5),
+        Field('agency_dv', str, 1),
+        Field('account', int, 12),
+        Field('account_dv', str, 1),
+        Field('dv_agencia_conta', str, 1),
+
+        # Nosso numero - 13
+        Field('nosso_numero', str, 20),
+
+        # 14 - 21 Bill data
+        Field('carteira', int, 1),
+        Field('numero_documento', str, 15),
+        Field('due_date', int, 8),
+        Field('value', Decimal, 13),
+        Field('charging_bank', int, 3),
+        Field('charging_agency', int, 5),
+        Field('charging_agency_dv', str, 1),
+        Field('company_identifier', str, 25),
+        Field('currency_code', int, 2),
+
+        # 22 - 24 Payer
+        Field('payer_type', int, 1),
+        Field('payer_document', int, 15),
+        Field('payer_name', str, 40),
+
+        Field('contract_number', str, 10),
+        Field('tariff', Decimal, 13),
+        Field('movement_reason', str, 10),  # C047
+        Field('cnab', str, 17, ''),
+    ]
+
+
+class RecordU(Record):
+    """Values paid for the bill of the previous :class:`RecordT`
+    """
+    fields = [
+        # Control data 1 - 3
+        Field('bank_number', int, 3),
+        Field('batch', int, 4),
+        Field('registry_type', int, 1, REGISTER_DETAIL),
+
+        # Service 4 - 7
+        Field('registry_sequence', int, 5),
+        Field('segment', str, 1, 'U'),
+        Field('cnab', str, 1, ''),
+        Field('movement_code', int, 2),
+
+        # 8 - 15 Values
+        Field('interest', Decimal, 13),  # Juros, multa e encargos
+        Field('discount', Decimal, 13),
+        Field('abatimento', Decimal, 13),
+        Field('iof', Decimal, 13),
+        Field('paid_value', Decimal, 13),
+        Field('net_value', Decimal, 13),
+        Field('other_expenses', Decimal, 13),
+        Field('other_credits', Decimal, 13),
+
+        # 16 - 17 Dates
+        Field('occurrence_date', int, 8),
+        Field('credit_date', int, 8),
+
+        # 18 - 20 Payer occurrence
+        Field('payer_occurrence_code', str, 4),
+        Field('payer_occurrence_date', int, 8),
+        Field('payer_occurrence_value', Decimal, 13),
+        Field('payer_occurrence_complement', str, 30),
+
+        Field('corresponding_bank', int, 3),
+        Field('corresponding_bank_nosso_numero', str, 20),
+        Field('cnab', str, 7, ''),
+    ]
+
+
 class BatchTrailer(Record):
     fields = [
         # Control
@@ -435,6 +532,12 @@ class FebrabanCnab(Cnab):
     RecordQ = RecordQ
     RecordR = RecordR
 
+    RecordT = RecordT
+    RecordU = RecordU
+
+    paid_movement_codes = (MOVEMENT_TYPE_PAID,
+                           MOVEMENT_TYPE_PAID_AFTER_WRITE_OFF)
+
     #: Version of the file record. Subclasses must define this if they are
     #: using the default febraban FileHeader record
     file_version = None
@@ -459,3 +562,41 @@ class FebrabanCnab(Cnab):
     @property
     def total_records(self):
         return len(self.records)
+
+    @classmethod
+    def parse_return(cls, data):
+        entries = []
+        record_t = cls.RecordT()
+        record_u = cls.RecordU()
+        bill = None
+        for line_number, line in cls.get_lines(data):
+            if line[7:8] != str(REGISTER_DETAIL):
+                continue
+            segment = line[13:14]
+            if segment == 'T':
+                bill = record_t.parse(line)
+                bill['line_number'] = line_number
+            elif segment == 'U':
+                if bill is None:
+                    raise CnabException(
+                        "Segment U without a segment T on line %d" % (
+                            line_number, ))
+                values = record_u.parse(line)
+                entries.append(cls._build_return_entry(bill, values))
+                bill = None
+        return entries
+
+    @classmethod
+    def _build_return_entry(cls, bill, values):
+        movement_code = bill['movement_code']
+        return ReturnEntry(
+            nosso_numero=str(bill['nosso_numero']),
+            movement_code=movement_code,
+            value=bill['value'],
+            paid_value=values['paid_value'],
+            interest=values['interest'],
+            discount=values['discount'] + values['abatimento'],
+            paid_date=parse_date(values['occurrence_date']),
+            credit_date=parse_date(values['credit_date']),
+            line_number=bill['line_number'],
+            paid=movement_code in cls.paid_movement_codes)
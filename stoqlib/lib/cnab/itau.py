@@ -22,7 +22,7 @@
 
 from stoqlib.lib.cnab.base import Field
 from stoqlib.lib.cnab.febraban import (FileHeader, BatchHeader, RecordP,
-                                       FebrabanCnab)
+                                       RecordT, FebrabanCnab)
 
 
 class ItauFileHeader(FileHeader):
@@ -68,10 +68,26 @@ class ItauRecordP(RecordP):
     }
 
 
+class ItauRecordT(RecordT):
+    replace_fields = {
+        'nosso_numero': [
+            Field('numero_carteira', int, 3),
+            Field('nosso_numero', int, 8),
+            Field('dac_nosso_numero', int, 1),
+            Field('_', str, 8, ''),
+        ],
+        'numero_documento': [
+            Field('numero_documento', str, 10),
+            Field('_', str, 5, ''),
+        ],
+    }
+
+
 class ItauCnab(FebrabanCnab):
     FileHeader = ItauFileHeader
     BatchHeader = ItauBatchHeader
     RecordP = ItauRecordP
+    RecordT = ItauRecordT
 
     file_version = 40
     batch_version = 30
@@ -22,7 +22,8 @@
 
 from decimal import Decimal
 
-from stoqlib.lib.cnab.base import Field, Record, Cnab
+from stoqlib.lib.cnab.base import (Field, Record, Cnab, ReturnEntry,
+                                   parse_date)
 from stoqlib.lib.formatters import format_address
 
 
@@ -194,8 +195,64 @@ class ItauFileTrailer(Record400):
     ]
 
 
+class ItauReturnDetail(Record400):
+    """A bill on the return file"""
+    fields = [
+        Field('registry_type', int, 1, 1),
+        Field('company_type', int, 2),
+        Field('company_document', int, 14),
+        Field('agency', int, 4),
+        Field('_', int, 2, 0),
+        Field('account', int, 5),
+        Field('dv_agencia_conta', int, 1),
+        Field('_', str, 8, ''),
+        Field('company_identifier', str, 25),
+        Field('nosso_numero', int, 8),
+        Field('_', str, 12, ''),
+        Field('carteira', int, 3),
+        Field('_', int, 8),  # The nosso numero again
+        Field('dac_nosso_numero', int, 1),
+        Field('_', str, 13, ''),
+        Field('codigo_carteira', str, 1),
+        Field('codigo_ocorrencia', int, 2),  # NOTA 17
+        Field('occurrence_date', int, 6),
+        Field('numero_documento', str, 10),
+        Field('_', str, 8, ''),  # The nosso numero again
+        Field('_', str, 12, ''),
+        Field('due_date', int, 6),
+        Field('value', Decimal, 11),
+        Field('bank_number', int, 3),
+        Field('charging_agency', int, 4),
+        Field('charging_agency_dv', int, 1),
+        Field('especie_titulo', str, 2),
+        Field('tariff', Decimal, 11),
+        Field('_', str, 26, ''),
+        Field('iof', Decimal, 11),
+        Field('abatimento', Decimal, 11),
+        Field('discount', Decimal, 11),
+        Field('principal', Decimal, 11),
+        Field('interest', Decimal, 11),  # Juros de mora e multa
+        Field('other_credits', Decimal, 11),
+        Field('dda', str, 1),
+        Field('_', str, 2, ''),
+        Field('credit_date', int, 6),
+        Field('cancelled_instruction', int, 4),
+        Field('_', str, 6, ''),
+        Field('_', int, 13, 0),
+        Field('payer_name', str, 30),
+        Field('_', str, 23, ''),
+        Field('errors', str, 8),  # NOTA 20
+        Field('_', str, 7, ''),
+        Field('codigo_liquidacao', str, 2),  # NOTA 28
+        Field('registry_sequence', int, 6),
+    ]
+
+
 class ItauCnab400(Cnab):
 
+    # NOTA 17: 06 = liquidação normal, 08 = liquidação em cartório
+    paid_movement_codes = (6, 8)
+
     def setup(self, payments):
         i = 1
         self.add_record(ItauFileHeader, registry_sequence=i)
@@ -215,3 +272,27 @@ class ItauCnab400(Cnab):
         date = self.default_values['create_date']
         # the format here is ddmmaa, while the other is ddmmaaaa
         return date[:4] + date[-2:]
+
+    @classmethod
+    def parse_return(cls, data):
+        entries = []
+        record = ItauReturnDetail()
+        for line_number, line in cls.get_lines(data):
+            if line[0] != '1':
+                continue
+            values = record.parse(line)
+            movement_code = values['codigo_ocorrencia']
+            discount = values['discount'] + values['abatimento']
+            entries.append(ReturnEntry(
+                nosso_numero=str(values['nosso_numero']),
+                movement_code=movement_code,
+                value=values['value'],
+                # The value credited by the bank
+                paid_value=values['principal'] or None,
+                interest=values['interest'],
+                discount=discount,
+                paid_date=parse_date(values['occurrence_date']),
+                credit_date=parse_date(values['credit_date']),
+                line_number=line_number,
+                paid=movement_code in cls.paid_movement_codes))
+        return entries
@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Settle the bills paid on a return file sent by the bank
+
+The return file (*arquivo de retorno*) lists the movements of the bills
+sent on the remittance files, including the ones that were paid. Instead
+of receiving each |payment| on the receivable application, the file is
+parsed by the bank specific :class:`stoqlib.lib.cnab.base.Cnab` and each
+paid bill is matched to its |payment| by the nosso número (which is built
+from the payment identifier) and paid with the values informed by the bank.
+
+The payments are paid in batches of :data:`BATCH_SIZE`, each one in its
+own transaction. Payments that are not pending anymore are left alone,
+so the same file can be reconciled again without paying anything twice
+(e.g. after fixing a batch that failed). The identifiers are only unique
+on each branch, so when more than one |payment| is found for a bill it
+is left alone and reported as ambiguous.
+"""
+
+import datetime
+import logging
+
+from storm.expr import And
+
+from stoqlib.database.runtime import new_store
+from stoqlib.domain.payment.method import PaymentMethod
+from stoqlib.domain.payment.payment import Payment
+from stoqlib.lib.boleto import get_bank_info_by_number
+from stoqlib.lib.translation import stoqlib_gettext
+
+_ = stoqlib_gettext
+log = logging.getLogger(__name__)
+
+#: How many bills are paid on each transaction
+BATCH_SIZE = 500
+
+#: The payment was paid
+STATUS_PAID = u'paid'
+#: The payment was already paid (e.g. the file was reconciled before)
+STATUS_ALREADY_PAID = u'already-paid'
+#: No payment was found for the nosso número
+STATUS_NOT_FOUND = u'not-found'
+#: The payment was found, but it is not pending (e.g. it was cancelled)
+STATUS_INVALID = u'invalid'
+#: The movement is not a payment (e.g. the bill was registered)
+STATUS_IGNORED = u'ignored'
+#: More than one payment was found for the nosso número (the identifiers
+#: are only unique on each branch)
+STATUS_AMBIGUOUS = u'ambiguous'
+#: The batch of the bill could not be paid
+STATUS_ERROR = u'error'
+
+
+class ReconciliationResult(object):
+    """The result of the reconciliation of a bill
+
+    :param entry: the :class:`stoqlib.lib.cnab.base.ReturnEntry`
+    :param status: one of the ``STATUS_*`` constants
+    :param identifier: the identifier of the |payment|, if found
+    :param message: a message explaining the status
+    :param paid_value: the value the |payment| was paid with
+    """
+
+    def __init__(self, entry, status, identifier=None, message=None,
+                 paid_value=None):
+        self.entry = entry
+        self.status = status
+        self.identifier = identifier
+        self.message = message
+        self.paid_value = paid_value
+
+
+class ReconciliationSummary(object):
+    """The results of a :class:`BillReconciliation`"""
+
+    statuses = [
+        (STATUS_PAID, _(u"Paid")),
+        (STATUS_ALREADY_PAID, _(u"Already paid")),
+        (STATUS_NOT_FOUND, _(u"Not found")),
+        (STATUS_INVALID, _(u"Not pending")),
+        (STATUS_IGNORED, _(u"Not a payment")),
+        (STATUS_AMBIGUOUS, _(u"More than one payment found")),
+        (STATUS_ERROR, _(u"Errors")),
+    ]
+
+    def __init__(self):
+        self.results = []
+
+    def get_results(self, status):
+        """Get the results with the given status
+
+        :param status: one of the ``STATUS_*`` constants
+        :returns: a list of :class:`ReconciliationResult`
+        """
+        return [r for r in self.results if r.status == status]
+
+    def get_paid_value(self):
+        """Get the total value paid by the reconciliation"""
+        return sum((r.paid_value for r in self.get_results(STATUS_PAID)), 0)
+
+    def get_description(self):
+        """Get a description of the summary, to be displayed to the user"""
+        lines = []
+        for status, description in self.statuses:
+            count = len(self.get_results(status))
+            if count:
+                lines.append(u"%s: %d" % (description, count))
+        lines.append(_(u"Total paid: %s") % (self.get_paid_value(), ))
+        return u'\n'.join(lines)
+
+
+class BillReconciliation(object):
+    """Pays the |payments| of the bills paid on a return file
+
+    :param bank_account: the |bankaccount| of the bills, its bank
+      number is used to know how to parse the file
+    :param data: the content of the return file
+    :param batch_size: how many bills to pay on each transaction
+    """
+
+    def __init__(self, bank_account, data, batch_size=None):
+        self.bank_info = get_bank_info_by_number(bank_account.bank_number)
+        self.options = dict((o.option, o.value)
+                            for o in bank_account.options)
+        self.batch_size = batch_size or BATCH_SIZE
+        self.entries = self.bank_info.parse_return(data)
+
+    #
+    #  Public API
+    #
+
+    def reconcile(self, progress_callback=None):
+        """Pays the payments of the bills paid on the file
+
+        :param progress_callback: a callable receiving the number of
+          bills processed so far and the total number of bills
+        :returns: a :class:`ReconciliationSummary`
+        """
+        summary = ReconciliationSummary()
+        entries = []
+        for entry in self.entries:
+            if not entry.paid:
+                summary.results.append(ReconciliationResult(
+                    entry, STATUS_IGNORED,
+                    message=_(u"Movement code %d") % (entry.movement_code, )))
+                continue
+            entries.append(entry)
+
+        total = len(entries)
+        for start in range(0, total, self.batch_size):
+            batch = entries[start:start + self.batch_size]
+            summary.results.extend(self._reconcile_batch(batch))
+            if progress_callback is not None:
+                progress_callback(start + len(batch), total)
+
+        return summary
+
+    #
+    #  Private
+    #
+
+    def _get_identifier(self, entry):
+        return self.bank_info.get_identifier(entry.nosso_numero,
+                                             self.options)
+
+    def _reconcile_batch(self, entries):
+        store = new_store()
+        try:
+            results = self._pay_entries(store, entries)
+            store.commit(close=True)
+        except Exception as e:
+            log.exception('Could not pay the bills of lines %d to %d' % (
+                entries[0].line_number, entries[-1].line_number))
+            store.rollback(close=True)
+            results = [ReconciliationResult(entry, STATUS_ERROR,
+                                            message=unicode(e))
+                       for entry in entries]
+        return results
+
+    def _pay_entries(self, store, entries):
+        identifiers = set(self._get_identifier(entry) for entry in entries)
+        identifiers.discard(None)
+        payments = {}
+        if identifiers:
+            # The nosso número is built from the payment identifier only
+            query = And(Payment.payment_type == Payment.TYPE_IN,
+                        Payment.method_id == PaymentMethod.id,
+                        PaymentMethod.method_name == u'bill',
+                        Payment.identifier.is_in(identifiers))
+            for payment in store.find(Payment, query):
+                payments.setdefault(int(payment.identifier), []).append(
+                    payment)
+
+        results = []
+        for entry in entries:
+            identifier = self._get_identifier(entry)
+            found = payments.get(identifier, [])
+            payment = found[0] if len(found) == 1 else None
+            if not found:
+                results.append(ReconciliationResult(entry, STATUS_NOT_FOUND))
+            elif len(found) > 1:
+                # The identifiers are unique per branch, and there is
+                # nothing on the file telling which branch the bill is from
+                results.append(ReconciliationResult(
+                    entry, STATUS_AMBIGUOUS, identifier=identifier,
+                    message=u', '.join(sorted(
+                        p.branch.get_description() for p in found))))
+            elif payment.is_paid():
+                results.append(ReconciliationResult(
+                    entry, STATUS_ALREADY_PAID, identifier=identifier))
+            elif not payment.is_pending():
+                results.append(ReconciliationResult(
+                    entry, STATUS_INVALID, identifier=identifier,
+                    message=payment.status_str))
+            else:
+                self._pay(payment, entry)
+                results.append(ReconciliationResult(
+                    entry, STATUS_PAID, identifier=identifier,
+                    paid_value=payment.paid_value))
+        return results
+
+    def _pay(self, payment, entry):
+        paid_date = entry.paid_date or entry.credit_date
+        if paid_date is not None:
+            paid_date = datetime.datetime.combine(paid_date, datetime.time())
+
+        payment.interest = entry.interest
+        payment.discount = entry.discount
+        payment.pay(paid_date=paid_date, paid_value=entry.paid_value)
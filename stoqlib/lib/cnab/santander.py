@@ -23,7 +23,7 @@
 
 from stoqlib.lib.cnab.base import Field
 from stoqlib.lib.cnab.febraban import (FileHeader, FebrabanCnab, BatchHeader,
-                                       RecordP, RecordQ, RecordR)
+                                       RecordP, RecordQ, RecordR, RecordT)
 
 
 class SantanderFileHeader(FileHeader):
@@ -124,6 +124,24 @@ class SantanderRecordR(RecordR):
     }
 
 
+class SantanderRecordT(RecordT):
+    fields = RecordT.fields[:-1] + [
+        Field('cnab', str, 22, ''),
+    ]
+
+    replace_fields = {
+        'agency': [Field('agency', int, 4)],
+        'account': [Field('account', int, 9)],
+        'dv_agencia_conta': [Field('_', str, 8, '')],
+        # The nosso numero here has the verifier digit
+        'nosso_numero': [
+            Field('nosso_numero', int, 12),
+            Field('dv_nosso_numero', int, 1),
+        ],
+        'charging_agency': [Field('charging_agency', int, 4)],
+    }
+
+
 class SantanderCnab(FebrabanCnab):
     FileHeader = SantanderFileHeader
 
@@ -132,6 +150,7 @@ class SantanderCnab(FebrabanCnab):
     RecordP = SantanderRecordP
     RecordQ = SantanderRecordQ
     RecordR = SantanderRecordR
+    RecordT = SantanderRecordT
 
     file_version = 40
     batch_version = 30
@@ -5,6 +5,7 @@
 # http://wiki.python.org/moin/PythonDecoratorLibrary#Cached_Properties
 #
 
+import collections
 import inspect
 import time
 import functools
@@ -13,6 +14,7 @@ import Queue
 import sys
 import threading
 import traceback
+import weakref
 
 log = logging.getLogger(__name__)
 
@@ -45,7 +47,7 @@ class cached_property(object):
 
     To expire a cached property value manually just do::
 
-        del instance._cache[<property name>]
+        MyClass.randint.expire(instance)
 
     '''
 
@@ -60,6 +62,9 @@ class cached_property(object):
         return self
 
     def __get__(self, inst, owner):
+        if inst is None:
+            return self
+
         now = time.time()
         try:
             value, last_update = inst._cache[self.__name__]
@@ -74,41 +79,194 @@ class cached_property(object):
             cache[self.__name__] = (value, now)
         return value
 
+    def expire(self, inst):
+        """Expire the value cached for the given instance
+
+        :param inst: the instance of the class that has the property
+        """
+        getattr(inst, '_cache', {}).pop(self.__name__, None)
+
+
+class _LRUCache(object):
+    """A mapping of a limited size, that evicts the least recently used
+    entries first and expires the ones older than *ttl* seconds
+    """
+
+    def __init__(self, name, maxsize, ttl):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                value, last_update = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return _missing
+
+            if self.ttl > 0 and time.time() - last_update > self.ttl:
+                self.misses += 1
+                return _missing
+
+            # Put it back at the end, as the most recently used
+            self._data[key] = (value, last_update)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, time.time())
+            if self.maxsize > 0 and len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def get_stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, size=len(self._data),
+                    maxsize=self.maxsize)
+
+
+_missing = object()
+_generic_key_mark = object()
+_caches = weakref.WeakSet()
+# name of a domain class -> the caches that depend on it
+_dependent_caches = {}
+
+
+def _make_generic_key(args, kwargs):
+    return (_generic_key_mark, args, tuple(sorted(kwargs.items())))
+
+
+def _get_key_builder(func):
+    # Inspecting the arguments on every call costs more than a lot of
+    # the functions being cached, so do that only once here
+    try:
+        spec = inspect.getargspec(func)
+    except TypeError:
+        return _make_generic_key
+    if spec.varargs is not None or spec.keywords is not None:
+        return _make_generic_key
+
+    names = spec.args
+    defaults = dict(zip(reversed(names), reversed(spec.defaults or ())))
+
+    def make_key(args, kwargs):
+        if not kwargs and len(args) == len(names):
+            return args
+
+        # Use the same key for positional, keyword and default arguments
+        values = list(args)
+        used = 0
+        for name in names[len(args):]:
+            if name in kwargs:
+                values.append(kwargs[name])
+                used += 1
+            elif name in defaults:
+                values.append(defaults[name])
+            else:
+                # The call is missing an argument and will fail anyway
+                return _make_generic_key(args, kwargs)
+        if used != len(kwargs):
+            return _make_generic_key(args, kwargs)
+        return tuple(values)
+
+    return make_key
+
 
 class cached_function(object):
-    """Like cached_property but for functions"""
+    """Like cached_property but for functions
+
+    The values are cached by the arguments used to call the function,
+    which means they need to be hashable. At most *maxsize* values are
+    cached, the least recently used ones being discarded first.
+
+    The decorated function will have some extra attributes:
+
+    * ``cache_info()``: a dict with the hits, misses, evictions and
+      size of the cache
+    * ``cache_clear()``: removes all the cached values
+    * ``invalidate(*args, **kwargs)``: removes the value cached for
+      the given arguments
+
+    :param ttl: for how many seconds the values are cached. Zero means
+      they will never expire
+    :param maxsize: how many values to cache. Zero means no limit
+    :param depends_on: a list of names of |domain| classes. The cache will
+      be cleared when an object of any of those classes is created,
+      updated or removed
+    """
 
-    def __init__(self, ttl=300):
-        self._cache = {}
+    def __init__(self, ttl=300, maxsize=128, depends_on=None):
         self.ttl = ttl
+        self.maxsize = maxsize
+        self.depends_on = depends_on or []
 
     def __call__(self, func):
-        def wraps(*args, **kwargs):
-            now = time.time()
-
-            # Use inspect.getcallargs so that we have all positional arguments
-            # with their respective names
-            args_dict = inspect.getcallargs(func, *args, **kwargs)
-            if len(args_dict) == len(args) + len(kwargs):
-                # This means all args and kwargs were converted to the named
-                # arguments, and we can use it as a key.
-                key = tuple(sorted(args_dict.items()))
-            else:
-                # otherwise, just use them separately
-                key = (args, tuple(sorted(kwargs.items())))
+        cache = _LRUCache('%s.%s' % (func.__module__, func.__name__),
+                          self.maxsize, self.ttl)
+        make_key = _get_key_builder(func)
 
-            try:
-                value, last_update = self._cache[key]
-                if self.ttl > 0 and now - last_update > self.ttl:
-                    raise AttributeError
-                return value
-            except (KeyError, AttributeError):
+        @functools.wraps(func)
+        def wraps(*args, **kwargs):
+            key = make_key(args, kwargs)
+            value = cache.get(key)
+            if value is _missing:
                 value = func(*args, **kwargs)
-                self._cache[key] = (value, now)
-                return value
+                cache.set(key, value)
+            return value
+
+        def invalidate(*args, **kwargs):
+            cache.invalidate(make_key(args, kwargs))
+
+        wraps.cache_info = cache.get_stats
+        wraps.cache_clear = cache.clear
+        wraps.invalidate = invalidate
+
+        _caches.add(cache)
+        for name in self.depends_on:
+            _dependent_caches.setdefault(name, weakref.WeakSet()).add(cache)
         return wraps
 
 
+def invalidate_dependent_caches(cls):
+    """Clears the caches of :class:`cached_function` depending on *cls*
+
+    This is called by the |domain| objects when they are created, updated
+    or removed.
+
+    :param cls: the class of the object that changed
+    """
+    if not _dependent_caches:
+        return
+    for klass in cls.__mro__:
+        for cache in list(_dependent_caches.get(klass.__name__, [])):
+            cache.clear()
+
+
+def get_cache_stats():
+    """Get the statistics of all the :class:`cached_function` caches
+
+    :returns: a dict mapping the name of the cached function to a dict
+      with its hits, misses, evictions and size
+    """
+    return dict((cache.name, cache.get_stats()) for cache in _caches)
+
+
 class public:
     """
     A decorator that is used to mark an API public.
@@ -22,8 +22,11 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
+import atexit
 import logging
+import os
 import sys
+import time
 import weakref
 
 from kiwi.python import ClassInittableObject, namedAny
@@ -32,6 +35,81 @@ log = logging.getLogger(__name__)
 # Returned when object is dead
 _dead = object()
 
+# Set STOQ_PROFILE_EVENTS=1 to profile the events and dump the
+# statistics when the process exits
+_profiling = False
+_stats = {}
+
+
+def enable_profiling():
+    """Start recording the number of calls and the time spent on each
+    event and callback. See :func:`get_event_stats`
+    """
+    global _profiling
+    _profiling = True
+
+
+def disable_profiling():
+    """Stop recording the event statistics. The statistics already
+    recorded are kept until :func:`reset_event_stats` is called
+    """
+    global _profiling
+    _profiling = False
+
+
+def is_profiling():
+    """If the event statistics are being recorded"""
+    return _profiling
+
+
+def reset_event_stats():
+    """Removes all the recorded event statistics"""
+    _stats.clear()
+
+
+def get_event_stats():
+    """Get the event statistics recorded while profiling was enabled
+
+    :returns: a dict mapping the event name to a dict with its ``calls``,
+      cumulative ``time`` (in seconds) and ``callbacks``, which maps
+      the callback name to a dict with its ``calls`` and ``time``
+    """
+    stats = {}
+    for name, (calls, total, callbacks) in _stats.items():
+        stats[name] = dict(
+            calls=calls, time=total,
+            callbacks=dict((cb_name, dict(calls=cb_calls, time=cb_time))
+                           for cb_name, (cb_calls, cb_time)
+                           in callbacks.items()))
+    return stats
+
+
+def dump_event_stats(fp=None):
+    """Write the event statistics as a table, slowest events first
+
+    :param fp: a file like object, defaults to ``sys.stderr``
+    """
+    if fp is None:
+        fp = sys.stderr
+    stats = get_event_stats()
+    events = sorted(stats.items(), key=lambda e: e[1]['time'], reverse=True)
+    fp.write('%-60s %10s %12s\n' % ('event/callback', 'calls', 'time'))
+    for name, event_stats in events:
+        fp.write('%-60s %10d %11.3fs\n' % (name, event_stats['calls'],
+                                          event_stats['time']))
+        callbacks = sorted(event_stats['callbacks'].items(),
+                           key=lambda c: c[1]['time'], reverse=True)
+        for cb_name, cb_stats in callbacks:
+            fp.write('  %-58s %10d %11.3fs\n' % (cb_name, cb_stats['calls'],
+                                                cb_stats['time']))
+
+
+def _get_callable_name(func, klass=None):
+    if klass is None:
+        return '%s.%s' % (getattr(func, '__module__', None),
+                          getattr(func, '__name__', repr(func)))
+    return '%s.%s.%s' % (klass.__module__, klass.__name__, func.__name__)
+
 
 class _CallbacksList(list):
     """List implementation for working with :class:`_WeakRef` objs"""
@@ -64,11 +142,14 @@ class _WeakRef(object):
             self.obj = weakref.ref(func.im_self)
             self.meth = weakref.ref(func.im_func)
             self.id = id(func.im_func)
+            self.name = _get_callable_name(func.im_func,
+                                           type(func.im_self))
         except AttributeError:
             # normal callable
             self.obj = None
             self.meth = weakref.ref(func)
             self.id = id(func)
+            self.name = _get_callable_name(func)
 
     def __eq__(self, other):
         if type(self) is not type(other):
@@ -105,6 +186,18 @@ class _WeakRef(object):
         return func(obj, *args, **kwargs)
 
 
+class _ClassMethodCallback(object):
+    """A classmethod connected using :meth:`Event.connect` as a decorator"""
+
+    def __init__(self, klass, func):
+        self.klass = klass
+        self.func = func
+        self.name = _get_callable_name(func, klass)
+
+    def __call__(self, *args, **kwargs):
+        return self.func(self.klass, *args, **kwargs)
+
+
 class Event(ClassInittableObject):
     """Base class for events"""
 
@@ -117,6 +210,9 @@ class Event(ClassInittableObject):
         # Also, using a list instead of a set to keep the order
         cls._callbacks_list = _CallbacksList()
         cls._lazy_callbacks = []
+        # A copy of _callbacks_list used by emit, so a callback can
+        # connect or disconnect while the event is being emitted
+        cls._callbacks = ()
 
     #
     #  Public API
@@ -142,18 +238,25 @@ class Event(ClassInittableObject):
 
     @classmethod
     def emit(cls, *args, **kwargs):
-        cls._resolve_lazy_callbacks()
+        if cls._lazy_callbacks:
+            cls._resolve_lazy_callbacks()
 
-        log.info('emitting event %s %r %r' % (cls.__name__,
-                                              args, kwargs))
-        rv_list = []
-        for callback in cls._callbacks_list:
-            rv = callback(*args, **kwargs)
-            if rv is _dead:
-                continue
-            # Insert in the beggining to pick the last
-            # return value which is not None
-            rv_list.insert(0, rv)
+        # Formatting the arguments is expensive, avoid it when not logging
+        if log.isEnabledFor(logging.INFO):
+            log.info('emitting event %s %r %r', cls.__name__, args, kwargs)
+
+        if _profiling:
+            rv_list = cls._emit_profiled(args, kwargs)
+        else:
+            rv_list = []
+            for callback in cls._callbacks:
+                rv = callback(*args, **kwargs)
+                if rv is _dead:
+                    cls._remove_callback(callback)
+                    continue
+                # Insert in the beggining to pick the last
+                # return value which is not None
+                rv_list.insert(0, rv)
 
         return cls.handle_return_values(rv_list)
 
@@ -179,10 +282,12 @@ class Event(ClassInittableObject):
 
         assert callback not in cls._callbacks_list
         cls._callbacks_list.append(callback)
+        cls._callbacks = tuple(cls._callbacks_list)
 
     @classmethod
     def disconnect(cls, callback):
         cls._callbacks_list.remove(_WeakRef(callback))
+        cls._callbacks = tuple(cls._callbacks_list)
 
     #
     #  Private
@@ -192,5 +297,38 @@ class Event(ClassInittableObject):
     def _resolve_lazy_callbacks(cls):
         for klass_string, func in cls._lazy_callbacks[:]:
             klass = namedAny(klass_string)
-            cls._callbacks_list.append(lambda *a, **kw: func(klass, *a, **kw))
+            cls._callbacks_list.append(_ClassMethodCallback(klass, func))
             cls._lazy_callbacks.remove((klass_string, func))
+        cls._callbacks = tuple(cls._callbacks_list)
+
+    @classmethod
+    def _remove_callback(cls, callback):
+        # The object/function the callback refers to is dead
+        if callback in cls._callbacks_list:
+            list.remove(cls._callbacks_list, callback)
+        cls._callbacks = tuple(cls._callbacks_list)
+
+    @classmethod
+    def _emit_profiled(cls, args, kwargs):
+        calls, total, callback_stats = _stats.get(cls.__name__, (0, 0, {}))
+        start = time.time()
+        rv_list = []
+        for callback in cls._callbacks:
+            cb_start = time.time()
+            rv = callback(*args, **kwargs)
+            cb_calls, cb_time = callback_stats.get(callback.name, (0, 0))
+            callback_stats[callback.name] = (cb_calls + 1,
+                                             cb_time + time.time() - cb_start)
+            if rv is _dead:
+                cls._remove_callback(callback)
+                continue
+            rv_list.insert(0, rv)
+
+        _stats[cls.__name__] = (calls + 1, total + time.time() - start,
+                                callback_stats)
+        return rv_list
+
+
+if os.environ.get('STOQ_PROFILE_EVENTS'):
+    enable_profiling()
+    atexit.register(dump_event_stats)
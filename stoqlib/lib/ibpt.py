@@ -27,21 +27,36 @@ IBPT - Instituto Brasileiro de Planejamento Tributário (Brazilian Institute
 of Tributary Planning)
 According to Law 12,741 of 12/08/2012 - Taxes in Coupon.
 """
+import csv
+import errno
+import logging
+import marshal
+import os
+import sys
+import time
 from collections import namedtuple
+from decimal import Decimal
 
 from kiwi.environ import environ
 
-import csv
-from decimal import Decimal
+from stoqlib.database.runtime import get_current_branch, get_default_store
+from stoqlib.lib.osutils import get_application_dir
 
-from stoqlib.database.runtime import get_current_branch, new_store
+log = logging.getLogger(__name__)
 
-taxes_data = {}
 TaxInfo = namedtuple('TaxInfo', 'nacionalfederal, importadosfederal, estadual,'
                      'fonte, chave')
 
+# Bump this when the format of the compiled tables change
+_COMPILED_FORMAT = 1
+# How often, in seconds, the csv files will be checked for a new version
+RELOAD_CHECK_INTERVAL = 300
+
+_tables = {}
+_branch_states = {}
 
-def load_taxes_csv():
+
+def load_taxes_csv(filename):
     """ Load the fields of IBPT table.
 
     - Fields:
@@ -58,35 +73,190 @@ def load_taxes_csv():
         - chave: Chave que associa a Tabela IBPT baixada com a empresa.
         - versao: Versão das alíquotas usadas para cálculo.
         - Fonte: Fonte
+
+    :param filename: the csv file to load
+    :returns: a tuple with the version of the table and a dict mapping
+      the ncm to another dict, mapping the ex to the tax values
     """
+    taxes = {}
+    version = None
+    with open(filename, 'r') as fp:
+        csv_file = csv.reader(fp, delimiter=';')
+        # Skip the header
+        next(csv_file, None)
+        for (ncm, ex, tipo, descricao, nacionalfederal, importadosfederal,
+             estadual, municipal, vigenciainicio, vigenciafim, chave,
+             versao, fonte) in csv_file:
+            # Ignore service codes (NBS - Nomenclatura Brasileira de Serviços)
+            if tipo == '1':
+                continue
+            version = versao
+            tax_dict = taxes.setdefault(ncm, {})
+            tax_dict[ex] = (nacionalfederal, importadosfederal, estadual,
+                            fonte, chave)
+    return version, taxes
+
 
-    # Avoid load taxes more than once.
-    if taxes_data:
-        return
+class IBPTTable(object):
+    """The IBPT taxes of a state
 
-    store = new_store()
-    branch = get_current_branch(store)
-    address = branch.person.get_main_address()
-    state = address.city_location.state
+    Parsing the csv files is slow, so the first time a table is loaded
+    it is compiled to a marshal file inside the application dir. The next
+    loads will use that file, unless the csv file was replaced by a new
+    version of the table.
 
-    filename = environ.get_resource_filename('stoq', 'csv', 'ibpt_tables',
-                                             'TabelaIBPTax%s.csv' % state)
-    csv_file = (csv.reader(open(filename, "r"), delimiter=';'))
+    Once loaded, the lookups are done in memory.
+
+    :param state: the state of the table, e.g. ``SP``
+    """
+
+    def __init__(self, state):
+        self.state = state
+        self.version = None
+        self.filename = environ.get_resource_filename(
+            'stoq', 'csv', 'ibpt_tables', 'TabelaIBPTax%s.csv' % state)
+        self._taxes = {}
+        self._source_key = None
+        self._last_check = 0
+
+    #
+    #  Public API
+    #
+
+    def load(self):
+        """Loads the table, from the compiled file when possible"""
+        source_key = self._get_source_key()
+        compiled = self._get_compiled_filename()
+        data = None
+        if compiled is not None:
+            data = self._load_compiled(compiled, source_key)
+        if data is None:
+            data = load_taxes_csv(self.filename)
+            if compiled is not None:
+                self._save_compiled(compiled, source_key, data)
+        self.version, taxes = data
+        self._taxes = dict(
+            (ncm, dict((ex, TaxInfo(*values)) for ex, values in options.items()))
+            for ncm, options in taxes.items())
+        self._source_key = source_key
+        self._last_check = time.time()
+        log.info('IBPT table for %s loaded: version %s, %d ncms' % (
+            self.state, self.version, len(self._taxes)))
+
+    def is_outdated(self):
+        """Checks if the csv file was replaced by a new version
+
+        The file is checked at most once every
+        :data:`RELOAD_CHECK_INTERVAL` seconds
+        """
+        now = time.time()
+        if now - self._last_check < RELOAD_CHECK_INTERVAL:
+            return False
+        self._last_check = now
+        return self._get_source_key() != self._source_key
+
+    def get_options(self, ncm):
+        """Get the taxes for an ncm
+
+        :param ncm: the ncm
+        :returns: a dict mapping the ex to a :class:`TaxInfo`
+        """
+        return self._taxes.get(ncm, {})
 
-    for (ncm, ex, tipo, descricao, nacionalfederal, importadosfederal,
-         estadual, municipal, vigenciainicio, vigenciafim, chave,
-         versao, fonte) in csv_file:
-        # Ignore service codes (NBS - Nomenclatura Brasileira de Serviços)
-        if tipo == '1':
-            continue
-        tax_dict = taxes_data.setdefault(ncm, {})
-        tax_dict[ex] = TaxInfo(nacionalfederal, importadosfederal, estadual,
-                               fonte, chave)
+    #
+    #  Private
+    #
+
+    def _get_source_key(self):
+        try:
+            st = os.stat(self.filename)
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            return None
+        return (st.st_mtime, st.st_size)
+
+    def _get_compiled_filename(self):
+        # The compiled table is just a cache, if the directory can't be
+        # created, the csv will be parsed every time
+        try:
+            directory = os.path.join(get_application_dir(), 'ibpt')
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+        except OSError as e:
+            log.warning('Could not create the IBPT tables directory: %s' % (
+                e, ))
+            return None
+        # marshal's format depends on the python version
+        return os.path.join(directory, 'TabelaIBPTax%s.py%d%d.bin' % (
+            (self.state, ) + sys.version_info[:2]))
+
+    def _load_compiled(self, compiled, source_key):
+        try:
+            with open(compiled, 'rb') as fp:
+                fmt, key, version, taxes = marshal.load(fp)
+        except (IOError, EOFError, ValueError, TypeError) as e:
+            log.info('Could not load compiled IBPT table %s: %s' % (
+                compiled, e))
+            return None
+        if fmt != _COMPILED_FORMAT or key != source_key:
+            return None
+        return version, taxes
+
+    def _save_compiled(self, compiled, source_key, data):
+        version, taxes = data
+        tmp = compiled + '.tmp'
+        try:
+            with open(tmp, 'wb') as fp:
+                marshal.dump((_COMPILED_FORMAT, source_key, version, taxes),
+                             fp)
+            # Rename is atomic, other processes will never see half a file
+            os.rename(tmp, compiled)
+        except (IOError, OSError) as e:
+            log.warning('Could not save compiled IBPT table %s: %s' % (
+                compiled, e))
+
+
+def get_taxes_table(state):
+    """Get the IBPT table for a state
+
+    The tables are loaded on demand and kept in memory, so deployments
+    with branches in several states only load the tables they use.
+    A table is reloaded when a new version of its csv is installed.
+
+    :param state: the state, e.g. ``SP``
+    :returns: an :class:`IBPTTable`
+    """
+    table = _tables.get(state)
+    if table is None or table.is_outdated():
+        table = IBPTTable(state)
+        table.load()
+        _tables[state] = table
+    return table
+
+
+def get_branch_state(branch):
+    """Get the state of a branch's main address
+
+    The state is cached, so this does not hit the database after the
+    first call for a given branch.
+
+    :param branch: a |branch|
+    :returns: the state, e.g. ``SP``
+    """
+    state = _branch_states.get(branch.id)
+    if state is None:
+        address = branch.person.get_main_address()
+        state = address.city_location.state
+        _branch_states[branch.id] = state
+    return state
 
 
 class IBPTGenerator(object):
-    def __init__(self, items):
-        load_taxes_csv()
+    def __init__(self, items, branch=None):
+        if branch is None:
+            branch = get_current_branch(get_default_store())
+        self.table = get_taxes_table(get_branch_state(branch))
         self.items = items
 
     def _format_ex(self, ex_tipi):
@@ -104,7 +274,7 @@ class IBPTGenerator(object):
         ncm = product.ncm or ''
         ex_tipi = self._format_ex(product.ex_tipi)
 
-        options = taxes_data.get(ncm, {})
+        options = self.table.get_options(ncm)
         n_options = len(options)
         if n_options == 0:
             tax_values = TaxInfo('0', '0', '0', '', '0')
@@ -171,6 +341,6 @@ class IBPTGenerator(object):
                                 source=source, key=key)
 
 
-def generate_ibpt_message(items):
-    generator = IBPTGenerator(items)
+def generate_ibpt_message(items, branch=None):
+    generator = IBPTGenerator(items, branch=branch)
     return generator.get_ibpt_message()
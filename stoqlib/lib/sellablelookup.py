@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""In-memory index used to find |sellables| by barcode, code or batch number
+
+Scanning a product on the POS used to do up to three sequential queries
+(barcode, code and batch number). This module keeps a per-station index of
+those strings so a scan can be resolved with dictionary lookups, only
+falling back to the database when the string is not known yet.
+"""
+
+import logging
+
+from storm.expr import And, Lower
+
+from stoqlib.domain.events import (SellableCreateEvent, SellableEditEvent,
+                                   SellableRemoveEvent)
+from stoqlib.domain.product import StorableBatch
+from stoqlib.domain.sellable import Sellable
+
+log = logging.getLogger(__name__)
+
+
+def _make_key(text):
+    if not text:
+        return None
+    return unicode(text).lower()
+
+
+class SellableLookupIndex(object):
+    """Resolves a scanned string to a (|sellable|, |batch|) tuple
+
+    The index maps lowercase barcodes, codes and batch numbers to ids.
+    The objects themselves are fetched with :meth:`Store.get`, which is
+    an identity map hit for objects already alive in the store.
+
+    The index is kept current by listening to the |sellable| domain events
+    while :meth:`.connect` is active. Entries are also validated on every
+    hit, so a stale entry (e.g. a barcode changed by another station) is
+    dropped and resolved again from the database.
+
+    :param store: the store used to fetch the |sellables| and |batches|
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._barcodes = {}
+        self._codes = {}
+        self._batches = {}
+        # sellable_id -> (barcode key, code key)
+        self._sellable_keys = {}
+        self._connected = False
+
+    #
+    #  Public API
+    #
+
+    def preload(self):
+        """Loads all |sellables| and |batches| into the index
+
+        This does only two queries and selects only the needed columns,
+        no domain objects are created.
+        """
+        self.clear()
+
+        sellables = self.store.find(
+            (Sellable.id, Sellable.barcode, Sellable.code))
+        for sellable_id, barcode, code in sellables:
+            self._add_sellable_keys(sellable_id, barcode, code)
+
+        # Storable and Product ids are the same as the Sellable one
+        batches = self.store.find(
+            (StorableBatch.id, StorableBatch.batch_number,
+             StorableBatch.storable_id))
+        for batch_id, batch_number, storable_id in batches:
+            key = _make_key(batch_number)
+            if key is not None:
+                self._batches[key] = (storable_id, batch_id)
+
+        log.info('sellable lookup index loaded: %d barcodes, %d codes, '
+                 '%d batches', len(self._barcodes), len(self._codes),
+                 len(self._batches))
+
+    def clear(self):
+        """Removes all the entries from the index"""
+        self._barcodes.clear()
+        self._codes.clear()
+        self._batches.clear()
+        self._sellable_keys.clear()
+
+    def connect(self):
+        """Start listening to |sellable| changes to keep the index current"""
+        if self._connected:
+            return
+        SellableCreateEvent.connect(self._on_SellableCreateEvent)
+        SellableEditEvent.connect(self._on_SellableEditEvent)
+        SellableRemoveEvent.connect(self._on_SellableRemoveEvent)
+        self._connected = True
+
+    def disconnect(self):
+        """Stop listening to |sellable| changes"""
+        if not self._connected:
+            return
+        SellableCreateEvent.disconnect(self._on_SellableCreateEvent)
+        SellableEditEvent.disconnect(self._on_SellableEditEvent)
+        SellableRemoveEvent.disconnect(self._on_SellableRemoveEvent)
+        self._connected = False
+
+    def update_sellable(self, sellable):
+        """Adds or updates the entries for the given sellable
+
+        :param sellable: a |sellable|
+        """
+        self.remove_sellable(sellable)
+        self._add_sellable_keys(sellable.id, sellable.barcode, sellable.code)
+
+    def remove_sellable(self, sellable):
+        """Removes the entries for the given sellable
+
+        :param sellable: a |sellable|
+        """
+        barcode, code = self._sellable_keys.pop(sellable.id, (None, None))
+        if self._barcodes.get(barcode) == sellable.id:
+            del self._barcodes[barcode]
+        if self._codes.get(code) == sellable.id:
+            del self._codes[code]
+
+    def lookup(self, text):
+        """Finds an available |sellable| by barcode, code or batch number
+
+        The same precedence of the old queries is kept: barcode first,
+        then code and finally batch number.
+
+        :param text: the barcode, code or batch number to look for
+        :returns: a (|sellable|, |batch|) tuple. Both will be ``None``
+            if nothing was found, and |batch| will be ``None`` if the
+            sellable was not found by its batch number
+        """
+        key = _make_key(text)
+        if key is None:
+            return None, None
+
+        for index, attr in [(self._barcodes, 'barcode'),
+                            (self._codes, 'code')]:
+            sellable = self._get_indexed_sellable(index, key, attr)
+            if sellable is not None and sellable.is_available():
+                return sellable, None
+
+        batch = self._get_indexed_batch(key)
+        if batch is not None:
+            return self._check_available(
+                self.store.get(Sellable, batch.storable_id), batch)
+
+        return self._lookup_database(key)
+
+    #
+    #  Private
+    #
+
+    def _add_sellable_keys(self, sellable_id, barcode, code):
+        barcode = _make_key(barcode)
+        code = _make_key(code)
+        if barcode is not None:
+            self._barcodes[barcode] = sellable_id
+        if code is not None:
+            self._codes[code] = sellable_id
+        self._sellable_keys[sellable_id] = (barcode, code)
+
+    def _get_indexed_sellable(self, index, key, attr):
+        sellable_id = index.get(key)
+        if sellable_id is None:
+            return None
+
+        sellable = self.store.get(Sellable, sellable_id)
+        # The entry may be stale if the sellable was modified or
+        # removed by another station. Drop it and let the database decide
+        if sellable is None or _make_key(getattr(sellable, attr)) != key:
+            del index[key]
+            return None
+        return sellable
+
+    def _get_indexed_batch(self, key):
+        ids = self._batches.get(key)
+        if ids is None:
+            return None
+
+        batch = self.store.get(StorableBatch, ids[1])
+        if batch is None or _make_key(batch.batch_number) != key:
+            del self._batches[key]
+            return None
+        return batch
+
+    def _check_available(self, sellable, batch):
+        if not sellable.is_available():
+            return None, None
+        return sellable, batch
+
+    def _lookup_database(self, key):
+        # The string is not in the index. It may have been created by
+        # another station after the index was loaded
+        query = Sellable.status == Sellable.STATUS_AVAILABLE
+        sellable = self.store.find(
+            Sellable, And(query, Lower(Sellable.barcode) == key)).one()
+        if sellable is None:
+            sellable = self.store.find(
+                Sellable, And(query, Lower(Sellable.code) == key)).one()
+        if sellable is not None:
+            self.update_sellable(sellable)
+            return sellable, None
+
+        batch = self.store.find(
+            StorableBatch, Lower(StorableBatch.batch_number) == key).one()
+        if batch is None:
+            return None, None
+
+        self._batches[key] = (batch.storable_id, batch.id)
+        return self._check_available(
+            self.store.get(Sellable, batch.storable_id), batch)
+
+    #
+    #  Callbacks
+    #
+
+    def _on_SellableCreateEvent(self, sellable):
+        self.update_sellable(sellable)
+
+    def _on_SellableEditEvent(self, sellable):
+        self.update_sellable(sellable)
+
+    def _on_SellableRemoveEvent(self, sellable):
+        self.remove_sellable(sellable)
@@ -21,12 +21,115 @@
 ##
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
-""" Templating """
+""" Templating
+
+Templates are compiled to python modules by mako. Since that is a lot
+slower than rendering them, the compiled templates are kept for the whole
+process by a shared :class:`mako.lookup.TemplateLookup` (and by a cache of
+the compiled template strings), and the modules of the template files are
+also cached on disk, being recompiled only when the template is modified.
+"""
+
+import collections
+import hashlib
+import logging
+import os
+import threading
 
 from kiwi.environ import environ
 from mako.lookup import TemplateLookup
 from mako.template import Template
 
+from stoqlib.lib.osutils import get_application_dir
+
+log = logging.getLogger(__name__)
+
+#: The maximum number of compiled templates strings kept in memory
+STRING_CACHE_SIZE = 50
+
+_TEMPLATE_OPTIONS = dict(output_encoding='utf8', input_encoding='utf8',
+                         default_filters=['h'])
+
+_lock = threading.Lock()
+_lookup = None
+_string_templates = collections.OrderedDict()
+
+
+def _get_key(text):
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.md5(text).hexdigest()
+
+
+def _get_module_directory(directories):
+    # Different installations (e.g. a checkout and a package) have
+    # different templates with the same names, don't mix their modules
+    key = _get_key(directories)[:8]
+    return os.path.join(get_application_dir(), 'templates', key)
+
+
+def get_template_lookup():
+    """Get the template lookup shared by the whole process
+
+    :returns: a :class:`mako.lookup.TemplateLookup` for the stoq
+      template directory
+    """
+    global _lookup
+    with _lock:
+        if _lookup is None:
+            directories = environ.get_resource_filename('stoq', 'template')
+            _lookup = TemplateLookup(
+                directories=directories,
+                module_directory=_get_module_directory(directories),
+                **_TEMPLATE_OPTIONS)
+        return _lookup
+
+
+def warmup_templates(filenames=None):
+    """Compiles the templates so rendering them later won't have to
+
+    The compiled modules are cached on disk, so this will only compile
+    the templates that were modified since the last time they were used.
+
+    :param filenames: the template filenames (relative to the template
+      directory) to compile. If ``None``, all the templates will be compiled
+    """
+    lookup = get_template_lookup()
+    if filenames is None:
+        filenames = list(iter_template_filenames())
+
+    for filename in filenames:
+        try:
+            lookup.get_template(filename)
+        except Exception:
+            # A broken template shouldn't break the startup, it will
+            # raise again when someone tries to render it
+            log.exception('Could not compile template %s' % (filename, ))
+
+
+def iter_template_filenames():
+    """Iterates over the filenames of all the html templates
+
+    :returns: the filenames, relative to the template directory
+    """
+    lookup = get_template_lookup()
+    for directory in lookup.directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            for filename in sorted(filenames):
+                if not filename.endswith('.html'):
+                    continue
+                path = os.path.relpath(os.path.join(dirpath, filename),
+                                       directory)
+                yield path.replace(os.sep, '/')
+
+
+def clear_template_cache():
+    """Forget all the compiled templates kept in memory"""
+    global _lookup
+    with _lock:
+        _lookup = None
+        _string_templates.clear()
+
 
 def render_template(filename, **ns):
     """Renders a template giving a filename and a keyword dictionary
@@ -34,12 +137,7 @@ def render_template(filename, **ns):
     @kwargs: keyword arguments to send to the template
     @return: the rendered template
     """
-    directories = environ.get_resource_filename('stoq', 'template')
-    lookup = TemplateLookup(directories=directories,
-                            output_encoding='utf8', input_encoding='utf8',
-                            default_filters=['h'])
-    tmpl = lookup.get_template(filename)
-
+    tmpl = get_template_lookup().get_template(filename)
     return tmpl.render(**ns)
 
 
@@ -49,6 +147,14 @@ def render_template_string(template, **ns):
     :param kwargs: keyword arguments to send to the template
     :return: the rendered template
     """
-    return Template(template,
-                    output_encoding='utf8', input_encoding='utf8',
-                    default_filters=['h']).render(**ns)
+    key = _get_key(template)
+    with _lock:
+        tmpl = _string_templates.pop(key, None)
+        if tmpl is None:
+            tmpl = Template(template, **_TEMPLATE_OPTIONS)
+        # Keep the most recently used ones in the end
+        _string_templates[key] = tmpl
+        while len(_string_templates) > STRING_CACHE_SIZE:
+            _string_templates.popitem(last=False)
+
+    return tmpl.render(**ns)
@@ -43,6 +43,25 @@ from stoqlib.reporting.boleto import BillReport
 from stoqlib.lib.unittestutils import get_tests_datadir
 
 
+class _SyncPool(object):
+    def __init__(self, processes):
+        pass
+
+    def apply_async(self, func, args):
+        result = mock.Mock()
+        result.get.return_value = func(*args)
+        return result
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
 class TestBillReport(DomainTest):
     def setUp(self):
         DomainTest.setUp(self)
@@ -185,6 +204,49 @@ class TestBillReport(DomainTest):
 
         self._diff(sale, 'boleto-001-carne')
 
+    @mock.patch('stoqlib.lib.boleto.localtoday')
+    def test_save_chunked(self, localtoday):
+        localtoday.return_value = datetime.date(2011, 05, 30)
+        sale = self._create_bill_sale(installments=5)
+        self._configure_boleto(u"001",
+                               account=u"5705853",
+                               agency=u"0531",
+                               carteira=u'06',
+                               especie_documento=u"DM")
+        progress = mock.Mock()
+        report = BillReport(self._filename, list(sale.payments),
+                            progress_callback=progress)
+        self.assertFalse(report.can_save_chunked())
+        report.chunk_size = 2
+        report.chunk_processes = 1
+
+        def merge_pdfs(filenames, output):
+            self.assertEqual(output, self._filename)
+            self.assertEqual([os.path.basename(f) for f in filenames],
+                             ['000000.pdf', '000001.pdf', '000002.pdf'])
+            for filename in filenames:
+                with open(filename) as f:
+                    self.assertEqual(f.read(4), '%PDF')
+
+        with mock.patch('stoqlib.reporting.boleto.multiprocessing.Pool',
+                        new=_SyncPool):
+            with mock.patch('stoqlib.reporting.boleto.merge_pdfs',
+                            side_effect=merge_pdfs) as merge:
+                report.save_chunked()
+        self.assertEqual(merge.call_count, 1)
+        self.assertEqual(progress.call_args_list,
+                         [mock.call(2, 5), mock.call(4, 5), mock.call(5, 5)])
+
+    def test_can_save_chunked_other_methods(self):
+        sale = self._create_bill_sale(installments=2)
+        money = PaymentMethod.get_by_name(self.store, u'money')
+        payments = list(sale.payments)
+        payments.extend(self.create_payment(method=money) for i in range(2))
+        report = BillReport(self._filename, payments)
+        # Only the 2 bills are rendered, not enough for a chunk
+        report.chunk_size = 2
+        self.assertFalse(report.can_save_chunked())
+
 
 class TestBank(BankInfo):
     description = 'Test Bank'
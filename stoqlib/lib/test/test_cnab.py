@@ -29,11 +29,18 @@ import os
 
 from stoqlib.lib.boleto import (BankInfo, custom_property, BILL_OPTION_CUSTOM,
                                 get_bank_info_by_number, BankItau)
-from stoqlib.lib.cnab.base import Record, Field
+from stoqlib.domain.payment.payment import Payment
+from stoqlib.lib.cnab.base import Record, Field, CnabException, parse_date
 from stoqlib.lib.cnab.bb import BBCnab
-from stoqlib.lib.cnab.febraban import FebrabanCnab, RecordP, RecordQ, RecordR
-from stoqlib.lib.cnab.itau400 import ItauCnab400, ItauPaymentDetail
+from stoqlib.lib.cnab.febraban import (FebrabanCnab, RecordP, RecordQ, RecordR,
+                                       RecordT, RecordU)
+from stoqlib.lib.cnab.itau400 import (ItauCnab400, ItauPaymentDetail,
+                                      ItauReturnDetail)
 from stoqlib.lib.cnab.itau import ItauBatchHeader, ItauCnab
+from stoqlib.lib.cnab.reconciliation import (BillReconciliation,
+                                             STATUS_PAID, STATUS_ALREADY_PAID,
+                                             STATUS_NOT_FOUND, STATUS_IGNORED,
+                                             STATUS_AMBIGUOUS)
 from stoqlib.lib.diffutils import diff_files
 from stoqlib.lib.unittestutils import get_tests_datadir
 from stoqlib.domain.test.domaintest import DomainTest
@@ -261,6 +268,200 @@ class TestCnab(DomainTest):
         self.assertEquals(cnab.as_string(), '00003\r\n')
 
 
+def _build_line(record_class, **values):
+    record = record_class()
+    for field in record._fields:
+        if field.name in values:
+            field.set_value(values[field.name])
+        elif field.default_value is not None:
+            field.set_value(field.default_value)
+        else:
+            field.set_value('' if field.type is str else 0)
+    return record.as_string()
+
+
+def _build_return_240(*bills):
+    lines = ['0' * 240]
+    for nosso_numero, movement_code, value, paid_value in bills:
+        lines.append(_build_line(RecordT, bank_number=1, segment='T',
+                                 movement_code=movement_code,
+                                 nosso_numero=nosso_numero, value=value))
+        lines.append(_build_line(RecordU, bank_number=1, segment='U',
+                                 movement_code=movement_code,
+                                 interest=Decimal('1.5'), discount=1,
+                                 abatimento=Decimal('0.5'),
+                                 paid_value=paid_value,
+                                 occurrence_date=10052015,
+                                 credit_date=11052015))
+    lines.append('9' * 240)
+    return '\r\n'.join(lines) + '\r\n'
+
+
+def _build_return_400(*bills):
+    lines = ['0' * 400]
+    for nosso_numero, movement_code, value, principal in bills:
+        lines.append(_build_line(ItauReturnDetail,
+                                 nosso_numero=nosso_numero,
+                                 codigo_ocorrencia=movement_code,
+                                 value=value, principal=principal,
+                                 interest=Decimal('1.5'),
+                                 discount=1, occurrence_date=100515,
+                                 credit_date=110515))
+    lines.append('9' * 400)
+    return '\r\n'.join(lines) + '\r\n'
+
+
+class TestReturnFile(DomainTest):
+    def test_parse_date(self):
+        self.assertEqual(parse_date('10052015'), datetime.date(2015, 5, 10))
+        self.assertEqual(parse_date('100515'), datetime.date(2015, 5, 10))
+        self.assertEqual(parse_date(1052015), datetime.date(2015, 5, 1))
+        self.assertIsNone(parse_date('00000000'))
+        self.assertIsNone(parse_date('      '))
+
+    def test_record_parse(self):
+        values = FooRecord().parse('00042')
+        self.assertEqual(values, {'foo': 42})
+        with self.assertRaises(CnabException):
+            FooRecord().parse('0004')
+        with self.assertRaises(CnabException):
+            FooRecord().parse('0004x')
+
+    def test_parse_return_240(self):
+        data = _build_return_240(('00000000000000000400', 6, 10, 11),
+                                 ('00000000000000000401', 2, 20, 0))
+        entries = FebrabanCnab.parse_return(data)
+        self.assertEqual(len(entries), 2)
+
+        entry = entries[0]
+        self.assertEqual(entry.nosso_numero, '00000000000000000400')
+        self.assertEqual(entry.line_number, 2)
+        self.assertEqual(entry.value, 10)
+        self.assertEqual(entry.paid_value, 11)
+        self.assertEqual(entry.interest, Decimal('1.5'))
+        self.assertEqual(entry.discount, Decimal('1.5'))
+        self.assertEqual(entry.paid_date, datetime.date(2015, 5, 10))
+        self.assertEqual(entry.credit_date, datetime.date(2015, 5, 11))
+        self.assertTrue(entry.paid)
+
+        self.assertEqual(entries[1].movement_code, 2)
+        self.assertFalse(entries[1].paid)
+
+    def test_parse_return_240_without_segment_t(self):
+        line = _build_line(RecordU, bank_number=1, segment='U')
+        with self.assertRaises(CnabException):
+            FebrabanCnab.parse_return(line)
+
+    def test_parse_return_400(self):
+        # The bank settled the first bill for less than value + interest -
+        # discount (10.5)
+        data = _build_return_400((400, 6, 10, Decimal('9.8')), (401, 2, 20, 0))
+        entries = ItauCnab400.parse_return(data)
+        self.assertEqual(len(entries), 2)
+
+        entry = entries[0]
+        self.assertEqual(entry.nosso_numero, '400')
+        self.assertEqual(entry.paid_value, Decimal('9.8'))
+        self.assertEqual(entry.paid_date, datetime.date(2015, 5, 10))
+        self.assertTrue(entry.paid)
+        self.assertFalse(entries[1].paid)
+        # Nothing was credited
+        self.assertIsNone(entries[1].paid_value)
+
+    def test_get_identifier(self):
+        info = get_bank_info_by_number(341)
+        self.assertEqual(info.get_identifier('00000400', {}), 400)
+        self.assertIsNone(info.get_identifier('xxx', {}))
+
+        info = get_bank_info_by_number(1)
+        self.assertEqual(info.get_identifier('1234567000000400',
+                                             {u'convenio': u'1234567'}), 400)
+
+        info = get_bank_info_by_number(104)
+        self.assertEqual(info.get_identifier('000000008000000400', {}), 400)
+
+
+class TestBillReconciliation(DomainTest):
+    def setUp(self):
+        super(TestBillReconciliation, self).setUp()
+        self.bank = self.create_bank_account(bank_branch=u'1102',
+                                             bank_account=u'12345',
+                                             bank_number=341)
+        self.method = self.get_payment_method(u'bill')
+        self.method.destination_account.bank = self.bank
+
+    def _create_payment(self, identifier):
+        payment = self.create_payment(payment_type=Payment.TYPE_IN,
+                                      method=self.method)
+        payment.identifier = identifier
+        payment.set_pending()
+        return payment
+
+    def _reconcile(self, data, **kwargs):
+        reconciliation = BillReconciliation(self.bank, data, **kwargs)
+        with mock.patch('stoqlib.lib.cnab.reconciliation.new_store') as ns:
+            ns.return_value = self.store
+            with mock.patch.object(self.store, 'commit'):
+                with mock.patch.object(self.store, 'rollback'):
+                    return reconciliation.reconcile()
+
+    def test_reconcile(self):
+        paid = self._create_payment(400)
+        self._create_payment(401)
+        already_paid = self._create_payment(402)
+        already_paid.pay()
+
+        data = _build_return_400((400, 6, 10, Decimal('9.8')),
+                                 (401, 2, 10, 0), (402, 6, 10, 10),
+                                 (499, 6, 10, 10))
+        summary = self._reconcile(data, batch_size=2)
+
+        self.assertEqual(
+            [r.identifier for r in summary.get_results(STATUS_PAID)], [400])
+        self.assertEqual(len(summary.get_results(STATUS_IGNORED)), 1)
+        self.assertEqual(len(summary.get_results(STATUS_ALREADY_PAID)), 1)
+        self.assertEqual(len(summary.get_results(STATUS_NOT_FOUND)), 1)
+        self.assertEqual(summary.get_paid_value(), Decimal('9.8'))
+
+        self.assertTrue(paid.is_paid())
+        self.assertEqual(paid.paid_value, Decimal('9.8'))
+        self.assertEqual(paid.interest, Decimal('1.5'))
+        self.assertEqual(paid.discount, 1)
+        self.assertEqual(paid.paid_date.date(), datetime.date(2015, 5, 10))
+
+        # Reconciling the same file again doesn't pay anything twice
+        summary = self._reconcile(data)
+        self.assertEqual(summary.get_results(STATUS_PAID), [])
+        self.assertEqual(len(summary.get_results(STATUS_ALREADY_PAID)), 2)
+
+    def test_reconcile_without_paid_value(self):
+        payment = self._create_payment(400)
+        summary = self._reconcile(_build_return_400((400, 6, 10, 0)))
+        # Payment.pay uses the value + interest - discount
+        self.assertEqual(payment.paid_value, Decimal('10.5'))
+        self.assertEqual(summary.get_paid_value(), Decimal('10.5'))
+
+    def test_reconcile_many_branches(self):
+        # The identifiers are only unique on each branch
+        payment = self._create_payment(400)
+        other = self.create_payment(payment_type=Payment.TYPE_IN,
+                                    method=self.method,
+                                    branch=self.create_branch(u'Other'))
+        other.identifier = 400
+        other.set_pending()
+        self._create_payment(401)
+
+        data = _build_return_400((400, 6, 10, 10), (401, 6, 10, 10))
+        summary = self._reconcile(data)
+        self.assertEqual(
+            [r.identifier for r in summary.get_results(STATUS_AMBIGUOUS)],
+            [400])
+        self.assertEqual(
+            [r.identifier for r in summary.get_results(STATUS_PAID)], [401])
+        self.assertTrue(payment.is_pending())
+        self.assertTrue(other.is_pending())
+
+
 class CnabTestMixin(object):
     cnab_class = BBCnab
 
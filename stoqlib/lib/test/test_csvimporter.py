@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+from cStringIO import StringIO
+
+import mock
+
+from stoqlib.database.bulkinsert import BulkInserter
+from stoqlib.domain.person import Client, Person, Supplier
+from stoqlib.domain.product import Product, ProductSupplierInfo
+from stoqlib.domain.sellable import Sellable
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.importers.clientimporter import ClientImporter
+from stoqlib.importers.productimporter import ProductImporter
+from stoqlib.importers.supplierimporter import SupplierImporter
+
+CLIENTS_CSV = """\
+% name, phone_number, mobile_number, email, rg, cpf,
+% city, country, state, street, streetnumber, district,
+Bulk Client 1,8653-7694,2482-1710,c1@example.com,5.251.375-B,160.618.061-40,Curitiba,Brazil,PR,Rua XV de Novembro,342,Centro
+Bulk Client 2,3123-4567,,c2@example.com,1.234.567-8,123.456.789-09,Curitiba,Brazil,PR,Rua das Flores,,Batel
+Bulk Client 3,3123-7654,9988-7766,,,,Curitiba,Brazil,PR,Rua Alameda,12,Centro
+"""
+
+SUPPLIERS_CSV = """\
+% name, phone_number, mobile_number, email, cnpj, state_registry,
+% city, country, state, street, streetnumber, district,
+Bulk Supplier 1,2904-8308,2004-9646,s1@example.com,51.583.509/0001-45,07503278200,Campinas,Brazil,SP,Rua das flores,1002,Vila Matilde
+Bulk Supplier 2,2904-1111,,s2@example.com,,,Campinas,Brazil,SP,Rua Sete,,Centro
+"""
+
+PRODUCTS_CSV = """\
+% base_category, barcode, category, description, price,
+% cost, commission, commission2, markup, markup2 [, unit]
+Bulk Bermudas,2368694135945,Bulk Bermudas Sarja,Bulk Bermuda Sarja,149,70,15,28,36,15
+Bulk Blusas,2368694135946,Bulk Blusas Polo,Bulk Blusa Polo,79.50,32.25,15,28,36,15
+"""
+
+
+class TestCSVImporterBulk(DomainTest):
+    def _import(self, importer, data, bulk, items=500):
+        importer.set_items_per_commit(items)
+        with mock.patch('stoqlib.importers.csvimporter.new_store',
+                        return_value=self.store):
+            with mock.patch('stoqlib.importers.importer.new_store',
+                            return_value=self.store):
+                with mock.patch.object(self.store, 'commit'):
+                    importer.feed(StringIO(data), 'test.csv')
+                    importer.process(bulk=bulk)
+
+    def _get_people(self, cls, name):
+        people = self.store.find(cls, cls.person_id == Person.id,
+                                 Person.name == name)
+        rows = []
+        for obj in people:
+            person = obj.person
+            address = person.get_main_address()
+            rows.append((person.phone_number, person.mobile_number,
+                         address.street, address.streetnumber,
+                         address.district, address.city_location))
+        return rows
+
+    def _get_products(self, description):
+        rows = []
+        for sellable in self.store.find(Sellable, description=description):
+            product = self.store.get(Product, sellable.id)
+            infos = self.store.find(ProductSupplierInfo, product=product)
+            rows.append((sellable.base_price, sellable.cost, sellable.barcode,
+                         sellable.code, sellable.category, sellable.unit,
+                         sellable.tax_constant_id, sellable.status,
+                         product.storable is not None,
+                         [(i.supplier, i.base_cost, i.is_main_supplier)
+                          for i in infos]))
+        return rows
+
+    def test_clients(self):
+        self._import(ClientImporter(), CLIENTS_CSV, bulk=False)
+        self._import(ClientImporter(), CLIENTS_CSV, bulk=True)
+
+        for i in range(1, 4):
+            rows = self._get_people(Client, u'Bulk Client %d' % (i, ))
+            # The same client imported by each path
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[0], rows[1])
+
+        clients = self.store.find(Client, Client.person_id == Person.id,
+                                  Person.name == u'Bulk Client 1')
+        for client in clients:
+            self.assertEqual(client.person.individual.cpf, u'160.618.061-40')
+            self.assertEqual(client.person.individual.rg_number,
+                             u'5.251.375-B')
+
+    def test_suppliers(self):
+        self._import(SupplierImporter(), SUPPLIERS_CSV, bulk=False)
+        self._import(SupplierImporter(), SUPPLIERS_CSV, bulk=True)
+
+        for i in range(1, 3):
+            rows = self._get_people(Supplier, u'Bulk Supplier %d' % (i, ))
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[0], rows[1])
+
+        suppliers = self.store.find(Supplier, Supplier.person_id == Person.id,
+                                    Person.name == u'Bulk Supplier 1')
+        for supplier in suppliers:
+            self.assertEqual(supplier.person.company.cnpj,
+                             u'51.583.509/0001-45')
+            self.assertEqual(supplier.person.company.fancy_name,
+                             u'Bulk Supplier 1')
+
+    def test_products(self):
+        self.create_supplier()
+        with mock.patch('stoqlib.importers.productimporter.get_default_store',
+                        return_value=self.store):
+            orm_importer = ProductImporter()
+            bulk_importer = ProductImporter()
+        bulk_importer.supplier = orm_importer.supplier
+        self._import(orm_importer, PRODUCTS_CSV, bulk=False)
+        self._import(bulk_importer, PRODUCTS_CSV, bulk=True)
+
+        for description in [u'Bulk Bermuda Sarja', u'Bulk Blusa Polo']:
+            rows = self._get_products(description)
+            self.assertEqual(len(rows), 2)
+            self.assertEqual(rows[0], rows[1])
+
+    def test_flush_before_commit(self):
+        calls = []
+        real_flush = BulkInserter.flush
+
+        def flush(inserter):
+            calls.append(('flush', len(inserter)))
+            return real_flush(inserter)
+
+        def commit(close=False):
+            calls.append('commit')
+
+        importer = ClientImporter()
+        importer.set_items_per_commit(2)
+        with mock.patch('stoqlib.importers.csvimporter.new_store',
+                        return_value=self.store):
+            with mock.patch('stoqlib.importers.importer.new_store',
+                            return_value=self.store):
+                with mock.patch.object(self.store, 'commit',
+                                       side_effect=commit):
+                    importer.feed(StringIO(CLIENTS_CSV), 'test.csv')
+                    del calls[:]
+                    with mock.patch.object(BulkInserter, 'flush', new=flush):
+                        importer.process(bulk=True)
+
+        # The first chunk only has the 2 comment lines, the second one has
+        # 2 clients and the last one has the remaining client. Each client
+        # is 4 rows: the person, individual, address and client
+        self.assertEqual(calls, [('flush', 0), 'commit',
+                                 ('flush', 8), 'commit',
+                                 ('flush', 4), 'commit',
+                                 'commit'])
+        self.assertEqual(
+            len(self._get_people(Client, u'Bulk Client 3')), 1)
+
+    def test_bulk_not_supported(self):
+        importer = ClientImporter()
+        importer.supports_bulk = False
+        with self.assertRaises(ValueError):
+            importer.process(bulk=True)
@@ -25,7 +25,8 @@
 import unittest
 import time
 
-from stoqlib.lib.decorators import cached_property, cached_function, threaded
+from stoqlib.lib.decorators import (cached_property, cached_function,
+                                    get_cache_stats, threaded)
 
 
 class TestDecorators(unittest.TestCase):
@@ -64,6 +65,10 @@ class TestDecorators(unittest.TestCase):
         time.sleep(1.1)
         self.assertEquals(foo.prop_ttl, 3)
 
+        Foo.prop.expire(foo)
+        self.assertEquals(foo.prop, 4)
+        self.assertEquals(foo.prop, 4)
+
     def test_cached_function(self):
         self.call_count = 0
 
@@ -129,6 +134,51 @@ class TestDecorators(unittest.TestCase):
         self.assertEquals(func_variable_args(1, 2, 4, foo=4, bar=5), (3, 2))
         self.assertEquals(self.call_count, 2)
 
+    def test_cached_function_maxsize(self):
+        self.call_count = 0
+
+        @cached_function(maxsize=2)
+        def func(arg):
+            self.call_count += 1
+            return arg
+
+        func(1)
+        func(2)
+        # 1 is now the most recently used, 2 should be evicted
+        func(1)
+        func(3)
+        self.assertEquals(self.call_count, 3)
+        func(1)
+        self.assertEquals(self.call_count, 3)
+        func(2)
+        self.assertEquals(self.call_count, 4)
+
+        self.assertEquals(func.cache_info(), dict(hits=2, misses=4,
+                                                  evictions=2, size=2,
+                                                  maxsize=2))
+        self.assertEquals(get_cache_stats()[__name__ + '.func'],
+                          func.cache_info())
+
+    def test_cached_function_invalidate(self):
+        self.call_count = 0
+
+        @cached_function()
+        def func(foo, bar=2):
+            self.call_count += 1
+            return (foo, bar)
+
+        func(1)
+        func(2)
+        func.invalidate(1, bar=2)
+        func(1, 2)
+        func(2)
+        self.assertEquals(self.call_count, 3)
+
+        func.cache_clear()
+        func(2)
+        self.assertEquals(self.call_count, 4)
+        self.assertEquals(func.cache_info()['size'], 1)
+
     def test_cached_function_ttl(self):
         self.call_count = 0
 
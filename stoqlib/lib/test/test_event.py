@@ -1,6 +1,9 @@
+import StringIO
 import unittest
 
-from stoqlib.lib.event import Event, _WeakRef
+from stoqlib.lib.event import (Event, _WeakRef, enable_profiling,
+                                disable_profiling, get_event_stats,
+                                reset_event_stats, dump_event_stats)
 
 
 class ReturnStatus:
@@ -127,3 +130,45 @@ class EventTest(unittest.TestCase):
         self.assertEqual(_WeakRef(xxx), _WeakRef(xxx))
         self.assertNotEqual(_WeakRef(xxx), _WeakRef(yyy))
         self.assertNotEqual(_WeakRef(xxx), zzz)
+
+    def test_dead_callback_removed(self):
+        class MyEvent(Event):
+            pass
+
+        MyEvent.connect(lambda: 666)
+        self.assertEqual(len(MyEvent._callbacks), 1)
+        MyEvent.emit()
+        self.assertEqual(len(MyEvent._callbacks), 0)
+        self.assertEqual(len(MyEvent._callbacks_list), 0)
+
+    def test_profiling(self):
+        class MyEvent(Event):
+            pass
+
+        obj = TestObject()
+        MyEvent.connect(obj.callback)
+        reset_event_stats()
+        enable_profiling()
+        try:
+            MyEvent.emit()
+            MyEvent.emit()
+        finally:
+            disable_profiling()
+        # Not recorded anymore
+        MyEvent.emit()
+
+        stats = get_event_stats()
+        self.assertEqual(stats['MyEvent']['calls'], 2)
+        callbacks = stats['MyEvent']['callbacks']
+        self.assertEqual(
+            callbacks.keys(),
+            ['stoqlib.lib.test.test_event.TestObject.callback'])
+        self.assertEqual(callbacks.values()[0]['calls'], 2)
+
+        fp = StringIO.StringIO()
+        dump_event_stats(fp)
+        self.assertTrue('MyEvent' in fp.getvalue())
+        self.assertTrue('TestObject.callback' in fp.getvalue())
+
+        reset_event_stats()
+        self.assertEqual(get_event_stats(), {})
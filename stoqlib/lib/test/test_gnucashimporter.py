@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+from cStringIO import StringIO
+import datetime
+from decimal import Decimal
+
+from stoqlib.domain.account import Account, AccountTransaction
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.importers.gnucashimporter import GnuCashXMLImporter
+
+
+GNUCASH_DATA = """<?xml version="1.0" encoding="utf-8" ?>
+<gnc-v2
+     xmlns:gnc="http://www.gnucash.org/XML/gnc"
+     xmlns:act="http://www.gnucash.org/XML/act"
+     xmlns:trn="http://www.gnucash.org/XML/trn"
+     xmlns:ts="http://www.gnucash.org/XML/ts"
+     xmlns:split="http://www.gnucash.org/XML/split">
+<gnc:book version="2.0.0">
+<gnc:account version="2.0.0">
+  <act:name>Root Account</act:name>
+  <act:id type="guid">root</act:id>
+  <act:type>ROOT</act:type>
+</gnc:account>
+<gnc:account version="2.0.0">
+  <act:name>GnuCash Checking</act:name>
+  <act:id type="guid">checking</act:id>
+  <act:type>BANK</act:type>
+  <act:code>1001</act:code>
+  <act:parent type="guid">root</act:parent>
+</gnc:account>
+<gnc:account version="2.0.0">
+  <act:name>GnuCash Salary</act:name>
+  <act:id type="guid">salary</act:id>
+  <act:type>INCOME</act:type>
+  <act:code>2001</act:code>
+  <act:parent type="guid">root</act:parent>
+</gnc:account>
+<gnc:transaction version="2.0.0">
+  <trn:num>42</trn:num>
+  <trn:date-posted>
+    <ts:date>2011-05-30 00:00:00 -0300</ts:date>
+  </trn:date-posted>
+  <trn:description>GnuCash Payday</trn:description>
+  <trn:splits>
+    <trn:split>
+      <split:value>150050/100</split:value>
+      <split:account type="guid">checking</split:account>
+    </trn:split>
+    <trn:split>
+      <split:value>-150050/100</split:value>
+      <split:account type="guid">salary</split:account>
+    </trn:split>
+  </trn:splits>
+</gnc:transaction>
+</gnc:book>
+</gnc-v2>
+"""
+
+
+class GnuCashXMLImporterTest(DomainTest):
+
+    def test_process(self):
+        importer = GnuCashXMLImporter()
+        importer.feed(StringIO(GNUCASH_DATA))
+        importer.set_dry(True)
+        importer.process(self.store)
+
+        checking = self.store.find(Account,
+                                   description=u'GnuCash Checking').one()
+        self.assertEquals(checking.account_type, Account.TYPE_BANK)
+        self.assertEquals(checking.code, u'1001')
+        salary = self.store.find(Account, description=u'GnuCash Salary').one()
+        self.assertEquals(salary.account_type, Account.TYPE_INCOME)
+
+        transaction = self.store.find(AccountTransaction,
+                                      description=u'GnuCash Payday').one()
+        self.assertEquals(transaction.account, checking)
+        self.assertEquals(transaction.source_account, salary)
+        self.assertEquals(transaction.code, u'42')
+        self.assertEquals(transaction.value, Decimal('1500.50'))
+        self.assertEquals(transaction.date, datetime.datetime(2011, 5, 30))
@@ -23,11 +23,17 @@
 ##
 
 from decimal import Decimal
+import os
+import shutil
+import tempfile
+
+import mock
 
 from stoqlib.database.runtime import get_current_branch
 from stoqlib.domain.taxes import ProductTaxTemplate, ProductIcmsTemplate
 from stoqlib.domain.test.domaintest import DomainTest
-from stoqlib.lib.ibpt import IBPTGenerator, generate_ibpt_message
+from stoqlib.lib.ibpt import (IBPTGenerator, IBPTTable, TaxInfo,
+                              generate_ibpt_message, get_taxes_table)
 
 
 class TestCalculateTaxForItem(DomainTest):
@@ -141,3 +147,61 @@ class TestCalculateTaxForItem(DomainTest):
         expected_federal_tax = total_item * (Decimal("21.45") / 100)
         federal = generator._calculate_federal_tax(sale_item, tax_values)
         self.assertEquals(federal, expected_federal_tax)
+
+
+class TestIBPTTable(DomainTest):
+    def setUp(self):
+        super(TestIBPTTable, self).setUp()
+        self.appdir = tempfile.mkdtemp()
+        patcher = mock.patch('stoqlib.lib.ibpt.get_application_dir',
+                             return_value=self.appdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.appdir)
+
+    def test_load(self):
+        table = IBPTTable('SP')
+        table.load()
+        self.assertEqual(table.get_options('01012100'),
+                         {'': TaxInfo('4.20', '6.20', '0.00', 'IBPT',
+                                      'W7m9E1')})
+        self.assertEqual(table.get_options('invalid'), {})
+
+    def test_load_compiled(self):
+        IBPTTable('SP').load()
+
+        table = IBPTTable('SP')
+        with mock.patch('stoqlib.lib.ibpt.load_taxes_csv') as load_taxes_csv:
+            table.load()
+            # The compiled table was used
+            self.assertFalse(load_taxes_csv.called)
+        self.assertEqual(table.get_options('01012100')[''].chave, 'W7m9E1')
+
+        # A new version of the csv was installed
+        table = IBPTTable('SP')
+        with mock.patch.object(table, '_get_source_key',
+                               return_value=(0, 0)):
+            with mock.patch('stoqlib.lib.ibpt.load_taxes_csv',
+                            return_value=('1', {})) as load_taxes_csv:
+                table.load()
+                self.assertTrue(load_taxes_csv.called)
+        self.assertEqual(table.version, '1')
+
+    def test_load_unwritable_dir(self):
+        with mock.patch('stoqlib.lib.ibpt.os.makedirs',
+                        side_effect=OSError(13, 'Permission denied')):
+            with mock.patch('stoqlib.lib.ibpt.get_application_dir',
+                            return_value=os.path.join(self.appdir, 'ro')):
+                table = IBPTTable('SP')
+                table.load()
+        self.assertEqual(table.get_options('01012100')[''].chave, 'W7m9E1')
+        self.assertEqual(os.listdir(self.appdir), [])
+
+    @mock.patch('stoqlib.lib.ibpt._tables', {})
+    def test_get_taxes_table(self):
+        table = get_taxes_table('SP')
+        self.assertIs(get_taxes_table('SP'), table)
+        self.assertIsNot(get_taxes_table('RJ'), table)
+
+        with mock.patch.object(table, 'is_outdated', return_value=True):
+            self.assertIsNot(get_taxes_table('SP'), table)
@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+from stoqlib.domain.events import SellableEditEvent, SellableRemoveEvent
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.lib.sellablelookup import SellableLookupIndex
+
+
+class TestSellableLookupIndex(DomainTest):
+    def _create_index(self):
+        index = SellableLookupIndex(self.store)
+        index.preload()
+        return index
+
+    def test_lookup_barcode(self):
+        sellable = self.create_sellable()
+        sellable.barcode = u'ABC123'
+        index = self._create_index()
+        self.assertEqual(index.lookup(u'abc123'), (sellable, None))
+        self.assertEqual(index.lookup(u'ABC123'), (sellable, None))
+
+    def test_lookup_code(self):
+        sellable = self.create_sellable(code=u'XCODE')
+        index = self._create_index()
+        self.assertEqual(index.lookup(u'xcode'), (sellable, None))
+
+    def test_lookup_barcode_before_code(self):
+        by_barcode = self.create_sellable()
+        by_barcode.barcode = u'COMMON'
+        self.create_sellable(code=u'COMMON')
+        index = self._create_index()
+        self.assertEqual(index.lookup(u'common'), (by_barcode, None))
+
+    def test_lookup_batch(self):
+        storable = self.create_storable(is_batch=True)
+        batch = self.create_storable_batch(storable, batch_number=u'LOT-1')
+        index = self._create_index()
+        self.assertEqual(index.lookup(u'lot-1'),
+                         (storable.product.sellable, batch))
+
+    def test_lookup_not_available(self):
+        sellable = self.create_sellable()
+        sellable.barcode = u'CLOSED'
+        sellable.close()
+        index = self._create_index()
+        self.assertEqual(index.lookup(u'CLOSED'), (None, None))
+
+    def test_lookup_not_found(self):
+        index = self._create_index()
+        self.assertEqual(index.lookup(u''), (None, None))
+        self.assertEqual(index.lookup(u'does-not-exist'), (None, None))
+
+    def test_lookup_not_indexed(self):
+        index = self._create_index()
+        # Created after the index was loaded, should come from the database
+        sellable = self.create_sellable()
+        sellable.barcode = u'NEW'
+        self.assertFalse(u'new' in index._barcodes)
+        self.assertEqual(index.lookup(u'new'), (sellable, None))
+        # And now it is indexed
+        self.assertEqual(index._barcodes[u'new'], sellable.id)
+
+    def test_stale_entry(self):
+        sellable = self.create_sellable()
+        sellable.barcode = u'OLD'
+        index = self._create_index()
+        sellable.barcode = u'NEW'
+        self.assertEqual(index.lookup(u'old'), (None, None))
+        self.assertEqual(index.lookup(u'new'), (sellable, None))
+
+    def test_events(self):
+        sellable = self.create_sellable()
+        sellable.barcode = u'OLD'
+        index = self._create_index()
+        index.connect()
+        try:
+            sellable.barcode = u'NEW'
+            SellableEditEvent.emit(sellable)
+            self.assertEqual(index._barcodes.get(u'new'), sellable.id)
+            self.assertFalse(u'old' in index._barcodes)
+
+            SellableRemoveEvent.emit(sellable)
+            self.assertFalse(u'new' in index._barcodes)
+        finally:
+            index.disconnect()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+
+import codecs
+import csv
+import datetime
+import os
+import tempfile
+import zipfile
+
+from kiwi.currency import currency
+from kiwi.ui.objectlist import Column
+import mock
+
+from stoqlib.domain.sellable import Sellable
+from stoqlib.domain.test.domaintest import DomainTest
+from stoqlib.exporters.streamexporter import (StreamExporter, XLSXWriter,
+                                              ExportColumn, FORMAT_CSV)
+
+
+class _Fruit(object):
+    def __init__(self, name, price, date):
+        self.name = name
+        self.price = price
+        self.date = date
+
+
+class TestStreamExporter(DomainTest):
+    def setUp(self):
+        super(TestStreamExporter, self).setUp()
+        for code, description in [(u'S1', u'Apple'),
+                                  (u'S2', u'Pineapple'),
+                                  (u'S3', u'Kiwi')]:
+            self.create_sellable(description=description, code=code,
+                                 price=currency('12.50'))
+        self.resultset = self.store.find(
+            Sellable, Sellable.code.is_in([u'S1', u'S2', u'S3'])).order_by(
+                Sellable.code)
+        self.columns = [
+            Column('code', title='Code', data_type=str),
+            Column('description', title='Description', data_type=str,
+                   format_func=lambda d: d.upper()),
+            Column('base_price', title='Price', data_type=currency)]
+
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+
+    def tearDown(self):
+        if os.path.exists(self.filename):
+            os.unlink(self.filename)
+        super(TestStreamExporter, self).tearDown()
+
+    def test_export_columns(self):
+        column = ExportColumn(Column('price', title='Price',
+                                     data_type=currency))
+        fruit = _Fruit(u'Apple', currency(4), datetime.date(2015, 1, 2))
+        self.assertFalse(column.formatted)
+        self.assertEqual(column.get_value(fruit), currency(4))
+
+        column = ExportColumn(Column('name', title='Name', data_type=str,
+                                     format_func=lambda n: n.upper()))
+        self.assertTrue(column.formatted)
+        self.assertEqual(column.get_value(fruit), u'APPLE')
+
+    def test_export_csv(self):
+        exporter = StreamExporter(self.resultset, self.columns,
+                                  file_format=FORMAT_CSV, fetch_size=2)
+        self.assertEqual(exporter.export(self.filename), 3)
+
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(len(codecs.BOM_UTF8)), codecs.BOM_UTF8)
+            rows = list(csv.reader(fp))
+        self.assertEqual(rows, [['Code', 'Description', 'Price'],
+                                ['S1', 'APPLE', '12.50'],
+                                ['S2', 'PINEAPPLE', '12.50'],
+                                ['S3', 'KIWI', '12.50']])
+
+    def test_export_xlsx(self):
+        exporter = StreamExporter(self.resultset, self.columns,
+                                  name=u'Sellables')
+        self.assertEqual(exporter.export(self.filename), 3)
+
+        xlsx = zipfile.ZipFile(self.filename)
+        self.assertIn('Sellables', xlsx.read('xl/workbook.xml'))
+        sheet = xlsx.read('xl/worksheets/sheet1.xml')
+        self.assertEqual(sheet.count('<row '), 4)
+        self.assertIn('<t xml:space="preserve">PINEAPPLE</t>', sheet)
+        # The price is written as a number, with the number style
+        self.assertIn('<c r="C2" s="%d"><v>12.50</v>' % (
+            XLSXWriter.STYLE_NUMBER, ), sheet)
+
+    def test_export_progress(self):
+        progress = mock.Mock()
+        exporter = StreamExporter(self.resultset, self.columns)
+        with mock.patch('stoqlib.exporters.streamexporter.PROGRESS_INTERVAL',
+                        2):
+            exporter.export(self.filename, progress_callback=progress)
+        self.assertEqual(progress.call_args_list,
+                         [mock.call(2, 3), mock.call(3, 3)])
+
+    def test_export_cancel(self):
+        exporter = StreamExporter(self.resultset, self.columns)
+        with mock.patch('stoqlib.exporters.streamexporter.PROGRESS_INTERVAL',
+                        1):
+            self.assertIsNone(exporter.export(
+                self.filename,
+                progress_callback=lambda exported, total: exporter.cancel()))
+        self.assertTrue(exporter.cancelled)
+        self.assertFalse(os.path.exists(self.filename))
+
+    def test_save(self):
+        exporter = StreamExporter(self.resultset, self.columns)
+        temporary = exporter.save(prefix='sellables')
+        try:
+            self.assertTrue(os.path.basename(temporary.name).startswith(
+                'Stoq-sellables-'))
+            self.assertTrue(temporary.name.endswith('.xlsx'))
+            self.assertTrue(zipfile.is_zipfile(temporary.name))
+        finally:
+            temporary.close()
+            os.unlink(temporary.name)
+
+    def test_start(self):
+        finish = mock.Mock()
+        exporter = StreamExporter(self.resultset, self.columns,
+                                  file_format=FORMAT_CSV)
+        with mock.patch('stoqlib.exporters.streamexporter.threadit',
+                        new=lambda func: func()):
+            with mock.patch('stoqlib.exporters.streamexporter.'
+                            'schedule_in_main_thread',
+                            new=lambda func, *args: func(*args)):
+                exporter.start(finish, filename=self.filename)
+        finish.assert_called_once_with(self.filename, None)
+
+    def test_invalid_format(self):
+        with self.assertRaises(ValueError):
+            StreamExporter(self.resultset, self.columns, file_format='ods')
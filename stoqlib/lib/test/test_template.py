@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU Lesser General Public License
+## as published by the Free Software Foundation; either version 2
+## of the License, or (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU Lesser General Public License for more details.
+##
+## You should have received a copy of the GNU Lesser General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+from mako.template import Template
+
+from stoqlib.lib import template
+from stoqlib.lib.template import (clear_template_cache, get_template_lookup,
+                                  iter_template_filenames,
+                                  render_template_string, warmup_templates)
+
+
+class TemplateTest(unittest.TestCase):
+    def setUp(self):
+        self.appdir = tempfile.mkdtemp()
+        patcher = mock.patch('stoqlib.lib.template.get_application_dir',
+                             return_value=self.appdir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.appdir)
+        clear_template_cache()
+        self.addCleanup(clear_template_cache)
+
+    def test_get_template_lookup(self):
+        lookup = get_template_lookup()
+        self.assertIs(get_template_lookup(), lookup)
+        self.assertTrue(lookup.module_directory.startswith(self.appdir))
+
+        clear_template_cache()
+        self.assertIsNot(get_template_lookup(), lookup)
+
+    def test_warmup_templates(self):
+        warmup_templates(['objectlist.html'])
+        lookup = get_template_lookup()
+        # The compiled module was cached on disk
+        modules = []
+        for dirpath, dirnames, filenames in os.walk(lookup.module_directory):
+            modules.extend(filenames)
+        self.assertIn('objectlist.html.py', modules)
+
+        # And the template is not compiled again when rendering
+        with mock.patch.object(lookup, '_load') as load:
+            lookup.get_template('objectlist.html')
+        self.assertEqual(load.call_count, 0)
+
+    def test_iter_template_filenames(self):
+        filenames = list(iter_template_filenames())
+        self.assertIn('objectlist.html', filenames)
+        self.assertIn('sale/sale.html', filenames)
+
+    def test_render_template_string(self):
+        with mock.patch('stoqlib.lib.template.Template',
+                        wraps=Template) as template_class:
+            for i in range(3):
+                self.assertEqual(
+                    render_template_string(u'foo ${ bar }', bar=i),
+                    'foo %d' % (i, ))
+            # Only compiled once
+            self.assertEqual(template_class.call_count, 1)
+
+    def test_render_template_string_cache_size(self):
+        with mock.patch.object(template, 'STRING_CACHE_SIZE', 2):
+            for text in [u'a', u'b', u'c']:
+                render_template_string(text)
+            with mock.patch('stoqlib.lib.template.Template',
+                            wraps=Template) as template_class:
+                # b and c are in the cache, a is not anymore
+                render_template_string(u'c')
+                render_template_string(u'b')
+                self.assertEqual(template_class.call_count, 0)
+                render_template_string(u'a')
+                self.assertEqual(template_class.call_count, 1)
@@ -23,7 +23,15 @@
 # This is mostly lifted from
 # http://code.google.com/p/pyboleto licensed under MIT
 
+import collections
+import contextlib
+import logging
+import multiprocessing
+import os
+import platform
+import shutil
 import sys
+import tempfile
 import traceback
 
 from reportlab.graphics.barcode.common import I2of5
@@ -36,8 +44,68 @@ from stoqlib.lib.crashreport import collect_traceback
 from stoqlib.lib.boleto import BoletoException, get_bank_info_by_number
 from stoqlib.lib.message import warning
 from stoqlib.lib.translation import stoqlib_gettext
+from stoqlib.reporting.utils import merge_pdfs
 
 _ = stoqlib_gettext
+log = logging.getLogger(__name__)
+
+
+@contextlib.contextmanager
+def _report_errors():
+    try:
+        yield
+    except (BoletoException, ValueError):
+        exc = sys.exc_info()
+        tb_str = ''.join(traceback.format_exception(*exc))
+        collect_traceback(exc, submit=True)
+        raise ReportError(tb_str)
+
+
+def _write_bills(bills, format, filename):
+    # This is called on the worker processes of BillReport.save_chunked
+    pdf = BoletoPDF(filename, format)
+    for bill in bills:
+        pdf.add_data(bill)
+    pdf._render_bill()
+    pdf.save()
+    return filename
+
+
+class BillData(object):
+    """The data drawn on a bill by :class:`BoletoPDF`
+
+    Everything needed from the database is fetched here, so the bill can
+    be pickled and drawn on another process.
+
+    :param bank_info: the :class:`stoqlib.lib.boleto.BankInfo` of the payment
+    """
+
+    def __init__(self, bank_info):
+        payment = bank_info.payment
+        self.payment_value = payment.value
+        self.payment_identifier = str(payment.identifier)
+        self.open_date = payment.open_date
+        self.due_date = payment.due_date
+
+        branch = bank_info.branch
+        address = branch.person.get_main_address()
+        self.branch_name = branch.get_description()
+        self.branch_address = '{}, {}'.format(address.get_address_string(),
+                                              address.get_details_string())
+        self.branch_cnpj = branch.person.company.cnpj
+
+        address = bank_info.payer.get_main_address()
+        self.payer_name = bank_info.payer.name
+        self.payer_address = address.get_address_string()
+        self.payer_address_details = address.get_details_string()
+
+        self.nosso_numero = bank_info.format_nosso_numero()
+        for attr in ['aceite', 'agencia_conta', 'barcode', 'carteira',
+                     'codigo_dv_banco', 'data_processamento', 'demonstrativo',
+                     'especie', 'especie_documento', 'instrucoes',
+                     'linha_digitavel', 'local_pagamento', 'logo_image_path',
+                     'quantidade', 'valor']:
+            setattr(self, attr, getattr(bank_info, attr))
 
 
 class BoletoPDF(object):
@@ -126,17 +194,17 @@ class BoletoPDF(object):
         self.pdfCanvas.setFont('Helvetica', 9)
         heighFont = 9 + 1
 
-        valorDocumento = self._format_value(boletoDados.payment.value)
+        valorDocumento = self._format_value(boletoDados.payment_value)
 
         self.pdfCanvas.drawString(
             self.space,
             (((linhaInicial + 0) * self.heightLine)) + self.space,
-            boletoDados.format_nosso_numero())
+            boletoDados.nosso_numero)
 
         self.pdfCanvas.drawString(
             self.widthCanhoto - (35 * mm) + self.space,
             (((linhaInicial + 0) * self.heightLine)) + self.space,
-            boletoDados.payment.due_date.strftime('%d/%m/%Y'))
+            boletoDados.due_date.strftime('%d/%m/%Y'))
         self.pdfCanvas.drawString(
             self.space,
             (((linhaInicial + 1) * self.heightLine)) + self.space,
@@ -315,7 +383,7 @@ class BoletoPDF(object):
         self.pdfCanvas.drawString(
             0 + self.space,
             (((linhaInicial + 1) * self.heightLine)) + self.space,
-            boletoDados.branch.get_description())
+            boletoDados.branch_name)
         self.pdfCanvas.drawString(
             self.width - (35 * mm) - (30 * mm) - (40 * mm) + self.space,
             (((linhaInicial + 1) * self.heightLine)) + self.space,
@@ -323,41 +391,39 @@ class BoletoPDF(object):
         self.pdfCanvas.drawString(
             self.width - (35 * mm) - (30 * mm) + self.space,
             (((linhaInicial + 1) * self.heightLine)) + self.space,
-            boletoDados.payment.open_date.strftime('%d/%m/%Y'))
+            boletoDados.open_date.strftime('%d/%m/%Y'))
         self.pdfCanvas.drawString(
             self.width - (35 * mm) + self.space,
             (((linhaInicial + 1) * self.heightLine)) + self.space,
-            boletoDados.payment.due_date.strftime('%d/%m/%Y'))
+            boletoDados.due_date.strftime('%d/%m/%Y'))
 
         # Valores da linha Endereço
         # Endereço
-        address = boletoDados.branch.person.get_main_address()
         self.pdfCanvas.drawString(
             0 + self.space,
             (((linhaInicial + 0) * self.heightLine)) + self.space,
-            '{}, {}'.format(address.get_address_string(),
-                            address.get_details_string()))
+            boletoDados.branch_address)
         # CNPJ
         self.pdfCanvas.drawString(
             self.width - (35 * mm) + self.space,
             (((linhaInicial + 0) * self.heightLine)) + self.space,
-            boletoDados.branch.person.company.cnpj)
+            boletoDados.branch_cnpj)
 
         # Valores da linha Sacado
-        valorDocumento = self._format_value(boletoDados.payment.value)
+        valorDocumento = self._format_value(boletoDados.payment_value)
 
         self.pdfCanvas.drawString(
             0 + self.space,
             (((linhaInicial - 1) * self.heightLine)) + self.space,
-            boletoDados.payer.name[:80])
+            boletoDados.payer_name[:80])
         self.pdfCanvas.drawString(
             self.width - (35 * mm) - (30 * mm) - (40 * mm) + self.space,
             (((linhaInicial - 1) * self.heightLine)) + self.space,
-            boletoDados.format_nosso_numero())
+            boletoDados.nosso_numero)
         self.pdfCanvas.drawString(
             self.width - (35 * mm) - (30 * mm) + self.space,
             (((linhaInicial - 1) * self.heightLine)) + self.space,
-            str(boletoDados.payment.identifier))
+            boletoDados.payment_identifier)
         self.pdfCanvas.drawString(
             self.width - (35 * mm) + self.space,
             (((linhaInicial - 1) * self.heightLine)) + self.space,
@@ -426,14 +492,13 @@ class BoletoPDF(object):
         self.pdfCanvas.setLineWidth(2)
         self._horizontalLine(0, y, self.width)
 
-        address = boletoDados.payer.get_main_address()
         self.pdfCanvas.setFont('Helvetica', self.fontSizeValue)
         self.pdfCanvas.drawString(15 * mm, (y - 10),
-                                  boletoDados.payer.name[:80])
+                                  boletoDados.payer_name[:80])
         self.pdfCanvas.drawString(15 * mm, (y - 10) - (1 * self.deltaFont),
-                                  address.get_address_string()[:80])
+                                  boletoDados.payer_address[:80])
         self.pdfCanvas.drawString(15 * mm, (y - 10) - (2 * self.deltaFont),
-                                  address.get_details_string()[:80])
+                                  boletoDados.payer_address_details[:80])
 
         self.pdfCanvas.setFont('Helvetica', self.fontSizeTitle)
 
@@ -545,7 +610,7 @@ class BoletoPDF(object):
             ((30 + 20 + 20 + 20 + 20) * mm) + self.space,
             y + self.space,
             valor)
-        valorDocumento = self._format_value(boletoDados.payment.value)
+        valorDocumento = self._format_value(boletoDados.payment_value)
         self.pdfCanvas.drawRightString(
             self.width - 2 * self.space,
             y + self.space,
@@ -588,11 +653,11 @@ class BoletoPDF(object):
         self.pdfCanvas.drawString(
             0,
             y + self.space,
-            boletoDados.payment.open_date.strftime('%d/%m/%Y'))
+            boletoDados.open_date.strftime('%d/%m/%Y'))
         self.pdfCanvas.drawString(
             (30 * mm) + self.space,
             y + self.space,
-            str(boletoDados.payment.identifier))
+            boletoDados.payment_identifier)
         self.pdfCanvas.drawString(
             ((30 + 40) * mm) + self.space,
             y + self.space,
@@ -608,7 +673,7 @@ class BoletoPDF(object):
         self.pdfCanvas.drawRightString(
             self.width - 2 * self.space,
             y + self.space,
-            boletoDados.format_nosso_numero())
+            boletoDados.nosso_numero)
         self.pdfCanvas.setFont('Helvetica', self.fontSizeTitle)
 
         # Linha horizontal com primeiro campo Beneficiário
@@ -622,7 +687,7 @@ class BoletoPDF(object):
 
         self.pdfCanvas.setFont('Helvetica', self.fontSizeValue)
         self.pdfCanvas.drawString(0, y + self.space,
-                                  boletoDados.branch.get_description())
+                                  boletoDados.branch_name)
         self.pdfCanvas.drawRightString(
             self.width - 2 * self.space,
             y + self.space,
@@ -649,7 +714,7 @@ class BoletoPDF(object):
         self.pdfCanvas.drawRightString(
             self.width - 2 * self.space,
             y + self.space,
-            boletoDados.payment.due_date.strftime('%d/%m/%Y'))
+            boletoDados.due_date.strftime('%d/%m/%Y'))
         self.pdfCanvas.setFont('Helvetica', self.fontSizeTitle)
 
         # Linha grossa com primeiro campo logo tipo do banco
@@ -732,13 +797,8 @@ class BoletoPDF(object):
         self.boletos.append(data)
 
     def render(self):
-        try:
+        with _report_errors():
             self._render_bill()
-        except (BoletoException, ValueError):
-            exc = sys.exc_info()
-            tb_str = ''.join(traceback.format_exception(*exc))
-            collect_traceback(exc, submit=True)
-            raise ReportError(tb_str)
 
     #
     #   Private API
@@ -804,9 +864,32 @@ class BoletoPDF(object):
 class BillReport(object):
     title = _('Bill')
 
-    def __init__(self, filename, payments):
+    #: The title of the progress dialog displayed by
+    #: :func:`stoqlib.gui.utils.printing.print_report` while the bills
+    #: are rendered, which is passed as the *progress_callback*
+    progress_title = _('Rendering the bills')
+
+    #: When there are more bills than this, :meth:`.save` will render
+    #: them in chunks of this many bills, see :meth:`.save_chunked`.
+    #: ``None`` disables that. It should be even, since the carnê has
+    #: two bills on each page
+    chunk_size = 200
+
+    #: The number of processes used to render the chunks. If ``None``,
+    #: the number of cpus will be used
+    chunk_processes = None
+
+    def __init__(self, filename, payments, progress_callback=None):
+        """
+        :param filename: the filename to save the bills
+        :param payments: the |payments| to print the bills for
+        :param progress_callback: a callable receiving the number of
+          bills rendered so far and the total number of bills
+        """
         self._payments = payments
         self._filename = filename
+        self._progress_callback = progress_callback
+        self._bank_info_classes = {}
         self._bill = self._get_bill()
 
     @classmethod
@@ -858,29 +941,111 @@ class BillReport(object):
             self.print_as_landscape = True
         return BoletoPDF(self._filename, format)
 
+    def _get_bill_payments(self):
+        return [p for p in self._payments if p.method.method_name == 'bill']
+
+    def _get_bill_data(self, payment):
+        account = payment.method.destination_account
+        # All the payments usually go to the same account, don't look
+        # for its bank for each one of them
+        bank_info_class = self._bank_info_classes.get(account.id)
+        if bank_info_class is None:
+            bank_info_class = get_bank_info_by_number(account.bank.bank_number)
+            self._bank_info_classes[account.id] = bank_info_class
+        return BillData(bank_info_class(payment))
+
+    def _notify_progress(self, rendered, total):
+        if self._progress_callback is not None:
+            self._progress_callback(rendered, total)
+
     def add_payments(self):
         if self._bill.boletos:
             return
 
-        for p in self._payments:
-            if p.method.method_name != 'bill':
-                continue
-            account = p.method.destination_account
-            _render_class = get_bank_info_by_number(account.bank.bank_number)
-            data = _render_class(p)
-            self._bill.add_data(data)
+        payments = self._get_bill_payments()
+        with _report_errors():
+            for i, p in enumerate(payments, 1):
+                self._bill.add_data(self._get_bill_data(p))
+                self._notify_progress(i, len(payments))
+
+    def can_save_chunked(self):
+        """If there are enough bills to be saved in chunks
+
+        That also needs poppler and cairo (used to merge the chunks)
+        """
+        if (self.chunk_size is None or
+                len(self._get_bill_payments()) <= self.chunk_size):
+            return False
+        # The worker processes need fork(), which windows doesn't have
+        if platform.system() == 'Windows':
+            return False
+        try:
+            import cairo
+            import poppler
+            cairo, poppler  # pylint: disable=W0104
+        except ImportError:
+            return False
+        return True
 
     def save(self):
+        if self.can_save_chunked():
+            self.save_chunked()
+            return
+
         self.add_payments()
         self._bill.render()
         self._bill.save()
 
+    def save_chunked(self):
+        """Saves the bills rendering them in chunks, in parallel
+
+        The data of the bills is fetched on this process, in order, and
+        each chunk of :attr:`.chunk_size` bills is drawn on a pool of
+        processes, each one writing a pdf file, which are merged in the end.
+        """
+        payments = self._get_bill_payments()
+        total = len(payments)
+        processes = self.chunk_processes or multiprocessing.cpu_count()
+        tmpdir = tempfile.mkdtemp(prefix='stoqlib-reporting-')
+        pool = multiprocessing.Pool(processes)
+        try:
+            filenames = []
+            pending = collections.deque()
+            rendered = 0
+            with _report_errors():
+                for i, start in enumerate(range(0, total, self.chunk_size)):
+                    chunk = payments[start:start + self.chunk_size]
+                    bills = [self._get_bill_data(p) for p in chunk]
+                    filename = os.path.join(tmpdir, '%06d.pdf' % (i, ))
+                    pending.append((len(bills), pool.apply_async(
+                        _write_bills, (bills, self._bill.format, filename))))
+                    # Don't let the bills pile up in memory
+                    while len(pending) >= processes * 2:
+                        count, result = pending.popleft()
+                        filenames.append(result.get())
+                        rendered += count
+                        self._notify_progress(rendered, total)
+                while pending:
+                    count, result = pending.popleft()
+                    filenames.append(result.get())
+                    rendered += count
+                    self._notify_progress(rendered, total)
+            pool.close()
+
+            log.info('rendered %d bills in %d chunks' % (total,
+                                                         len(filenames)))
+            merge_pdfs(filenames, self._filename)
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
 
 class BillTestReport(object):
     def __init__(self, filename, data):
         self.title = _("Bill")
         self._bill = BoletoPDF(filename, BoletoPDF.FORMAT_BOLETO)
-        self._bill.add_data(data)
+        self._bill.add_data(BillData(data))
 
     def save(self):
         self._bill.render()
@@ -106,7 +106,7 @@ class BookletReport(HTMLReport):
         demonstrative = []
         sale = payment.group.sale
         if sale:
-            items = sale.get_items()
+            items = list(sale.get_items().prefetch('sellable'))
             has_decimal = any([item.quantity - int(item.quantity) != 0
                                for item in items])
             for item in sorted(items,
@@ -64,12 +64,11 @@ class FinancialIntervalReport(object):
         self.store = store
         self.year = year
 
-    def _prepare_items(self, items, account, start, end):
-        total = account.get_total_for_interval(start, end)
-        items.append((account.description, total))
+    def _prepare_items(self, items, account, totals):
+        items.append((account.description, totals[account.id]))
 
         for child in Account.get_children_for(self.store, parent=account):
-            self._prepare_items(items, child, start, end)
+            self._prepare_items(items, child, totals)
 
     def get_data(self):
         sheets = {}
@@ -80,7 +79,9 @@ class FinancialIntervalReport(object):
             columns = []
             for start, end in get_month_intervals_for_year(self.year):
                 column = []
-                self._prepare_items(column, account, start, end)
+                totals = Account.get_totals_for_interval(
+                    self.store, start, end, root=account)
+                self._prepare_items(column, account, totals)
                 columns.append(column)
 
             # Skip empty sheets
@@ -20,8 +20,13 @@
 ## Author(s): Stoq Team <stoq-devel@async.com.br>
 ##
 
+import collections
+import logging
+import multiprocessing
 import os
 import platform
+import shutil
+import tempfile
 
 import weasyprint
 
@@ -34,8 +39,26 @@ from stoqlib.lib.translation import stoqlib_gettext, stoqlib_ngettext
 from stoqlib.lib.formatters import (get_formatted_price, get_formatted_cost,
                                     format_quantity, format_phone_number,
                                     get_formatted_percentage)
-from stoqlib.reporting.utils import get_logo_data
+from stoqlib.reporting.utils import get_logo_data, merge_pdfs
 _ = stoqlib_gettext
+log = logging.getLogger(__name__)
+
+
+def _get_base_url():
+    template_dir = environ.get_resource_filename('stoq', 'template')
+    if platform.system() == 'Windows':
+        # FIXME: Figure out why this is breaking
+        # On windows, weasyprint is eating the last directory of the path
+        template_dir = os.path.join(template_dir, 'foobar')
+    return template_dir
+
+
+def _write_pdf(html, base_url, stylesheet, filename):
+    # This is called on the worker processes of TableReport.save_chunked
+    document = weasyprint.HTML(string=html, base_url=base_url).render(
+        stylesheets=[weasyprint.CSS(string=stylesheet)])
+    document.write_pdf(filename)
+    return filename
 
 
 class HTMLReport(object):
@@ -81,13 +104,8 @@ class HTMLReport(object):
         html.flush()
 
     def render(self, stylesheet=None):
-        template_dir = environ.get_resource_filename('stoq', 'template')
-        if platform.system() == 'Windows':
-            # FIXME: Figure out why this is breaking
-            # On windows, weasyprint is eating the last directory of the path
-            template_dir = os.path.join(template_dir, 'foobar')
         html = weasyprint.HTML(string=self.get_html(),
-                               base_url=template_dir)
+                               base_url=_get_base_url())
 
         return html.render(stylesheets=[weasyprint.CSS(string=stylesheet)])
 
@@ -139,6 +157,29 @@ class TableReport(HTMLReport):
     #:
     template_filename = "objectlist.html"
 
+    #: When there are more rows than this, :meth:`.save` will render the
+    #: report in chunks of this many rows, see :meth:`.save_chunked`.
+    #: ``None`` disables that
+    chunk_size = 2000
+
+    #: The number of processes used to render the chunks. If ``None``,
+    #: the number of cpus will be used
+    chunk_processes = None
+
+    #: If the report is being rendered in chunks. The template should not
+    #: add the page counter on the pages, since each chunk has its own one
+    is_chunked = False
+
+    #: If the chunk being rendered is the first one. The template should
+    #: only add the report header if it is
+    is_first_chunk = True
+
+    #: If the chunk being rendered is the last one. The template should
+    #: only add the summaries if it is
+    is_last_chunk = True
+
+    _chunk_rows = None
+
     def __init__(self, filename, data, title=None, blocked_records=0,
                  status_name=None, filter_strings=None, status=None):
         self.title = title or self.title
@@ -183,6 +224,79 @@ class TableReport(HTMLReport):
             self.accumulate(obj)
             yield self.get_row(obj)
 
+    def get_rows(self):
+        """Get the rows that should be rendered by the template
+
+        :returns: the rows of the chunk being rendered, or all the rows
+          (see :meth:`.get_data`) if not rendering in chunks
+        """
+        if self._chunk_rows is not None:
+            return self._chunk_rows
+        return self.get_data()
+
+    def can_save_chunked(self):
+        """If this report is big enough to be saved in chunks
+
+        That also needs poppler and cairo (used to merge the chunks)
+        """
+        if self.chunk_size is None or len(self.data) <= self.chunk_size:
+            return False
+        # The worker processes need fork(), which windows doesn't have
+        if platform.system() == 'Windows':
+            return False
+        try:
+            import cairo
+            import poppler
+            cairo, poppler  # pylint: disable=W0104
+        except ImportError:
+            return False
+        return True
+
+    def save(self):
+        if self.can_save_chunked():
+            self.save_chunked()
+        else:
+            super(TableReport, self).save()
+
+    def save_chunked(self):
+        """Saves the report rendering it in chunks, in parallel
+
+        Laying out a table with lots of rows takes a lot of time and memory.
+        This renders the html of :attr:`.chunk_size` rows at a time, and lays
+        them out on a pool of processes, each one writing a pdf file, which
+        are merged in the end.
+
+        The rows (and the summaries, using :meth:`.accumulate`) are still
+        computed on this process, in order. Only some chunks are rendered at
+        a time, so the memory used does not depend on the number of rows.
+        """
+        processes = self.chunk_processes or multiprocessing.cpu_count()
+        base_url = _get_base_url()
+        tmpdir = tempfile.mkdtemp(prefix='stoqlib-reporting-')
+        pool = multiprocessing.Pool(processes)
+        try:
+            filenames = []
+            pending = collections.deque()
+            for i, html in enumerate(self._iter_chunks_html()):
+                filename = os.path.join(tmpdir, '%06d.pdf' % (i, ))
+                pending.append(pool.apply_async(
+                    _write_pdf, (html, base_url, '', filename)))
+                # Don't let the html of the chunks pile up in memory
+                while len(pending) >= processes * 2:
+                    filenames.append(pending.popleft().get())
+            while pending:
+                filenames.append(pending.popleft().get())
+            pool.close()
+
+            log.info('rendered %d rows in %d chunks' % (len(self.data),
+                                                        len(filenames)))
+            page_label = u'%s %%(page)d %s %%(pages)d' % (_("Page"), _("of"))
+            merge_pdfs(filenames, self.filename, page_label=page_label)
+        finally:
+            pool.terminate()
+            pool.join()
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
     def accumulate(self, row):
         """This method is called once for each row in the report.
 
@@ -226,6 +340,32 @@ class TableReport(HTMLReport):
         """
         raise NotImplementedError
 
+    #
+    #  Private
+    #
+
+    def _iter_chunks_html(self):
+        self.is_chunked = True
+        try:
+            for i, (rows, is_last) in enumerate(self._iter_chunks()):
+                self._chunk_rows = rows
+                self.is_first_chunk = i == 0
+                self.is_last_chunk = is_last
+                yield self.get_html()
+        finally:
+            self._chunk_rows = None
+            self.is_chunked = False
+            self.is_first_chunk = self.is_last_chunk = True
+
+    def _iter_chunks(self):
+        chunk = []
+        for row in self.get_data():
+            if len(chunk) == self.chunk_size:
+                yield chunk, False
+                chunk = []
+            chunk.append(row)
+        yield chunk, True
+
 
 class ObjectListReport(TableReport):
     """Creates an pdf report from an objectlist and its current state
@@ -25,6 +25,8 @@
 
 import datetime
 from decimal import Decimal
+import os
+import tempfile
 
 import mock
 from nose.exc import SkipTest
@@ -50,6 +52,7 @@ from stoqlib.domain.views import (ProductFullStockView, SoldItemsByBranchView,
 from stoqlib.domain.workorder import WorkOrderView
 from stoqlib.gui.dialogs.tilldailymovement import TillDailyMovementDialog
 from stoqlib.lib.parameters import sysparam
+from stoqlib.lib.pdf import pdftohtml
 from stoqlib.reporting.paymentsreceipt import (InPaymentReceipt,
                                                OutPaymentReceipt)
 from stoqlib.reporting.callsreport import CallsReport
@@ -60,6 +63,7 @@ from stoqlib.reporting.payment import (BillCheckPaymentReport,
 from stoqlib.reporting.product import ProductReport, ProductPriceReport
 from stoqlib.reporting.production import ProductionOrderReport
 from stoqlib.reporting.purchase import PurchaseQuoteReport
+from stoqlib.reporting.report import TableReport
 from stoqlib.reporting.service import ServicePriceReport
 from stoqlib.reporting.sale import (SaleOrderReport, SalesPersonReport,
                                     SoldItemsByBranchReport)
@@ -618,3 +622,114 @@ class TestReport(ReportTest):
 
         self._diff_expected(WorkOrdersReport, 'workorders-report',
                             search.results, list(search.results))
+
+
+class _SyncPool(object):
+    # A multiprocessing.Pool running everything on this process
+    def __init__(self, processes):
+        pass
+
+    def apply_async(self, func, args):
+        result = mock.Mock()
+        result.get.return_value = func(*args)
+        return result
+
+    def close(self):
+        pass
+
+    def terminate(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class _NumbersReport(TableReport):
+    title = u'Numbers'
+    chunk_size = 2
+
+    def get_columns(self):
+        return [dict(title=u'Number', align='right')]
+
+    def get_row(self, obj):
+        return [u'number-%d' % (obj, )]
+
+    def reset(self):
+        self.total = 0
+
+    def accumulate(self, obj):
+        self.total += obj
+
+    def get_summary_row(self):
+        return [u'total-%d' % (self.total, )]
+
+
+class TestTableReport(ReportTest):
+    def test_iter_chunks_html(self):
+        report = _NumbersReport(None, [1, 2, 3, 4, 5])
+        chunks = list(report._iter_chunks_html())
+        self.assertEqual(len(chunks), 3)
+
+        for i, numbers in enumerate([[1, 2], [3, 4], [5]]):
+            for number in range(1, 6):
+                self.assertEqual('number-%d' % (number, ) in chunks[i],
+                                 number in numbers)
+        # The header only goes on the first chunk
+        self.assertIn('<header>', chunks[0])
+        self.assertNotIn('<header>', chunks[1])
+        # The summary only on the last one, with all the rows accumulated
+        self.assertNotIn('total-', chunks[1])
+        self.assertIn('total-15', chunks[2])
+        # The page counter is added when merging the chunks
+        self.assertNotIn('counter(pages)', chunks[0])
+
+        # The report is back to normal
+        self.assertFalse(report.is_chunked)
+        html = report.get_html()
+        self.assertIn('<header>', html)
+        self.assertIn('number-1', html)
+        self.assertIn('number-5', html)
+        self.assertIn('total-15', html)
+        self.assertIn('counter(pages)', html)
+
+    def test_save(self):
+        report = _NumbersReport(None, [1, 2])
+        self.assertFalse(report.can_save_chunked())
+
+        with mock.patch.object(report, 'can_save_chunked',
+                               return_value=True):
+            with mock.patch.object(report, 'save_chunked') as save_chunked:
+                report.save()
+        save_chunked.assert_called_once_with()
+
+    def test_save_chunked(self):
+        try:
+            import cairo
+            import poppler
+            cairo  # pylint: disable=W0104
+        except ImportError:
+            raise SkipTest('poppler and cairo are needed to merge the chunks')
+
+        filename = tempfile.mktemp(suffix='.pdf')
+        html = tempfile.mktemp(suffix='.html')
+        report = _NumbersReport(filename, [1, 2, 3, 4, 5])
+        try:
+            with mock.patch('stoqlib.reporting.report.multiprocessing.Pool',
+                            new=_SyncPool):
+                report.save_chunked()
+
+            document = poppler.document_new_from_file(
+                'file://' + filename, password="")
+            # One page for each chunk of 2 rows
+            self.assertEqual(document.get_n_pages(), 3)
+
+            # The chunks are labeled as pages of the same document
+            pdftohtml(filename, html)
+            with open(html) as f:
+                content = f.read()
+            for page in range(1, 4):
+                self.assertIn('Page %d of 3' % (page, ), content)
+        finally:
+            for name in [filename, html]:
+                if os.path.exists(name):
+                    os.unlink(name)
@@ -26,7 +26,10 @@
 
 import base64
 import logging
+import os
 import platform
+import urllib
+import urlparse
 
 from kiwi.environ import environ
 
@@ -41,6 +44,9 @@ _system = platform.system()
 log = logging.getLogger(__name__)
 # a list of programs to be tried when a report needs be viewed
 
+# The margin of the pages defined on base.css, in points
+_PAGE_MARGIN = 15 * 72 / 25.4
+
 
 def get_logo_data(store):
     logo_domain = sysparam.get_object(store, 'CUSTOM_LOGO_FOR_REPORTS')
@@ -109,3 +115,56 @@ def get_header_data():
             data['lines'].append(' - '.join(company_parts))
 
     return data
+
+
+def merge_pdfs(filenames, output, page_label=None):
+    """Merges some pdf files into a single one
+
+    The pages are drawn (as vectors) on the new file using poppler and
+    cairo, in the order of *filenames*.
+
+    :param filenames: the pdf files to merge
+    :param output: the filename of the resulting pdf
+    :param page_label: if not ``None``, a string with ``page`` and ``pages``
+      format keys (e.g. ``'Page %(page)d of %(pages)d'``) to be written
+      on the bottom right of each page. Useful when the files are parts of
+      the same document, since each one has its own page counter
+    """
+    import cairo
+    import poppler
+
+    documents = []
+    for filename in filenames:
+        uri = urlparse.urljoin(
+            'file:', urllib.pathname2url(os.path.abspath(filename)))
+        documents.append(poppler.document_new_from_file(uri, password=""))
+    pages = sum(document.get_n_pages() for document in documents)
+
+    surface = None
+    page_no = 0
+    for document in documents:
+        for i in range(document.get_n_pages()):
+            page = document.get_page(i)
+            width, height = page.get_size()
+            if surface is None:
+                surface = cairo.PDFSurface(output, width, height)
+            else:
+                surface.set_size(width, height)
+
+            cr = cairo.Context(surface)
+            page.render_for_printing(cr)
+            page_no += 1
+            if page_label is not None:
+                text = page_label % dict(page=page_no, pages=pages)
+                cr.select_font_face('sans-serif')
+                cr.set_font_size(8)
+                x_advance = cr.text_extents(text)[4]
+                cr.move_to(width - _PAGE_MARGIN - x_advance,
+                           height - _PAGE_MARGIN / 2)
+                cr.show_text(text)
+            cr.show_page()
+
+    if surface is not None:
+        surface.finish()
+    log.info('merged %d pdfs with %d pages on %s' % (
+        len(documents), pages, output))
@@ -0,0 +1,485 @@
+#!/usr/bin/env python
+# -*- Mode: Python; coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Benchmark the hot paths of Stoq on a generated dataset
+
+A dataset of the given scale is generated first: for each unit of scale,
+2 |branches|, 2000 |products| (with stock on every branch), 1000
+|clients| and 100 confirmed |sales| with their |payments|. The products
+and clients are created by the csv importers, using the ORM or, with
+``--bulk``, multi-row INSERTs.
+
+Then these are timed:
+
+ * pos_barcode_lookup_*: resolving a barcode as the POS does, with the
+   preloaded index and querying the database
+ * sale_confirm: confirming a sale with 3 items and its payments
+ * stock_search: a search on ProductFullStockView by description
+ * in_payment_search: the pending payments on InPaymentView
+ * report_rendering: the product price report, as a PDF
+ * import_*: importing clients and products from csv files
+
+The results are printed as JSON (or saved with ``--output``), so they can
+be compared with the ones of another version using ``--compare``.
+
+Everything is done in a transaction that is rolled back in the end,
+unless ``--commit-data`` is used, which commits the generated dataset, so
+it can be reused on the next runs with ``--skip-generate``. Run this on a
+database created for it, e.g. with ``stoqdbadmin init --demo``.
+Usage:
+
+    tools/benchmark-suite.py -d <dbname> [--scale 1] [--bulk]
+        [--runs 5] [--output results.json] [--compare old.json]
+"""
+
+import csv
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+from kiwi.component import provide_utility
+from storm.expr import Like
+
+import stoq
+from stoqlib.database.bulkinsert import BulkInserter
+from stoqlib.database.interfaces import ICurrentUser
+from stoqlib.database.runtime import get_current_branch, new_store
+from stoqlib.domain.exampledata import ExampleCreator
+from stoqlib.domain.payment.payment import Payment
+from stoqlib.domain.payment.views import InPaymentView
+from stoqlib.domain.person import Branch, Client, LoginUser
+from stoqlib.domain.product import (ProductStockItem, Storable,
+                                    StockTransactionHistory)
+from stoqlib.domain.sale import Sale
+from stoqlib.domain.sellable import Sellable
+from stoqlib.domain.views import ProductFullStockView
+from stoqlib.importers.clientimporter import ClientImporter
+from stoqlib.importers.productimporter import ProductImporter
+from stoqlib.lib.configparser import StoqConfig
+from stoqlib.lib.sellablelookup import SellableLookupIndex
+from stoqlib.reporting.product import ProductPriceReport
+
+from stoq.lib.options import get_option_parser
+from stoq.lib.startup import setup
+
+# The number of objects of each kind generated for each unit of scale
+_BRANCHES = 2
+_PRODUCTS = 2000
+_CLIENTS = 1000
+_SALES = 100
+
+_WORDS = [u'Coffee', u'Sugar', u'Rice', u'Beans', u'Soap', u'Shirt',
+          u'Shoes', u'Pencil', u'Notebook', u'Cable', u'Lamp', u'Chair']
+
+_PREFIX = u'Benchmark'
+
+
+def _write_csv(rows):
+    fd, filename = tempfile.mkstemp(suffix='.csv', prefix='stoq-benchmark-')
+    with os.fdopen(fd, 'w') as fp:
+        writer = csv.writer(fp)
+        for row in rows:
+            writer.writerow([unicode(v).encode('utf-8') for v in row])
+    return filename
+
+
+def _import(store, importer, rows, bulk):
+    filename = _write_csv(rows)
+    try:
+        importer.feed_file(filename)
+        # In dry mode, everything is done on the given store
+        importer.set_dry(True)
+        importer.process(store=store, bulk=bulk)
+    finally:
+        os.unlink(filename)
+
+
+def _get_product_rows(rng, start, count):
+    for i in range(start, start + count):
+        word = rng.choice(_WORDS)
+        price = rng.randint(100, 100000) / 100.0
+        yield [u'%s %s' % (_PREFIX, word),  # base_category
+               u'%013d' % (i, ),  # barcode
+               word,  # category
+               u'%s product %s %d' % (_PREFIX, word, i),  # description
+               price,
+               round(price * 0.6, 2),  # cost
+               5, 5, 40, 40]  # commissions and markups
+
+
+def _get_client_rows(rng, start, count):
+    for i in range(start, start + count):
+        yield [u'%s client %s %d' % (_PREFIX, rng.choice(_WORDS), i),
+               u'1633%06d' % (i % 1000000, ),  # phone
+               u'', u'', u'', u'',  # mobile, email, rg and cpf
+               u'São Carlos', u'Brazil', u'SP',
+               u'Street %d' % (i, ), i % 1000 + 1, u'Downtown']
+
+
+class DataGenerator(object):
+    """Generates the dataset of the benchmarks
+
+    :param store: the store where everything will be created
+    :param scale: the scale of the dataset, see the module docs
+    :param bulk: if the products and clients should be inserted in bulk
+    :param seed: the seed of the random choices
+    """
+
+    def __init__(self, store, scale=1, bulk=False, seed=0):
+        self.store = store
+        self.scale = scale
+        self.bulk = bulk
+        self.rng = random.Random(seed)
+        self.ec = ExampleCreator()
+        self.ec.set_store(store)
+        #: how long each step took, in seconds
+        self.timings = {}
+
+    def generate(self):
+        """Generates the dataset
+
+        :returns: a dict with the number of objects created by kind
+        """
+        counts = {}
+        for name, func, count in [
+                ('branches', self._create_branches, _BRANCHES),
+                ('products', self._create_products, _PRODUCTS),
+                ('clients', self._create_clients, _CLIENTS),
+                ('sales', self._create_sales, _SALES)]:
+            count = int(count * self.scale) or 1
+            start = time.time()
+            func(count)
+            self.store.flush()
+            self.timings[name] = time.time() - start
+            counts[name] = count
+        return counts
+
+    def _create_branches(self, count):
+        for i in range(count):
+            self.ec.create_branch(name=u'%s branch %d' % (_PREFIX, i))
+
+    def _create_products(self, count):
+        start = self.store.find(Sellable).count()
+        _import(self.store, ProductImporter(),
+                _get_product_rows(self.rng, start, count), self.bulk)
+
+        # Give them some stock on every branch
+        barcodes = [u'%013d' % (i, ) for i in range(start, start + count)]
+        storable_ids = list(self.store.find(
+            Sellable.id, Sellable.barcode.is_in(barcodes)))
+        branches = list(self.store.find(Branch))
+        if self.bulk:
+            # No StockTransactionHistory is created this way, but it is
+            # not used by the benchmarks
+            inserter = BulkInserter(self.store)
+            for storable_id in storable_ids:
+                for branch in branches:
+                    inserter.add(ProductStockItem, storable_id=storable_id,
+                                 branch_id=branch.id,
+                                 quantity=self.rng.randint(0, 1000),
+                                 stock_cost=10)
+            inserter.flush()
+            return
+
+        for storable_id in storable_ids:
+            storable = self.store.get(Storable, storable_id)
+            for branch in branches:
+                quantity = self.rng.randint(0, 1000)
+                if quantity:
+                    storable.increase_stock(
+                        quantity, branch,
+                        StockTransactionHistory.TYPE_INITIAL,
+                        object_id=None, unit_cost=10)
+
+    def _create_clients(self, count):
+        start = self.store.find(Client).count()
+        _import(self.store, ClientImporter(),
+                _get_client_rows(self.rng, start, count), self.bulk)
+
+    def _create_sales(self, count):
+        sellables = get_benchmark_sellables(self.store)
+        clients = list(self.store.find(Client).config(limit=1000))
+        salesperson = self.ec.create_sales_person()
+        for i in range(count):
+            sale = create_sale(self.ec, self.rng, sellables,
+                               self.rng.choice(clients), salesperson)
+            sale.confirm()
+
+
+def get_benchmark_sellables(store):
+    branch = get_current_branch(store)
+    return list(store.find(
+        Sellable,
+        Sellable.id == ProductStockItem.storable_id,
+        ProductStockItem.branch_id == branch.id,
+        ProductStockItem.quantity >= 10,
+        Like(Sellable.description, _PREFIX + u' product %')).config(
+            limit=1000))
+
+
+def create_sale(ec, rng, sellables, client, salesperson):
+    """Creates an ordered |sale| with 3 items and its payments"""
+    sale = ec.create_sale(client=client, salesperson=salesperson)
+    for sellable in rng.sample(sellables, 3):
+        sale.add_sellable(sellable, quantity=rng.randint(1, 3))
+    # Half of them paid with checks in installments, that stay pending
+    if rng.random() < 0.5:
+        ec.add_payments(sale, method_type=u'money')
+    else:
+        ec.add_payments(sale, method_type=u'check', installments=3)
+    sale.order()
+    return sale
+
+
+class BenchmarkSuite(object):
+    """Times the hot paths on the dataset
+
+    :param store: the store where the dataset is
+    :param runs: how many times the slower benchmarks should run
+    :param seed: the seed of the random choices
+    """
+
+    def __init__(self, store, runs=5, seed=0):
+        self.store = store
+        self.runs = runs
+        self.rng = random.Random(seed)
+        self.ec = ExampleCreator()
+        self.ec.set_store(store)
+        self.branch = get_current_branch(store)
+        self.sellables = get_benchmark_sellables(store)
+        self.results = {}
+
+    def run(self):
+        """Runs all the benchmarks
+
+        :returns: a dict with the results of each benchmark
+        """
+        for name in sorted(dir(self)):
+            if name.startswith('bench_'):
+                getattr(self, name)()
+                self.store.flush()
+        return self.results
+
+    def measure(self, name, func, runs, **extra):
+        """Times *func*, called *runs* times, and saves the results
+
+        :param name: the name of the benchmark
+        :param func: a callable receiving the number of the run
+        :param runs: the number of times to call *func*
+        :param extra: other information to save with the results
+        """
+        timings = []
+        for i in range(runs):
+            start = time.time()
+            func(i)
+            timings.append(time.time() - start)
+
+        timings.sort()
+        result = dict(extra)
+        result.update(runs=runs,
+                      total=sum(timings),
+                      mean=sum(timings) / runs,
+                      median=timings[runs // 2],
+                      min=timings[0],
+                      max=timings[-1])
+        self.results[name] = result
+        print >> sys.stderr, '%-35s %10.6fs (%d runs)' % (
+            name, result['mean'], runs)
+
+    def bench_barcode_lookup(self):
+        barcodes = [s.barcode for s in self.sellables]
+        runs = self.runs * 200
+
+        # A new index finds everything on the database
+        index = SellableLookupIndex(self.store)
+        self.measure('pos_barcode_lookup_database',
+                     lambda i: index.lookup(barcodes[i % len(barcodes)]),
+                     runs)
+
+        index = SellableLookupIndex(self.store)
+        self.measure('pos_barcode_index_preload',
+                     lambda i: index.preload(), self.runs)
+        self.measure('pos_barcode_lookup_index',
+                     lambda i: index.lookup(self.rng.choice(barcodes)),
+                     runs)
+
+    def bench_sale_confirm(self):
+        clients = list(self.store.find(Client).config(limit=100))
+        salesperson = self.ec.create_sales_person()
+        sales = [create_sale(self.ec, self.rng, self.sellables,
+                             self.rng.choice(clients), salesperson)
+                 for i in range(self.runs)]
+        self.store.flush()
+
+        def confirm(i):
+            sales[i].confirm()
+            self.store.flush()
+        self.measure('sale_confirm', confirm, self.runs)
+
+    def bench_stock_search(self):
+        def search(i):
+            word = _WORDS[i % len(_WORDS)]
+            results = ProductFullStockView.find_by_branch(
+                self.store, self.branch).find(
+                    Like(ProductFullStockView.description, u'%%%s%%' % word,
+                         case_sensitive=False))
+            results.count()
+            list(results.order_by(ProductFullStockView.description)[:50])
+        self.measure('stock_search', search, self.runs)
+
+    def bench_in_payment_search(self):
+        def search(i):
+            results = self.store.find(
+                InPaymentView, InPaymentView.status == Payment.STATUS_PENDING)
+            results.count()
+            list(results.order_by(InPaymentView.due_date)[:50])
+        self.measure('in_payment_search', search, self.runs)
+
+    def bench_report_rendering(self):
+        products = list(ProductFullStockView.find_by_branch(
+            self.store, self.branch).order_by(
+                ProductFullStockView.code)[:500])
+        branch_name = self.branch.get_description()
+
+        def render(i):
+            fd, filename = tempfile.mkstemp(suffix='.pdf')
+            os.close(fd)
+            try:
+                ProductPriceReport(filename, products,
+                                   branch_name=branch_name).save()
+            finally:
+                os.unlink(filename)
+        self.measure('report_rendering', render, self.runs,
+                     rows=len(products))
+
+    def bench_import(self):
+        rows = 200
+        start = self.store.find(Sellable).count()
+        for bulk in [False, True]:
+            suffix = '_bulk' if bulk else ''
+            self.measure(
+                'import_products' + suffix,
+                lambda i: _import(self.store, ProductImporter(),
+                                  _get_product_rows(self.rng, start, rows),
+                                  bulk),
+                1, rows=rows)
+            self.measure(
+                'import_clients' + suffix,
+                lambda i: _import(self.store, ClientImporter(),
+                                  _get_client_rows(self.rng, start, rows),
+                                  bulk),
+                1, rows=rows)
+            start += rows
+
+
+def _get_dataset_info(store):
+    return dict(
+        branches=store.find(Branch).count(),
+        sellables=store.find(Sellable).count(),
+        clients=store.find(Client).count(),
+        sales=store.find(Sale).count(),
+        payments=store.find(Payment).count())
+
+
+def _compare(old, new):
+    print >> sys.stderr
+    print >> sys.stderr, '%-35s %11s %11s %8s' % ('benchmark', 'old',
+                                                  'new', 'new/old')
+    for name in sorted(new['results']):
+        if name not in old['results']:
+            continue
+        old_mean = old['results'][name]['mean']
+        new_mean = new['results'][name]['mean']
+        print >> sys.stderr, '%-35s %10.6fs %10.6fs %8.2f' % (
+            name, old_mean, new_mean,
+            new_mean / old_mean if old_mean else 0)
+
+
+def main(args):
+    parser = get_option_parser()
+    parser.add_option('', '--scale', action="store", type="float",
+                      default=1, dest="scale")
+    parser.add_option('', '--bulk', action="store_true", default=False,
+                      dest="bulk")
+    parser.add_option('', '--runs', action="store", type="int",
+                      default=5, dest="runs")
+    parser.add_option('', '--seed', action="store", type="int",
+                      default=0, dest="seed")
+    parser.add_option('', '--skip-generate', action="store_true",
+                      default=False, dest="skip_generate")
+    parser.add_option('', '--commit-data', action="store_true",
+                      default=False, dest="commit_data")
+    parser.add_option('', '--output', action="store", dest="output")
+    parser.add_option('', '--compare', action="store", dest="compare")
+    options, args = parser.parse_args(args)
+
+    config = StoqConfig()
+    config.load_default()
+    setup(config, options, register_station=True, check_schema=False)
+
+    store = new_store()
+    user = store.find(LoginUser, username=u'admin').one()
+    provide_utility(ICurrentUser, user, replace=True)
+
+    output = dict(version=stoq.version,
+                  server_version=store.execute(
+                      'SHOW server_version').get_one()[0],
+                  scale=options.scale,
+                  bulk=options.bulk)
+    try:
+        if not options.skip_generate:
+            generator = DataGenerator(store, options.scale, options.bulk,
+                                      options.seed)
+            output['generated'] = generator.generate()
+            output['generate_timings'] = generator.timings
+            if options.commit_data:
+                store.commit(close=False)
+
+        output['dataset'] = _get_dataset_info(store)
+        if len(get_benchmark_sellables(store)) < 3:
+            raise SystemExit("There are no products to benchmark, "
+                             "generate them first")
+        suite = BenchmarkSuite(store, options.runs, options.seed)
+        output['results'] = suite.run()
+    finally:
+        store.rollback()
+
+    data = json.dumps(output, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as fp:
+            fp.write(data)
+    else:
+        print data
+
+    if options.compare:
+        with open(options.compare) as fp:
+            _compare(json.load(fp), output)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- Mode: Python; coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Benchmark the text searches done by the search dialogs
+
+This will insert a lot of |persons| and |sellables| (500k by default) and
+time StringQueryState searches on them, with and without the trigram
+indexes created by patch-05-46.sql.
+
+Everything is done in a single transaction that is rolled back in the end,
+but since the indexes are dropped during the benchmark, this should only be
+run on a test database. Usage:
+
+    tools/benchmark-text-search.py -d <dbname> [--rows 500000]
+"""
+
+import sys
+import time
+
+from kiwi.python import Settable
+
+from stoqlib.database.queryexecuter import QueryExecuter, StringQueryState
+from stoqlib.database.runtime import new_store
+from stoqlib.domain.person import Person
+from stoqlib.domain.sellable import Sellable
+from stoqlib.lib.configparser import StoqConfig
+
+from stoq.lib.options import get_option_parser
+from stoq.lib.startup import setup
+
+_WORDS = [u'parafuso', u'porca', u'arruela', u'martelo', u'chave',
+          u'alicate', u'serrote', u'trena', u'broca', u'lixa',
+          u'joão', u'maría', u'josé', u'antônio', u'conceição']
+
+_SEARCHES = [
+    (Person, [Person.name], u'joao silva'),
+    (Person, [Person.name], u'1234'),
+    (Sellable, [Sellable.description, Sellable.code, Sellable.barcode],
+     u'parafuso 99'),
+    (Sellable, [Sellable.description, Sellable.code, Sellable.barcode],
+     u'789123'),
+]
+
+_INDEXES = [
+    'person_name_normalized_trgm_idx',
+    'sellable_code_normalized_trgm_idx',
+    'sellable_barcode_normalized_trgm_idx',
+    'sellable_description_idx',
+    'sellable_description_normalized_idx',
+]
+
+
+def _populate(store, rows):
+    words = u"ARRAY[%s]" % u', '.join(u"'%s'" % w for w in _WORDS)
+    pick = u"(%s)[1 + (random() * %d)::int %% %d]" % (
+        words, len(_WORDS), len(_WORDS))
+    store.execute(u"""
+        INSERT INTO person (name)
+        SELECT %s || ' ' || %s || ' ' || i
+            FROM generate_series(1, %d) AS i""" % (pick, pick, rows))
+    store.execute(u"""
+        INSERT INTO sellable (description, code, barcode)
+        SELECT %s || ' ' || %s || ' ' || i, 'C' || i, (7890000000000 + i)::text
+            FROM generate_series(1, %d) AS i""" % (pick, pick, rows))
+    store.execute(u"ANALYZE person")
+    store.execute(u"ANALYZE sellable")
+
+
+def _time_searches(store, repeat):
+    results = []
+    for search_spec, columns, text in _SEARCHES:
+        search_filter = Settable()
+        executer = QueryExecuter(store)
+        executer.set_search_spec(search_spec)
+        executer.set_filter_columns(search_filter, columns)
+        state = StringQueryState(filter=search_filter, text=text,
+                                 mode=StringQueryState.CONTAINS_ALL)
+
+        timings = []
+        for i in range(repeat):
+            start = time.time()
+            count = executer.search([state]).count()
+            timings.append(time.time() - start)
+        results.append((search_spec.__name__, text, count, min(timings)))
+    return results
+
+
+def main(args):
+    parser = get_option_parser()
+    parser.add_option('', '--rows',
+                      action="store",
+                      type="int",
+                      default=500000,
+                      dest="rows")
+    parser.add_option('', '--repeat',
+                      action="store",
+                      type="int",
+                      default=3,
+                      dest="repeat")
+    options, args = parser.parse_args(args)
+
+    config = StoqConfig()
+    config.load_default()
+    setup(config, options, register_station=False, check_schema=False)
+
+    store = new_store()
+    try:
+        print 'Inserting %d persons and sellables...' % (options.rows, )
+        _populate(store, options.rows)
+
+        indexed = _time_searches(store, options.repeat)
+        for index in _INDEXES:
+            store.execute(u"DROP INDEX IF EXISTS %s" % (index, ))
+        not_indexed = _time_searches(store, options.repeat)
+    finally:
+        store.rollback()
+
+    print '%-10s %-15s %8s %12s %12s' % ('table', 'search', 'rows',
+                                         'indexed', 'seq scan')
+    for (name, text, count, t1), (_, _, _, t2) in zip(indexed, not_indexed):
+        print '%-10s %-15s %8d %11.3fs %11.3fs' % (name, text, count, t1, t2)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- Mode: Python; coding: utf-8 -*-
+# vi:si:et:sw=4:sts=4:ts=4
+
+##
+## Copyright (C) 2015 Async Open Source <http://www.async.com.br>
+## All rights reserved
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., or visit: http://www.gnu.org/.
+##
+## Author(s): Stoq Team <stoq-devel@async.com.br>
+##
+
+"""Benchmark the writes of domain objects with each transaction entry strategy
+
+This will create a lot of |persons| and |clients| (10k by default) using
+the ORM and flush them, then update all of them and flush again, first
+with the transaction entries allocated by StoqlibStore.flush (the default)
+and then with the ones created by the te_id column default, new_te().
+
+Everything is done in a transaction that is rolled back in the end.
+Usage:
+
+    tools/benchmark-transaction-entries.py -d <dbname> [--rows 10000]
+"""
+
+import sys
+import time
+
+from stoqlib.database.runtime import new_store
+from stoqlib.domain.person import Client, Person
+from stoqlib.lib.configparser import StoqConfig
+
+from stoq.lib.options import get_option_parser
+from stoq.lib.startup import setup
+
+
+def _time_writes(store, rows):
+    start = time.time()
+    clients = []
+    for i in range(rows):
+        person = Person(store=store, name=u'Benchmark person %d' % (i, ))
+        clients.append(Client(store=store, person=person))
+    store.flush()
+    inserts = time.time() - start
+
+    start = time.time()
+    for client in clients:
+        client.person.name += u' updated'
+        client.credit_limit = 100
+    store.flush()
+    updates = time.time() - start
+
+    return inserts, updates
+
+
+def main(args):
+    parser = get_option_parser()
+    parser.add_option('', '--rows',
+                      action="store",
+                      type="int",
+                      default=10000,
+                      dest="rows")
+    options, args = parser.parse_args(args)
+
+    config = StoqConfig()
+    config.load_default()
+    setup(config, options, register_station=False, check_schema=False)
+
+    results = []
+    for batch in [True, False]:
+        store = new_store()
+        store.batch_transaction_entries = batch
+        try:
+            inserts, updates = _time_writes(store, options.rows)
+        finally:
+            store.rollback()
+        results.append(('batch' if batch else 'new_te()', inserts, updates))
+
+    # Each row written is a person and a client
+    rows = options.rows * 2
+    print '%-10s %12s %12s %12s' % ('strategy', 'inserts', 'updates',
+                                    'inserts/s')
+    for name, inserts, updates in results:
+        print '%-10s %11.3fs %11.3fs %12d' % (name, inserts, updates,
+                                               rows / inserts)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))